@@ -14,35 +14,135 @@ Predicts whether the datapoint is anomaly or not.
 # print('============\ncwd after change to script dir is %s' %(os.getcwd()))
 
 import numpy as np
-import pickle
+from typing import Tuple
 
-from anomaly_detection.ngsy import BooleanAttr, FloatAttr
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.model import ModelProvider
+from anomaly_detection.ngsy import BooleanAttr, FloatAttr, TextAttr
 from anomaly_detection.ngsy import RawReading, MachineEntity, AnomalyDetectionEntity
 
-ANOMALY_MODEL_PATH_FROM_ROOT = 'data/anomaly_detection.pkl'
 
+provider = ModelProvider.from_config()
 
-with open(ANOMALY_MODEL_PATH_FROM_ROOT, 'rb') as open_file:
-    model = pickle.load(open_file)
 
+def warm_up():
+    provider.warm_up()
+    provider.start()
 
-def predict(machine: MachineEntity) -> AnomalyDetectionEntity:
-    label = predict_anomaly(machine)
-    #print(label)
 
-    return AnomalyDetectionEntity(id=machine.id,
-                                   Label=FloatAttr.new(label))
+def shut_down():
+    provider.stop()
+
 
+def predict(machine: MachineEntity) -> AnomalyDetectionEntity:
+    estimates = predict_batch([machine])
+    if not estimates:
+        raise ValueError(f"can't score machine {machine.id}: missing readings")
+    return estimates[0]
 
 
 def predict_anomaly(machine: MachineEntity) -> bool:
-    
-    global model
-    
-    x = machine.Joules.value
-
-    return model.predict(np.array(x).reshape(-1,1))[0]
-    
+    return predict(machine).Label.value
+
+
+def score_batch(batch: MachineBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score a batch of machines straight into arrays, taking the features
+    the model's spec asks for.
+
+    :param batch: the machines.
+    :return: the labels and the scores, in the same order as the input.
+        Labels are ``1.0`` for anomalies and ``0.0`` for normal readings.
+        The higher the score, the more anomalous the reading. Both are
+        ``NaN`` for machines the model can't score, e.g. for missing
+        readings.
+    """
+    model = provider.get()
+    X, ok = model.features(batch)
+    labels = np.full(len(batch), np.nan)
+    scores = np.full(len(batch), np.nan)
+    if ok.any():
+        scorer = model.scorer
+        scores[ok] = scorer.decision_function(X if ok.all() else X[ok])
+        labels[ok] = scores[ok] > scorer.label_threshold
+    return labels, scores
+
+
+def predict_readings(joules: np.ndarray) -> np.ndarray:
+    """
+    Estimate anomalies straight from an array of ``Joules`` readings.
+
+    :param joules: the readings, ``NaN`` for missing ones.
+    :return: the labels, ``1.0`` for anomalies, ``0.0`` for normal
+        readings and ``NaN`` for missing readings.
+    """
+    return score_readings(joules)[0]
+
+
+def score_readings(joules: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as ``predict_readings`` but also return the anomaly scores the
+    labels come from.
+
+    :param joules: the readings, ``NaN`` for missing ones.
+    :return: the labels and the scores, both ``NaN`` for missing readings.
+        The higher the score, the more anomalous the reading.
+    """
+    ensure_readings_model()
+    batch = MachineBatch(ids=[''] * len(joules), numeric={'Joules': joules})
+    return score_batch(batch)
+
+
+def ensure_readings_model():
+    """
+    Make sure we can score the current model from ``Joules`` readings
+    alone, as ``score_readings`` does.
+
+    :raise ValueError: if the model takes any other features.
+    """
+    model = provider.get()
+    inputs = model.features.spec.inputs()
+    if inputs != ['Joules']:
+        raise ValueError(
+            f"model {model.version} takes {', '.join(inputs)}, " +
+            "can't score it from Joules readings alone")
+
+
+def predict_batch(machines: [MachineEntity]) -> [AnomalyDetectionEntity]:
+    """
+    Estimate anomalies for a whole batch of machines with one model call.
+
+    :param machines: the machines to score.
+    :return: an estimate for each machine that has the readings the model
+        needs, in the same order as the input. Machines without them get
+        no estimate since there's nothing to feed the model.
+    """
+    return predict_machines(MachineBatch.from_machine_entities(machines))
+
+
+def predict_machines(batch: MachineBatch) -> [AnomalyDetectionEntity]:
+    """
+    Same as ``predict_batch`` but for a columnar batch. Only the IDs and
+    the columns the model takes get read, so a batch built from raw
+    entities as they come in from Orion never gets parsed into models.
+
+    :param batch: the machines to score.
+    :return: an estimate for each machine that has an ID and the readings
+        the model needs, in the same order as the input.
+    """
+    model = provider.get()
+    X, ok = model.features(batch)
+    ids = batch.ids
+    scorable = [k for k in np.flatnonzero(ok) if isinstance(ids[k], str)]
+    if not scorable:
+        return []
+
+    labels = model.scorer.predict(X[scorable])
+    version = TextAttr.new(model.version)
+
+    return [AnomalyDetectionEntity(id=ids[k], Label=FloatAttr.new(label),
+                                   ModelVersion=version)
+            for k, label in zip(scorable, labels)]
 
 
 # sensors_data = {"Barcode":"ZLM001", "Face": "2nd", "Cell":"8th", "Point":"1st", "Group": "A+E1",
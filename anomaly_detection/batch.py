@@ -0,0 +1,360 @@
+"""
+Columnar representation of machine readings.
+
+A list of ``MachineEntity`` models stores each reading of each machine
+in its own attribute model, which is a lot of small objects to build
+and walk through. A ``MachineBatch`` stores the same data in columns
+instead: a float array for each numeric reading, an integer code array
+for each categorical reading (with the distinct values interned in a
+list) plus the entity IDs and timestamps.
+
+Examples
+--------
+
+>>> batch = MachineBatch.from_raw_readings(
+...     [{'Joules': 7.0, 'Face': '1st'}, {'Joules': -3.0, 'Face': '1st'},
+...      {'Face': '2nd'}],
+...     ids=['m1', 'm2', 'm3'])
+>>> batch.numeric('Joules')
+array([ 7., -3., nan])
+>>> batch.valid('Joules')
+array([ True,  True, False])
+>>> face = batch.categorical('Face')
+>>> face.codes, face.categories
+(array([0, 0, 1], dtype=int32), ['1st', '2nd'])
+>>> batch.to_machine_entities()[2]
+MachineEntity(id='m3', type='Machine', Barcode=None, \
+Face=TextAttr(type='Text', value='2nd'), Cell=None, Point=None, Group=None, \
+Joules=None, Charge=None, Residue=None, Force_N=None, Force_N_1=None, \
+Datetime=None)
+
+Batches built from NGSI entities or raw readings extract columns lazily,
+the first time they're needed, so scoring only reads out of the parsed
+JSON the readings the model actually uses.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from anomaly_detection.ngsy import MachineEntity, RawReading
+from anomaly_detection.util.ngsi.entity import FloatAttr, TextAttr, \
+    attr_value, attr_values, number_or_nan
+
+
+NUMERIC_ATTRS = ['Joules', 'Charge', 'Residue', 'Force_N', 'Force_N_1']
+CATEGORICAL_ATTRS = ['Barcode', 'Face', 'Cell', 'Point', 'Group']
+TEXT_ATTRS = ['Datetime']
+
+
+class Categorical:
+    """
+    Interned text column. ``codes[k]`` is the index in ``categories`` of
+    the ``k``-th value or ``-1`` if the value is missing.
+    """
+
+    def __init__(self, codes: np.ndarray, categories: List[str]):
+        self.codes = codes
+        self.categories = categories
+
+    @staticmethod
+    def from_values(values: List[Optional[str]]) -> 'Categorical':
+        """
+        Intern a list of values.
+
+        :param values: the values, ``None`` for missing ones.
+        :return: the interned column, categories in order of appearance.
+        """
+        index: Dict[str, int] = {}
+        codes = np.fromiter(
+            (-1 if v is None else index.setdefault(v, len(index))
+             for v in values),
+            dtype=np.int32, count=len(values))
+        return Categorical(codes, list(index))
+
+    def values(self) -> List[Optional[str]]:
+        """
+        :return: the column values, ``None`` for missing ones.
+        """
+        cs = self.categories
+        return [cs[c] if c >= 0 else None for c in self.codes]
+
+    def take(self, indexes: np.ndarray) -> 'Categorical':
+        return Categorical(self.codes[indexes], self.categories)
+
+
+class MachineBatch:
+    """
+    Readings of a batch of machines, stored by column.
+    """
+
+    def __init__(self, ids: List[str],
+                 numeric: Optional[Dict[str, np.ndarray]] = None,
+                 categorical: Optional[Dict[str, Categorical]] = None,
+                 text: Optional[Dict[str, List[Optional[str]]]] = None,
+                 source: Optional[List[dict]] = None, ngsi: bool = True):
+        """
+        Create a new instance. You'd normally use one of the ``from_*``
+        factory methods instead.
+
+        :param ids: the entity ID of each machine.
+        :param numeric: float readings, ``NaN`` for missing ones.
+        :param categorical: interned text readings.
+        :param text: other text readings, ``None`` for missing ones.
+        :param source: dictionaries to extract any column not given in
+            the other arguments from.
+        :param ngsi: are the source dictionaries NGSI entities, where
+            each attribute holds its value in a ``value`` field? If not,
+            they're taken to be flat raw readings.
+        """
+        self.ids = ids
+        self._numeric = dict(numeric or {})
+        self._categorical = dict(categorical or {})
+        self._text = dict(text or {})
+        self._source = source
+        self._ngsi = ngsi
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def from_entities(entities: List[dict]) -> 'MachineBatch':
+        """
+        Build a batch out of raw NGSI machine entities. Columns get
+        extracted from the entities as they're needed.
+
+        :param entities: raw machine entities as parsed from JSON.
+        :return: the batch.
+        """
+        return MachineBatch(ids=[e.get('id') for e in entities],
+                            source=entities)
+
+    @staticmethod
+    def from_raw_readings(readings: List[Union[RawReading, dict]],
+                          ids: Optional[List[str]] = None) \
+            -> 'MachineBatch':
+        """
+        Build a batch out of raw readings.
+
+        :param readings: ``RawReading`` models or raw reading dictionaries
+            as parsed from JSON. Any reading that isn't a dictionary is
+            taken to have no values.
+        :param ids: the entity ID to give each machine. Empty if missing.
+        :return: the batch.
+        """
+        rows = [r.dict() if isinstance(r, RawReading) else
+                r if isinstance(r, dict) else {}
+                for r in readings]
+        return MachineBatch(ids=ids if ids is not None else [''] * len(rows),
+                            source=rows, ngsi=False)
+
+    @staticmethod
+    def from_machine_entities(machines: List[MachineEntity]) \
+            -> 'MachineBatch':
+        """
+        Build a batch out of machine entity models.
+
+        :param machines: the machines.
+        :return: the batch.
+        """
+        return MachineBatch.from_entities(
+            [m.dict(exclude_none=True) for m in machines])
+
+    @staticmethod
+    def from_npz(path: Union[str, Path], key: str = 'test') \
+            -> 'MachineBatch':
+        """
+        Build a batch out of a NumPy archive like ``data/data.npz``, where
+        the first column of each array holds ``Joules`` readings.
+
+        :param path: the archive.
+        :param key: the name of the array to read.
+        :return: a batch with a ``Joules`` column and machine IDs set to
+            the row numbers.
+        """
+        joules = np.load(path)[key][:, 0].astype(float)
+        ids = [str(k) for k in range(len(joules))]
+        numeric = {name: np.full(len(joules), np.nan)
+                   for name in NUMERIC_ATTRS}
+        numeric['Joules'] = joules
+
+        return MachineBatch(ids=ids, numeric=numeric)
+
+    def numeric(self, name: str) -> np.ndarray:
+        """
+        :param name: a numeric attribute, e.g. ``Joules``.
+        :return: the attribute values, ``NaN`` for missing ones.
+        """
+        column = self._numeric.get(name)
+        if column is None:
+            column = self._numeric[name] = self._extract_numeric(name)
+        return column
+
+    def set_numeric(self, name: str, values: np.ndarray):
+        """
+        Add or replace a numeric column, e.g. a feature derived from the
+        readings.
+
+        :param name: the column name.
+        :param values: one value for each machine, ``NaN`` for missing.
+        """
+        if len(values) != len(self):
+            raise ValueError(f"expected {len(self)} values for {name}, " +
+                             f"got {len(values)}")
+        self._numeric[name] = values
+
+    def valid(self, name: str) -> np.ndarray:
+        """
+        :param name: a numeric attribute, e.g. ``Joules``.
+        :return: ``True`` for each machine that has a value for it.
+        """
+        return ~np.isnan(self.numeric(name))
+
+    def categorical(self, name: str) -> Categorical:
+        """
+        :param name: a categorical attribute, e.g. ``Face``.
+        :return: the interned attribute values.
+        """
+        column = self._categorical.get(name)
+        if column is None:
+            column = self._categorical[name] = \
+                Categorical.from_values(self._extract_text(name))
+        return column
+
+    def text(self, name: str) -> List[Optional[str]]:
+        """
+        :param name: a text attribute, e.g. ``Datetime``.
+        :return: the attribute values, ``None`` for missing ones.
+        """
+        column = self._text.get(name)
+        if column is None:
+            column = self._text[name] = self._extract_text(name)
+        return column
+
+    def _extract_numeric(self, name: str) -> np.ndarray:
+        if self._source is None:
+            return np.full(len(self), np.nan)
+        if self._ngsi:
+            return attr_values(self._source, name)
+        return np.fromiter((number_or_nan(r.get(name)) for r in self._source),
+                           dtype=float, count=len(self._source))
+
+    def _extract_text(self, name: str) -> List[Optional[str]]:
+        if self._source is None:
+            return [None] * len(self)
+        value_of = attr_value if self._ngsi else dict.get
+        return [_text_or_none(value_of(r, name)) for r in self._source]
+
+    def _materialize(self):
+        for name in NUMERIC_ATTRS:
+            self.numeric(name)
+        for name in CATEGORICAL_ATTRS:
+            self.categorical(name)
+        for name in TEXT_ATTRS:
+            self.text(name)
+
+    def take(self, indexes: np.ndarray) -> 'MachineBatch':
+        """
+        Select machines.
+
+        :param indexes: positions or boolean mask of the machines to pick.
+        :return: a new batch with just those machines.
+        """
+        indexes = np.arange(len(self))[indexes]
+        if self._source is not None:
+            return MachineBatch(ids=[self.ids[k] for k in indexes],
+                                numeric={n: c[indexes]
+                                         for n, c in self._numeric.items()},
+                                categorical={
+                                    n: c.take(indexes)
+                                    for n, c in self._categorical.items()},
+                                text={n: [c[k] for k in indexes]
+                                      for n, c in self._text.items()},
+                                source=[self._source[k] for k in indexes],
+                                ngsi=self._ngsi)
+
+        self._materialize()
+        return MachineBatch(
+            ids=[self.ids[k] for k in indexes],
+            numeric={n: c[indexes] for n, c in self._numeric.items()},
+            categorical={n: c.take(indexes)
+                         for n, c in self._categorical.items()},
+            text={n: [c[k] for k in indexes] for n, c in self._text.items()}
+        )
+
+    @staticmethod
+    def concat(batches: List['MachineBatch']) -> 'MachineBatch':
+        """
+        Stack batches one after the other.
+
+        :param batches: the batches to stack.
+        :return: a new batch with all the machines in the input batches.
+        """
+        numeric = list(dict.fromkeys(n for b in batches for n in b._numeric))
+        if batches and all(b._source is not None and
+                           b._ngsi == batches[0]._ngsi for b in batches):
+            return MachineBatch(ids=[i for b in batches for i in b.ids],
+                                numeric={n: np.concatenate(
+                                            [b.numeric(n) for b in batches])
+                                         for n in numeric},
+                                source=[r for b in batches for r in b._source],
+                                ngsi=batches[0]._ngsi)
+
+        for b in batches:
+            b._materialize()
+        return MachineBatch(
+            ids=[i for b in batches for i in b.ids],
+            numeric={n: np.concatenate([b.numeric(n) for b in batches])
+                     for n in dict.fromkeys(NUMERIC_ATTRS + numeric)},
+            categorical={n: Categorical.from_values(
+                            [v for b in batches
+                             for v in b.categorical(n).values()])
+                         for n in CATEGORICAL_ATTRS},
+            text={n: [v for b in batches for v in b.text(n)]
+                  for n in TEXT_ATTRS}
+        )
+    # NOTE. Extra columns. Numeric columns added with ``set_numeric``, e.g.
+    # window features, carry over too. Batches without one get whatever
+    # their readings hold for it, typically ``NaN``.
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over machines as dictionaries of readings, leaving out
+        missing readings.
+
+        :return: an iterator of dictionaries with the machine ID and its
+            readings.
+        """
+        self._materialize()
+        numeric = {n: self.numeric(n).tolist() for n in NUMERIC_ATTRS}
+        text = {n: self.categorical(n).values() for n in CATEGORICAL_ATTRS}
+        text.update({n: self.text(n) for n in TEXT_ATTRS})
+
+        for k, eid in enumerate(self.ids):
+            row = {'id': eid}
+            for n, vs in text.items():
+                if vs[k] is not None:
+                    row[n] = vs[k]
+            for n, vs in numeric.items():
+                if vs[k] == vs[k]:
+                    row[n] = vs[k]
+            yield row
+    # NOTE. NaN check. ``x == x`` is ``False`` only for ``NaN``.
+
+    def to_machine_entities(self) -> List[MachineEntity]:
+        """
+        :return: a ``MachineEntity`` model for each machine.
+        """
+        ms = []
+        for row in self.rows():
+            m = MachineEntity(id=row.pop('id'))
+            for name, value in row.items():
+                attr = FloatAttr if name in NUMERIC_ATTRS else TextAttr
+                setattr(m, name, attr.new(value))
+            ms.append(m)
+        return ms
+
+
+def _text_or_none(x: Any) -> Optional[str]:
+    return x if isinstance(x, str) else None
@@ -0,0 +1,301 @@
+"""
+Offline bulk scoring of historical readings.
+
+Scores a whole file of ``Joules`` readings in one go instead of posting
+each row to ``/rawReading``, writing out a label and an anomaly score for
+each row, in the same order as the input. Only works with models that
+take just ``Joules``, see ``features``. E.g.
+
+    python -m anomaly_detection.bulk data/data.npz labels.csv --key test
+
+Inputs can be
+
+* NumPy ``.npy`` files, which we memory-map;
+* NumPy ``.npz`` archives, reading the array named by ``--key``;
+* CSV files, reading the column named by ``--column``;
+* Parquet files, if ``pyarrow`` is installed.
+
+For ``.npy`` and ``.npz`` inputs, ``--column`` is the index of the
+readings column in a 2D array, the first one unless you give an index.
+
+Outputs can be CSV, ``.npy`` (a float array with the labels in the first
+column and the scores in the second) or Parquet. The output format
+follows the file extension.
+
+We read, score and write one chunk of rows at a time, so memory use
+depends on the chunk size rather than the input size. With ``--workers``
+set, chunks get scored in a pool of processes, each with its own copy of
+the model. The model is the one configured in the environment, same as
+for the service, except we score with the threshold table by default
+since it's exact and way faster than walking the trees, see ``ttable``.
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
+import sys
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+import anomaly_detection.ai as ai
+import anomaly_detection.config as config
+from anomaly_detection.model import ModelProvider
+
+
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_COLUMN = 'Joules'
+LABEL_COLUMN = 'Label'
+SCORE_COLUMN = 'Score'
+
+Column = Union[str, int]
+
+
+def _array_column(array: np.ndarray, column: Column) -> np.ndarray:
+    if array.ndim == 1:
+        return array
+    index = int(column) if str(column).isdigit() else 0
+    return array[:, index]
+
+
+def _array_chunks(array: np.ndarray, chunk_size: int) \
+        -> Iterator[np.ndarray]:
+    for k in range(0, len(array), chunk_size):
+        yield np.asarray(array[k:k + chunk_size], dtype=float)
+
+
+class Reader:
+    """
+    Reads the readings column of an input file in chunks.
+    """
+
+    def __init__(self, path: Path, column: Column = DEFAULT_COLUMN,
+                 key: Optional[str] = None):
+        """
+        Create a new instance.
+
+        :param path: the input file.
+        :param column: the name or index of the readings column.
+        :param key: the array to read out of an ``.npz`` archive. Defaults
+            to the first one.
+        """
+        self.path = path
+        self.column = column
+        self.key = key
+
+    def rows(self) -> Optional[int]:
+        """
+        :return: how many rows there are in the input, if we can tell
+            without reading it all.
+        """
+        suffix = self.path.suffix
+        if suffix == '.npy':
+            return len(np.load(self.path, mmap_mode='r'))
+        if suffix == '.npz':
+            return len(self._npz_array())
+        if suffix == '.parquet':
+            return _parquet().ParquetFile(self.path).metadata.num_rows
+        return None
+
+    def _npz_array(self) -> np.ndarray:
+        archive = np.load(self.path)
+        return archive[self.key or archive.files[0]]
+
+    def chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        :param chunk_size: max number of rows in each chunk.
+        :return: the readings, ``chunk_size`` at a time, ``NaN`` for
+            missing ones.
+        """
+        suffix = self.path.suffix
+        if suffix == '.npy':
+            array = np.load(self.path, mmap_mode='r')
+            yield from _array_chunks(_array_column(array, self.column),
+                                     chunk_size)
+        elif suffix == '.npz':
+            array = self._npz_array()
+            yield from _array_chunks(_array_column(array, self.column),
+                                     chunk_size)
+        elif suffix == '.parquet':
+            parquet = _parquet().ParquetFile(self.path)
+            for batch in parquet.iter_batches(batch_size=chunk_size,
+                                              columns=[self.column]):
+                yield batch.column(0).to_numpy(zero_copy_only=False) \
+                    .astype(float)
+        else:
+            yield from self._csv_chunks(chunk_size)
+    # NOTE. Memory-mapping. Only ``.npy`` files get memory-mapped. NumPy
+    # loads ``.npz`` members into memory in one go, so convert archives
+    # bigger than RAM to ``.npy`` first.
+
+    def _csv_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        import pandas as pd
+
+        for frame in pd.read_csv(self.path, usecols=[self.column],
+                                 chunksize=chunk_size):
+            yield pd.to_numeric(frame[self.column], errors='coerce') \
+                .to_numpy(dtype=float)
+
+
+class Writer:
+    """
+    Writes labels and scores out in chunks.
+    """
+
+    def __init__(self, path: Path, rows: Optional[int]):
+        """
+        Create a new instance.
+
+        :param path: the output file.
+        :param rows: how many rows the output will have, if known.
+        :raise ValueError: if the output is an ``.npy`` file but the number
+            of rows isn't known upfront.
+        """
+        self.path = path
+        self._offset = 0
+        self._npy = None
+        self._csv = None
+        self._parquet = None
+
+        if path.suffix == '.npy':
+            if rows is None:
+                raise ValueError(
+                    "can't write .npy output without knowing the number " +
+                    "of rows upfront; use a CSV or Parquet output instead")
+            self._npy = np.lib.format.open_memmap(
+                path, mode='w+', dtype=float, shape=(rows, 2))
+        elif path.suffix != '.parquet':
+            self._csv = open(path, 'w')
+            self._csv.write(f"{LABEL_COLUMN},{SCORE_COLUMN}\n")
+
+    def write(self, labels: np.ndarray, scores: np.ndarray):
+        if self._npy is not None:
+            end = self._offset + len(labels)
+            self._npy[self._offset:end, 0] = labels
+            self._npy[self._offset:end, 1] = scores
+            self._offset = end
+        elif self._csv is not None:
+            np.savetxt(self._csv, np.column_stack([labels, scores]),
+                       delimiter=',', fmt=['%.0f', '%.17g'])
+        else:
+            self._write_parquet(labels, scores)
+
+    def _write_parquet(self, labels: np.ndarray, scores: np.ndarray):
+        import pyarrow as pa
+
+        table = pa.table({LABEL_COLUMN: labels, SCORE_COLUMN: scores})
+        if self._parquet is None:
+            self._parquet = _parquet().ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+
+    def close(self):
+        if self._npy is not None:
+            self._npy.flush()
+            self._npy = None
+        if self._csv is not None:
+            self._csv.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('Parquet files need pyarrow; pip install pyarrow')
+    return pq
+
+
+def _score_chunk(joules: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return ai.score_readings(joules)
+
+
+def _init_worker():
+    ai.provider.warm_up()
+
+
+def score_file(source: Path, target: Path, column: Column = DEFAULT_COLUMN,
+               key: Optional[str] = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE,
+               workers: int = 0) -> int:
+    """
+    Score all the readings in a file.
+
+    :param source: the input file.
+    :param target: where to write labels and scores.
+    :param column: the name or index of the readings column.
+    :param key: the array to read out of an ``.npz`` archive.
+    :param chunk_size: how many rows to read, score and write at a time.
+    :param workers: how many processes to score chunks in. Zero or less
+        means score in this process.
+    :return: how many rows got scored.
+    :raise ValueError: if the model takes more than ``Joules`` readings.
+    """
+    ai.ensure_readings_model()
+    reader = Reader(source, column, key)
+    writer = Writer(target, reader.rows())
+    rows = 0
+    try:
+        if workers > 0:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker) as pool:
+                pending = deque()
+                for joules in reader.chunks(chunk_size):
+                    pending.append(pool.submit(_score_chunk, joules))
+                    if len(pending) >= 2 * workers:
+                        rows += _write_next(writer, pending)
+                while pending:
+                    rows += _write_next(writer, pending)
+        else:
+            for joules in reader.chunks(chunk_size):
+                labels, scores = _score_chunk(joules)
+                writer.write(labels, scores)
+                rows += len(labels)
+    finally:
+        writer.close()
+    return rows
+# NOTE. Process pool. We keep at most two chunks per worker in flight so
+# we don't read the whole input ahead of the workers, and write results
+# out in input order as they come in. Scoring is a few vectorised NumPy
+# calls per chunk, so a pool only pays off for big chunks on inputs that
+# are slow to read, e.g. CSV.
+
+
+def _write_next(writer: Writer, pending: deque) -> int:
+    labels, scores = pending.popleft().result()
+    writer.write(labels, scores)
+    return len(labels)
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source', type=Path, help='readings file')
+    parser.add_argument('target', type=Path,
+                        help='where to write labels and scores')
+    parser.add_argument('--column', default=DEFAULT_COLUMN,
+                        help='readings column name, or index for NumPy ' +
+                             'inputs')
+    parser.add_argument('--key', help='array to read out of an .npz file')
+    parser.add_argument('--chunk-size', type=int,
+                        default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='processes to score chunks in')
+    parser.add_argument('--mode', default=config.TABLE_SCORING,
+                        choices=[config.FOREST_SCORING, config.TABLE_SCORING],
+                        help='scoring engine to use')
+    args = parser.parse_args(argv)
+
+    os.environ[config.SCORING_MODE_VAR] = args.mode
+    ai.provider = ModelProvider.from_config()
+
+    rows = score_file(args.source, args.target, column=args.column,
+                      key=args.key, chunk_size=args.chunk_size,
+                      workers=args.workers)
+    print(f"scored {rows} readings into {args.target}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,181 @@
+"""
+Coalesces estimate upserts across notifications.
+
+Orion often sends us lots of small notifications in quick succession.
+Rather than firing off an update request for each of them, we buffer
+the estimates for a little while, one buffer for each FIWARE service
+and service path, and then write out each buffer in one go. A buffer
+gets written out as soon as it holds enough estimates or its oldest
+estimate has been waiting long enough, whichever comes first.
+
+Within a buffer we only keep the latest estimate for each entity since
+an upsert would overwrite any earlier one anyway.
+"""
+
+import logging
+from threading import Event, Lock, Thread
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import anomaly_detection.config as config
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+Sink = Callable[[FiwareContext, List[AnomalyDetectionEntity]], None]
+ContextKey = Tuple[Optional[str], Optional[str]]
+
+
+class _Buffer:
+
+    def __init__(self, ctx: FiwareContext):
+        self.ctx = ctx
+        self.since = time.monotonic()
+        self.estimates: Dict[str, AnomalyDetectionEntity] = {}
+
+    def age(self, now: float) -> float:
+        return now - self.since
+
+
+class UpsertCoalescer:
+    """
+    Buffers estimates and hands them over to a sink in batches.
+    Safe to share among threads.
+    """
+
+    def __init__(self, sink: Sink, max_batch: int = 100,
+                 max_delay: float = 0.1):
+        """
+        Create a new instance. Call ``start`` to write out buffers on
+        time even when no new estimates come in.
+
+        :param sink: what to do with a batch of estimates, typically
+            upsert them to Orion.
+        :param max_batch: write out a buffer when it has this many
+            estimates in it.
+        :param max_delay: write out a buffer when its oldest estimate
+            has been waiting for this many seconds. Zero or less means
+            don't buffer at all.
+        """
+        self._sink = sink
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._buffers: Dict[ContextKey, _Buffer] = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._flusher: Optional[Thread] = None
+        self._added = 0
+        self._deduplicated = 0
+        self._flushes = 0
+
+    @staticmethod
+    def from_config(sink: Sink) -> 'UpsertCoalescer':
+        """
+        :param sink: what to do with a batch of estimates.
+        :return: a coalescer with the thresholds configured in the
+            environment.
+        """
+        return UpsertCoalescer(sink=sink,
+                               max_batch=config.upsert_batch_size(),
+                               max_delay=config.upsert_max_delay())
+
+    def add(self, ctx: FiwareContext,
+            estimates: List[AnomalyDetectionEntity]):
+        """
+        Buffer estimates, writing out the buffer if it's full or old
+        enough.
+
+        :param ctx: the FIWARE context the estimates belong to.
+        :param estimates: the estimates.
+        """
+        if self._max_delay <= 0:
+            self._write(ctx, estimates)
+            return
+
+        key = (ctx.service, ctx.service_path)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = _Buffer(ctx)
+
+            for e in estimates:
+                if e.id in buffer.estimates:
+                    self._deduplicated += 1
+                buffer.estimates[e.id] = e
+            self._added += len(estimates)
+
+            if len(buffer.estimates) >= self._max_batch or \
+                    buffer.age(time.monotonic()) >= self._max_delay:
+                del self._buffers[key]
+            else:
+                buffer = None
+
+        if buffer:
+            self._write(buffer.ctx, list(buffer.estimates.values()))
+
+    def flush(self, expired_only: bool = False):
+        """
+        Write out buffered estimates.
+
+        :param expired_only: only write out buffers older than the max
+            delay. Write out all of them if ``False``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k, b in self._buffers.items()
+                    if not expired_only or b.age(now) >= self._max_delay]
+            buffers = [self._buffers.pop(k) for k in keys]
+
+        for b in buffers:
+            self._write(b.ctx, list(b.estimates.values()))
+
+    def _write(self, ctx: FiwareContext,
+               estimates: List[AnomalyDetectionEntity]):
+        with self._lock:
+            self._flushes += 1
+        try:
+            self._sink(ctx, estimates)
+        except Exception:
+            _logger().exception(f"failed to write estimates for {ctx}")
+
+    def _flush_on_time(self):
+        while not self._stopped.wait(self._max_delay / 2):
+            self.flush(expired_only=True)
+
+    def start(self):
+        """
+        Start writing out buffers in the background as soon as they're
+        old enough.
+        """
+        if self._max_delay > 0 and self._flusher is None:
+            self._stopped.clear()
+            self._flusher = Thread(target=self._flush_on_time, daemon=True,
+                                   name='upsert-coalescer')
+            self._flusher.start()
+
+    def stop(self):
+        """
+        Stop the background writer and write out whatever is still
+        buffered.
+        """
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: counts of estimates added, estimates dropped because a
+            later one for the same entity came in, and batches written.
+        """
+        with self._lock:
+            return {
+                'added': self._added,
+                'deduplicated': self._deduplicated,
+                'flushes': self._flushes
+            }
+
+
+def _logger() -> logging.Logger:
+    return logging.getLogger(__name__)
@@ -1,12 +1,218 @@
+from functools import lru_cache
 import os
+from pathlib import Path
+from typing import Optional
 from uri import URI
 
 
 ORION_BASE_URL_VAR = 'ORION_BASE_URL'
+SCORING_MODE_VAR = 'ANOMALY_SCORING_MODE'
+MODEL_PATH_VAR = 'ANOMALY_MODEL_PATH'
+MODEL_MMAP_VAR = 'ANOMALY_MODEL_MMAP'
+MODEL_DIR_VAR = 'ANOMALY_MODEL_DIR'
+MODEL_POLL_INTERVAL_VAR = 'ANOMALY_MODEL_POLL_INTERVAL'
+QUEUE_SIZE_VAR = 'ANOMALY_QUEUE_SIZE'
+WORKERS_N_VAR = 'ANOMALY_WORKERS'
+WORKER_BATCH_SIZE_VAR = 'ANOMALY_WORKER_BATCH_SIZE'
+UPSERT_BATCH_SIZE_VAR = 'ORION_UPSERT_BATCH_SIZE'
+UPSERT_MAX_DELAY_VAR = 'ORION_UPSERT_MAX_DELAY'
+ORION_POOL_MAXSIZE_VAR = 'ORION_POOL_MAXSIZE'
+ORION_KEEP_ALIVE_VAR = 'ORION_KEEP_ALIVE'
+VALIDATE_NOTIFICATIONS_VAR = 'ANOMALY_VALIDATE_NOTIFICATIONS'
+LOG_LEVEL_VAR = 'ANOMALY_LOG_LEVEL'
+LOG_QUEUE_SIZE_VAR = 'ANOMALY_LOG_QUEUE_SIZE'
+HTTP_WORKERS_VAR = 'ANOMALY_HTTP_WORKERS'
+THREADPOOL_SIZE_VAR = 'ANOMALY_THREADPOOL_SIZE'
+BIND_VAR = 'ANOMALY_BIND'
+WINDOW_SIZE_VAR = 'ANOMALY_WINDOW_SIZE'
+WINDOW_MACHINES_VAR = 'ANOMALY_WINDOW_MACHINES'
+WINDOW_EWMA_ALPHA_VAR = 'ANOMALY_WINDOW_EWMA_ALPHA'
+RESULT_CACHE_SIZE_VAR = 'ANOMALY_RESULT_CACHE_SIZE'
+RESULT_CACHE_TTL_VAR = 'ANOMALY_RESULT_CACHE_TTL'
+CHANGE_ONLY_UPSERTS_VAR = 'ORION_CHANGE_ONLY_UPSERTS'
+PUBLISHED_LABELS_SIZE_VAR = 'ORION_PUBLISHED_LABELS_SIZE'
+ORION_TIMEOUT_VAR = 'ORION_TIMEOUT'
+ORION_RETRIES_VAR = 'ORION_RETRIES'
+ORION_BACKOFF_VAR = 'ORION_BACKOFF'
+ORION_BREAKER_FAILURES_VAR = 'ORION_BREAKER_FAILURES'
+ORION_BREAKER_RESET_VAR = 'ORION_BREAKER_RESET'
+ORION_SPILL_SIZE_VAR = 'ORION_SPILL_SIZE'
+
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent / 'data' / \
+                     'anomaly_detection.pkl'
+
+FOREST_SCORING = 'forest'
+TABLE_SCORING = 'table'
+
+
+def _read_flag(var_name: str, default: bool) -> bool:
+    value = os.environ.get(var_name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
 
 def orion_base_url() -> URI:
     value = os.environ[ORION_BASE_URL_VAR]
+    return _parse_uri(value)
+
+
+@lru_cache(maxsize=8)
+def _parse_uri(value: str) -> URI:
     return URI(value)
+# NOTE. Caching. Parsing the URL on each call adds up on the hot path.
+# Callers must not modify the returned URI.
+
+
+def orion_pool_maxsize() -> int:
+    value = os.environ.get(ORION_POOL_MAXSIZE_VAR, '10')
+    return int(value)
+
+
+def orion_keep_alive() -> bool:
+    return _read_flag(ORION_KEEP_ALIVE_VAR, True)
+
+
+def orion_timeout() -> float:
+    value = os.environ.get(ORION_TIMEOUT_VAR, '10')
+    return float(value)
+
+
+def orion_retries() -> int:
+    value = os.environ.get(ORION_RETRIES_VAR, '3')
+    return int(value)
+
+
+def orion_backoff() -> float:
+    value = os.environ.get(ORION_BACKOFF_VAR, '0.1')
+    return float(value)
+
+
+def orion_breaker_failures() -> int:
+    value = os.environ.get(ORION_BREAKER_FAILURES_VAR, '5')
+    return int(value)
+
+
+def orion_breaker_reset() -> float:
+    value = os.environ.get(ORION_BREAKER_RESET_VAR, '30')
+    return float(value)
+
+
+def orion_spill_size() -> int:
+    value = os.environ.get(ORION_SPILL_SIZE_VAR, '10000')
+    return int(value)
+
+
+def scoring_mode() -> str:
+    value = os.environ.get(SCORING_MODE_VAR, FOREST_SCORING)
+    if value not in (FOREST_SCORING, TABLE_SCORING):
+        raise ValueError(f"invalid {SCORING_MODE_VAR}: {value}")
+    return value
+
+
+def model_path() -> Path:
+    value = os.environ.get(MODEL_PATH_VAR)
+    return Path(value) if value else DEFAULT_MODEL_PATH
+
+
+def model_mmap() -> bool:
+    return _read_flag(MODEL_MMAP_VAR, True)
+
+
+def model_dir() -> Optional[Path]:
+    value = os.environ.get(MODEL_DIR_VAR)
+    return Path(value) if value else None
+
+
+def model_poll_interval() -> float:
+    value = os.environ.get(MODEL_POLL_INTERVAL_VAR, '10')
+    return float(value)
+
+
+def queue_size() -> int:
+    value = os.environ.get(QUEUE_SIZE_VAR, '1000')
+    return int(value)
+
+
+def workers_n() -> int:
+    value = os.environ.get(WORKERS_N_VAR, '4')
+    return int(value)
+
+
+def worker_batch_size() -> int:
+    value = os.environ.get(WORKER_BATCH_SIZE_VAR, '500')
+    return int(value)
+
+
+def upsert_batch_size() -> int:
+    value = os.environ.get(UPSERT_BATCH_SIZE_VAR, '100')
+    return int(value)
+
+
+def upsert_max_delay() -> float:
+    value = os.environ.get(UPSERT_MAX_DELAY_VAR, '0.1')
+    return float(value)
+
+
+def validate_notifications() -> bool:
+    return _read_flag(VALIDATE_NOTIFICATIONS_VAR, False)
+
+
+def log_level() -> str:
+    value = os.environ.get(LOG_LEVEL_VAR, 'INFO')
+    return value.strip().upper()
+
+
+def log_queue_size() -> int:
+    value = os.environ.get(LOG_QUEUE_SIZE_VAR, '10000')
+    return int(value)
+
+
+def http_workers() -> int:
+    value = os.environ.get(HTTP_WORKERS_VAR, '1')
+    return int(value)
+
+
+def threadpool_size() -> Optional[int]:
+    value = os.environ.get(THREADPOOL_SIZE_VAR)
+    return int(value) if value else None
+
+
+def bind_address() -> str:
+    return os.environ.get(BIND_VAR, '0.0.0.0:8000')
+
+
+def window_size() -> int:
+    value = os.environ.get(WINDOW_SIZE_VAR, '0')
+    return int(value)
+
+
+def window_machines() -> int:
+    value = os.environ.get(WINDOW_MACHINES_VAR, '10000')
+    return int(value)
+
+
+def window_ewma_alpha() -> float:
+    value = os.environ.get(WINDOW_EWMA_ALPHA_VAR, '0.2')
+    return float(value)
+
+
+def result_cache_size() -> int:
+    value = os.environ.get(RESULT_CACHE_SIZE_VAR, '0')
+    return int(value)
+
+
+def result_cache_ttl() -> float:
+    value = os.environ.get(RESULT_CACHE_TTL_VAR, '600')
+    return float(value)
+
+
+def change_only_upserts() -> bool:
+    return _read_flag(CHANGE_ONLY_UPSERTS_VAR, False)
+
+
+def published_labels_size() -> int:
+    value = os.environ.get(PUBLISHED_LABELS_SIZE_VAR, '100000')
+    return int(value)
 
 # TODO. Robust implementation. See e.g. env readers from QL.
\ No newline at end of file
@@ -5,23 +5,114 @@ Endpoint to process machine entity updates from Orion.
 
 """
 
-from anomaly_detection.ai import predict
+import time
+
+from anomaly_detection.ai import predict_machines, provider
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.coalesce import UpsertCoalescer
 import anomaly_detection.config as config
+from anomaly_detection.features import FeatureSpec
 import anomaly_detection.log as log
-from anomaly_detection.ngsy import MachineEntity, AnomalyDetectionEntity
+import anomaly_detection.metrics as metrics
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.published import PublishedLabels
+from anomaly_detection.results import ResultCache
+from anomaly_detection.util.ngsi.entity import entities_upsert_json
 from anomaly_detection.util.ngsi.headers import FiwareContext
-from anomaly_detection.util.ngsi.orion import OrionClient
+from anomaly_detection.util.ngsi.orion import OrionClientCache
+from anomaly_detection.windows import MachineWindows
+from anomaly_detection.writer import CLOSED, OrionWriter
+
+
+def process_update(ctx: FiwareContext, ms: [dict]):
+    batch = MachineBatch.from_entities(ms)
+    log.going_to_process_updates(ctx, batch)
+    spec = provider.get().features.spec
+    if results is not None:
+        batch = drop_seen(ctx, batch, spec)
+    if windows is not None:
+        windows.annotate(batch, ctx)
 
+    start = time.perf_counter()
+    estimates = predict_machines(batch)
+    secs = time.perf_counter() - start
+    metrics.predict_seconds.observe(secs)
+    metrics.entities_processed.inc(len(estimates))
+    metrics.anomalies_flagged.inc(
+        sum(1 for e in estimates if e.Label.value == 1))
+    log.processed_updates(ctx, len(batch), len(estimates), secs)
+    if results is not None:
+        results.remember(ctx, batch, spec)
+    if estimates:
+        update_context(ctx, estimates)
 
-def process_update(ctx: FiwareContext, ms: [MachineEntity]):
-    log.going_to_process_updates(ctx, ms)
 
-    estimates = [predict(m) for m in ms]
-    update_context(ctx, estimates)
+def drop_seen(ctx: FiwareContext, batch: MachineBatch,
+              spec: FeatureSpec) -> MachineBatch:
+    fresh = results.drop_seen(ctx, batch, spec)
+    metrics.result_cache_hits.inc(len(batch) - len(fresh))
+    metrics.result_cache_misses.inc(len(fresh))
+    return fresh
+# NOTE. Windows. We drop repeats before adding readings to the windows
+# so the same reading doesn't get counted twice in the rolling stats.
+# NOTE. Remembering. We only remember readings as handled once they've
+# been scored, so if scoring fails the next notification with the same
+# readings gets scored again. We do it right before handing estimates
+# over to be published since the writer may give up on them straight
+# away, making us forget them, and that has to come after.
 
 
 def update_context(ctx: FiwareContext, estimates: [AnomalyDetectionEntity]):
+    if published is not None:
+        changed = published.changed(ctx, estimates)
+        metrics.upserts_suppressed.inc(len(estimates) - len(changed))
+        estimates = changed
+    if estimates:
+        coalescer.add(ctx, estimates)
+
+
+def upsert_estimates(ctx: FiwareContext,
+                     estimates: [AnomalyDetectionEntity]):
     log.going_to_update_context_with_estimates(ctx, estimates)
 
-    orion = OrionClient(config.orion_base_url(), ctx)
-    orion.upsert_entities(estimates)
+    start = time.perf_counter()
+    payload = entities_upsert_json(estimates)
+    serialized = time.perf_counter()
+    metrics.serialize_seconds.observe(serialized - start)
+
+    orion = orion_clients.get(config.orion_base_url(), ctx)
+    try:
+        orion.upsert_entities_json(payload)
+    except Exception:
+        metrics.orion_errors.inc()
+        raise
+    finally:
+        metrics.orion_seconds.observe(time.perf_counter() - serialized)
+    log.updated_context(ctx, len(estimates), time.perf_counter() - start)
+
+
+def forget_estimates(ctx: FiwareContext,
+                     estimates: [AnomalyDetectionEntity]):
+    ids = [e.id for e in estimates]
+    if results is not None:
+        results.forget(ctx, ids)
+    if published is not None:
+        published.forget(ctx, ids)
+# NOTE. Lost estimates. The writer calls this for the estimates it gives
+# up on, so the next readings of those machines get scored and their
+# estimates sent out again rather than being taken as published.
+
+
+orion_clients = OrionClientCache(pool_maxsize=config.orion_pool_maxsize(),
+                                 keep_alive=config.orion_keep_alive(),
+                                 timeout=config.orion_timeout())
+writer = OrionWriter.from_config(upsert_estimates, on_drop=forget_estimates)
+metrics.spilled_estimates.set_function(writer.spilled)
+metrics.orion_breaker_open.set_function(
+    lambda: int(writer.breaker.state != CLOSED))
+coalescer = UpsertCoalescer.from_config(writer.write)
+results = ResultCache.from_config()
+published = PublishedLabels.from_config()
+windows = MachineWindows.from_config()
+if windows is not None:
+    metrics.windowed_machines.set_function(windows.__len__)
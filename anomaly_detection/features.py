@@ -0,0 +1,243 @@
+"""
+Declarative feature specs.
+
+A model comes with a spec of the features it was trained on, in a JSON
+file next to it: ``anomaly_detection.features.json`` for a pickle named
+``anomaly_detection.pkl`` or ``features.json`` inside a bundle directory.
+E.g.
+
+    {
+        "numeric": [{"name": "Joules"}, {"name": "Charge", "fill": 0}],
+        "categorical": [{"name": "Face", "categories": ["1st", "2nd"]}],
+        "missing": "skip"
+    }
+
+says the model takes four columns: ``Joules``, ``Charge`` and a one-hot
+encoding of ``Face``. Numeric features can be any numeric column of a
+``MachineBatch``, e.g. a reading or a window feature like
+``Joules_mean``. Missing values get replaced with the feature's
+``fill`` value if it has one. Otherwise the ``missing`` policy applies:
+with ``skip``, machines missing the value get no estimate; with
+``fill``, the value gets replaced with the spec's ``fill``, zero by
+default. Missing or unknown categories encode as all zeros in one-hot
+encodings and as ``-1`` in ordinal ones.
+
+A model without a spec file takes just ``Joules`` and skips machines
+without it, which is what our original model does.
+
+We compile the spec into a ``FeatureExtractor`` when loading the model.
+The extractor fills in the feature matrix one column at a time with
+array operations, so its cost doesn't grow with the number of machines
+in Python code.
+
+Examples
+--------
+
+>>> spec = FeatureSpec.parse_obj({
+...     'numeric': [{'name': 'Joules'}],
+...     'categorical': [{'name': 'Face', 'categories': ['1st', '2nd']}]})
+>>> spec.columns()
+['Joules', 'Face=1st', 'Face=2nd']
+>>> batch = MachineBatch.from_raw_readings(
+...     [{'Joules': 7.0, 'Face': '2nd'}, {'Face': '1st'},
+...      {'Joules': -3.0, 'Face': '9th'}])
+>>> X, ok = FeatureExtractor(spec)(batch)
+>>> X
+array([[ 7.,  0.,  1.],
+       [nan,  1.,  0.],
+       [-3.,  0.,  0.]], dtype=float32)
+>>> ok
+array([ True, False,  True])
+"""
+
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from anomaly_detection.batch import MachineBatch
+
+
+SPEC_FILE_NAME = 'features.json'
+SPEC_FILE_SUFFIX = '.features.json'
+
+SKIP_MISSING = 'skip'
+FILL_MISSING = 'fill'
+ONE_HOT = 'onehot'
+ORDINAL = 'ordinal'
+
+
+class NumericFeature(BaseModel):
+    name: str
+    fill: Optional[float] = None
+
+
+class CategoricalFeature(BaseModel):
+    name: str
+    categories: List[str]
+    encoding: Literal['onehot', 'ordinal'] = ONE_HOT
+
+    def columns(self) -> List[str]:
+        if self.encoding == ORDINAL:
+            return [self.name]
+        return [f"{self.name}={c}" for c in self.categories]
+
+
+class FeatureSpec(BaseModel):
+    numeric: List[NumericFeature]
+    categorical: List[CategoricalFeature] = []
+    missing: Literal['skip', 'fill'] = SKIP_MISSING
+    fill: float = 0.0
+
+    @staticmethod
+    def default() -> 'FeatureSpec':
+        """
+        :return: the spec of models without a spec file: just ``Joules``,
+            skipping machines without it.
+        """
+        return FeatureSpec(numeric=[NumericFeature(name='Joules')])
+
+    def columns(self) -> List[str]:
+        """
+        :return: the name of each column of the feature matrix, in order.
+        """
+        return [f.name for f in self.numeric] + \
+            [c for f in self.categorical for c in f.columns()]
+
+    def inputs(self) -> List[str]:
+        """
+        :return: the name of each batch column the features come from, in
+            order, each name once.
+        """
+        names = [f.name for f in self.numeric] + \
+            [f.name for f in self.categorical]
+        return list(dict.fromkeys(names))
+
+    def required(self) -> List[str]:
+        """
+        :return: the name of each batch column machines get skipped
+            without.
+        """
+        if self.missing == FILL_MISSING:
+            return []
+        return [f.name for f in self.numeric if f.fill is None]
+
+
+def spec_path(model_path: Path) -> Path:
+    """
+    :param model_path: a pickle file or a bundle directory.
+    :return: where the model's feature spec should be.
+    """
+    if model_path.is_dir():
+        return model_path / SPEC_FILE_NAME
+    return model_path.with_suffix(SPEC_FILE_SUFFIX)
+
+
+def load_spec(model_path: Path) -> FeatureSpec:
+    """
+    Load the feature spec that comes with a model.
+
+    :param model_path: a pickle file or a bundle directory.
+    :return: the spec or the default one if the model has none.
+    """
+    path = spec_path(model_path)
+    if path.is_file():
+        return FeatureSpec.parse_file(path)
+    return FeatureSpec.default()
+
+
+class _Numeric:
+
+    def __init__(self, name: str, column: int, fill: Optional[float]):
+        self.name = name
+        self.column = column
+        self.fill = fill
+
+
+class _Categorical:
+
+    def __init__(self, name: str, column: int, categories: List[str],
+                 one_hot: bool):
+        self.name = name
+        self.column = column
+        self.index: Dict[str, int] = {c: k for k, c in enumerate(categories)}
+        self.one_hot = one_hot
+        self.width = len(categories) if one_hot else 1
+
+
+class FeatureExtractor:
+    """
+    Turns batches of machines into feature matrices as a spec says.
+    Safe to share among threads.
+    """
+
+    def __init__(self, spec: FeatureSpec):
+        """
+        Compile the given spec.
+
+        :param spec: the features to extract.
+        """
+        self.spec = spec
+        self.columns = spec.columns()
+
+        default_fill = spec.fill if spec.missing == FILL_MISSING else None
+        self._numeric = [
+            _Numeric(f.name, k, f.fill if f.fill is not None else default_fill)
+            for k, f in enumerate(spec.numeric)]
+        self._categorical = []
+        column = len(self._numeric)
+        for f in spec.categorical:
+            plan = _Categorical(f.name, column, f.categories,
+                                f.encoding == ONE_HOT)
+            self._categorical.append(plan)
+            column += plan.width
+
+    @property
+    def width(self) -> int:
+        return len(self.columns)
+
+    def __call__(self, batch: MachineBatch) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Extract features.
+
+        :param batch: the machines.
+        :return: the float32 feature matrix, one C-contiguous row for each
+            machine, and a mask telling which rows the model can score.
+            Rows of machines skipped for missing values hold ``NaN`` in
+            place of those values.
+        """
+        n = len(batch)
+        X = np.empty((n, self.width), dtype=np.float32)
+        ok = np.ones(n, dtype=bool)
+
+        for f in self._numeric:
+            values = batch.numeric(f.name)
+            X[:, f.column] = values
+            missing = np.isnan(values)
+            if f.fill is None:
+                ok &= ~missing
+            elif missing.any():
+                X[missing, f.column] = f.fill
+
+        for f in self._categorical:
+            codes = self._codes(f, batch)
+            if f.one_hot:
+                X[:, f.column:f.column + f.width] = 0
+                rows = np.flatnonzero(codes >= 0)
+                X[rows, f.column + codes[rows]] = 1
+            else:
+                X[:, f.column] = codes
+
+        return X, ok
+
+    @staticmethod
+    def _codes(f: _Categorical, batch: MachineBatch) -> np.ndarray:
+        column = batch.categorical(f.name)
+        lookup = np.array([f.index.get(c, -1) for c in column.categories] +
+                          [-1], dtype=np.intp)
+        return lookup[column.codes]
+    # NOTE. Recoding. The batch interns categories in order of appearance,
+    # so we map its codes to the spec's through a lookup table with one
+    # entry for each category in the batch. Its last entry is for code
+    # ``-1`` (missing), which indexes it from the end.
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for serving with several worker processes.
+
+    gunicorn -c anomaly_detection/gunicorn_conf.py anomaly_detection.main:app
+
+The master imports the app and loads the model before forking the
+workers, so all the workers share the master's copy of the model pages
+copy-on-write instead of each loading their own. (With a memory-mapped
+bundle, see ``model``, they'd share the pages through the OS page cache
+anyway.) Each worker then runs the app's startup as usual, which finds
+the model already loaded and only starts the worker's own background
+threads.
+
+Settings come from the environment:
+
+* ``ANOMALY_HTTP_WORKERS``: how many worker processes to run.
+* ``ANOMALY_THREADPOOL_SIZE``: threads each worker has for sync
+  endpoints.
+* ``ANOMALY_BIND``: the address to listen on.
+"""
+
+from anomaly_detection.config import bind_address, http_workers
+
+
+bind = bind_address()
+workers = http_workers()
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+
+
+def when_ready(server):
+    from anomaly_detection.ai import provider
+
+    provider.warm_up()
+    server.log.info(f"loaded model version {provider.version()}")
+# NOTE. Preloading. Gunicorn calls this hook in the master after importing
+# the app and before forking any worker. We only load the model here, we
+# don't start any threads: forking a process with running threads is
+# asking for trouble.
+#
+# NOTE. Names. Gunicorn treats every module-level name that matches one of
+# its settings as that setting, so we can't have a ``config`` name here.
@@ -1,47 +1,185 @@
+"""
+Logging of notification processing.
+
+Summaries---counts, entity IDs, timings---get logged at ``INFO`` level,
+full dumps of entities and estimates at ``DEBUG``. Set the level through
+the ``ANOMALY_LOG_LEVEL`` environment variable.
+
+Messages only get rendered if their level is enabled and never get
+written out on the thread logging them: ``start`` routes our records
+through a bounded queue to a background thread that formats them and
+writes them to stdout. If the queue fills up, we drop records rather
+than block.
+"""
+
+import copy
 import logging
-from typing import Any
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+import sys
+from typing import Any, Callable, Iterable, Optional
 
-from anomaly_detection.ngsy import MachineEntity, AnomalyDetectionEntity
-from anomaly_detection.util.ngsi.entity import EntityUpdateNotification
+import anomaly_detection.config as config
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.ngsy import AnomalyDetectionEntity
 from anomaly_detection.util.ngsi.headers import FiwareContext
 
 
+ROOT_LOGGER_NAME = 'anomaly_detection'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+MAX_LOGGED_IDS = 10
+
+
 def _logger() -> logging.Logger:
     return logging.getLogger(__name__)
 
 
-def _format_mgs(lines: [Any]) -> str:
-    ls = [f"{line}\n" for line in lines]
-    return ''.join(ls)
+class _Lazy:
+
+    def __init__(self, render: Callable[[], str]):
+        self._render = render
+
+    def __str__(self) -> str:
+        return self._render()
+
+
+def _lines(items: Callable[[], Iterable[Any]]) -> _Lazy:
+    return _Lazy(lambda: ''.join(f"\n{x}" for x in items()))
+
+
+def _ids(ids: Callable[[], Iterable[Any]]) -> _Lazy:
+    def render() -> str:
+        xs = list(ids())
+        shown = ', '.join(str(x) for x in xs[:MAX_LOGGED_IDS])
+        more = len(xs) - MAX_LOGGED_IDS
+        return f"{shown}, ... ({more} more)" if more > 0 else shown
+
+    return _Lazy(render)
+# NOTE. Deferred formatting. We hand these objects to the logger as
+# message args, so the logger only turns them into strings if the
+# record makes it past the level check. Taking callables rather than
+# values means we don't even walk the input to collect IDs or rows
+# unless the message gets written.
 
 
 def info(msg: str):
-    # _logger().info(msg)
-    # TODO. ^ not printing anything to stdout. Figure out why.
-    # Have a look at:
-    # - uvicorn.main, uvicorn.config.LOGGING_CONFIG
-    # - https://github.com/tiangolo/uvicorn-gunicorn-fastapi-docker/issues/19
-    # - https://nuculabs.dev/2021/05/18/fastapi-uvicorn-logging-in-production/
-    # - https://stackoverflow.com/questions/66602480
+    _logger().info(msg)
+
 
-    print(msg)
+def received_ngsi_entity_update(ctx: FiwareContext, data: [dict]):
+    logger = _logger()
+    logger.info("got %d entity updates for %s", len(data), ctx)
+    logger.debug("entity updates for %s:%s", ctx, _lines(lambda: data))
 
 
-def received_ngsi_entity_update(ctx: FiwareContext,
-                                notification: EntityUpdateNotification):
-    header = f"got entity updates for {ctx}:"
-    msg = _format_mgs([header] + notification.data)
-    info(msg)
+def going_to_process_updates(ctx: FiwareContext, batch: MachineBatch):
+    logger = _logger()
+    logger.info("going to process %d machines for %s: %s",
+                len(batch), ctx, _ids(lambda: batch.ids))
+    logger.debug("machine updates for %s:%s", ctx, _lines(batch.rows))
 
 
-def going_to_process_updates(ctx: FiwareContext, ms: [MachineEntity]):
-    header = f"going to process updates for {ctx}:"
-    msg = _format_mgs([header] + ms)
-    info(msg)
+def processed_updates(ctx: FiwareContext, machines_n: int,
+                      estimates_n: int, secs: float):
+    _logger().info("scored %d machines for %s in %.1f ms, %d estimates",
+                   machines_n, ctx, secs * 1000, estimates_n)
 
 
 def going_to_update_context_with_estimates(ctx: FiwareContext,
                                            rs: [AnomalyDetectionEntity]):
-    header = f"going to update context ({ctx}) with estimates:"
-    msg = _format_mgs([header] + rs)
-    info(msg)
+    logger = _logger()
+    logger.info("going to update context (%s) with %d estimates: %s",
+                ctx, len(rs), _ids(lambda: (r.id for r in rs)))
+    logger.debug("estimates for %s:%s", ctx, _lines(lambda: rs))
+
+
+def updated_context(ctx: FiwareContext, estimates_n: int, secs: float):
+    _logger().info("updated context (%s) with %d estimates in %.1f ms",
+                   ctx, estimates_n, secs * 1000)
+
+
+class _DeferredQueueHandler(QueueHandler):
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+# NOTE. Prepare. We render the message before queueing the record, so
+# the record doesn't hold on to its args, e.g. whole batches or lists of
+# estimates, while it waits in the queue, nor render them after they've
+# changed. Rendering the message is all we do here though; the stock
+# ``QueueHandler`` also runs the whole formatter, timestamps and all,
+# which we leave to the listener's handler. Conversely, the listener has
+# got to wait for room in the queue to tell its thread to stop.
+
+
+_exc_formatter = logging.Formatter()
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_handler: Optional[_DeferredQueueHandler] = None
+_listener: Optional[_Listener] = None
+
+
+def start(level: Optional[str] = None):
+    """
+    Send our log records to stdout through a background writer.
+
+    :param level: the level to log at; defaults to the configured one.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(logging.Formatter(LOG_FORMAT))
+    queue = Queue(maxsize=config.log_queue_size())
+    _handler = _DeferredQueueHandler(queue)
+    _listener = _Listener(queue, out)
+
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.setLevel(level or config.log_level())
+    logger.addHandler(_handler)
+    logger.propagate = False
+    _listener.start()
+
+
+def stop():
+    """
+    Write out any queued records and stop the background writer.
+    """
+    global _handler, _listener
+    if _listener is None:
+        return
+
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.removeHandler(_handler)
+    logger.propagate = True
+    _listener.stop()
+    _handler, _listener = None, None
+
+
+def dropped() -> int:
+    """
+    :return: how many records got dropped because the queue was full.
+    """
+    return _handler.dropped if _handler else 0
@@ -1,18 +1,80 @@
-from fastapi import FastAPI, Header, Request
-from typing import Optional
-
-from anomaly_detection.enteater import process_update
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request, \
+    Response
+from anyio import to_thread
+import numpy as np
+from pydantic import ValidationError
+from threading import Event
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+import anomaly_detection.config as config
+from anomaly_detection.enteater import coalescer, orion_clients, \
+    process_update, published, results, writer
 import anomaly_detection.log as log
+import anomaly_detection.metrics as metrics
+from anomaly_detection.batch import MachineBatch
 from anomaly_detection.ngsy import MachineEntity, RawReading
-from anomaly_detection.util.ngsi.entity import EntityUpdateNotification
+from anomaly_detection.pipeline import NotificationPipeline, QueueFullError
+from anomaly_detection.util.ngsi.entity import EntityUpdateNotification, \
+    filter_raw_entities
 from anomaly_detection.util.ngsi.headers import FiwareContext
-from anomaly_detection.ai import predict
+from anomaly_detection.ai import provider, score_batch, shut_down, warm_up
+from anomaly_detection.util.ndjson import read_batches
 
 import uvicorn, json
 
 VERSION = '0.1.0'
+RAW_READINGS_CHUNK_SIZE = 1024
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+LABEL_LINES = [b'{"Label": 0.0}\n', b'{"Label": 1.0}\n', b'{"Label": null}\n']
 
 app = FastAPI()
+pipeline = NotificationPipeline.from_config(process_update)
+metrics.queue_depth.set_function(pipeline.depth)
+
+
+ready = Event()
+
+
+@app.on_event('startup')
+def load_model():
+    log.start()
+    _size_threadpool()
+    warm_up()
+    writer.start()
+    coalescer.start()
+    pipeline.start()
+    ready.set()
+
+
+@app.on_event('shutdown')
+def unload_model():
+    ready.clear()
+    pipeline.stop()
+    coalescer.stop()
+    writer.stop()
+    orion_clients.close()
+    shut_down()
+    log.stop()
+
+
+def _size_threadpool():
+    size = config.threadpool_size()
+    if size:
+        to_thread.current_default_thread_limiter().total_tokens = size
+# NOTE. Thread pool. FastAPI runs sync endpoints in AnyIO's default
+# thread pool, which has 40 threads unless we say otherwise. The pool is
+# per event loop, so with several worker processes each gets its own.
+
+
+@app.get("/ready")
+def read_readiness():
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail='warming up')
+    return {'ready': True, 'version': provider.version()}
+# NOTE. Readiness. We only flag the app as ready at the end of startup,
+# after the model got loaded and scored a sample, so load balancers and
+# Kubernetes probes don't route traffic to a worker that's still cold.
 
 
 @app.get('/')
@@ -25,41 +87,149 @@ def read_version():
     return read_root()
 
 
-@app.post("/updates")
-def post_updates(notification: EntityUpdateNotification,
-                 fiware_service: Optional[str] = Header(None),
-                 fiware_servicepath: Optional[str] = Header(None),
-                 fiware_correlator: Optional[str] = Header(None)):
+@app.get("/admin/model")
+def read_model_version():
+    return {'version': provider.version()}
+
+
+@app.post("/admin/model/reload", status_code=202)
+def reload_model(tasks: BackgroundTasks):
+    tasks.add_task(provider.reload)
+    return read_model_version()
+
+
+@app.get("/metrics")
+def read_metrics():
+    return Response(content=metrics.registry.render(),
+                    media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/admin/pipeline")
+def read_pipeline_stats():
+    stats = {**pipeline.stats(), 'upserts': coalescer.stats(),
+             'orion_writer': writer.stats(),
+             'orion_clients': orion_clients.stats()}
+    if results is not None:
+        stats['results'] = results.stats()
+    if published is not None:
+        stats['published'] = published.stats()
+    return stats
+
+
+@app.post("/updates", status_code=204)
+async def post_updates(notification: Request,
+                       fiware_service: Optional[str] = Header(None),
+                       fiware_servicepath: Optional[str] = Header(None),
+                       fiware_correlator: Optional[str] = Header(None)):
     ctx = FiwareContext(
         service=str(fiware_service), service_path=str(fiware_servicepath),
         correlator=str(fiware_correlator)
     )
 
-    log.received_ngsi_entity_update(ctx, notification)
-
-    updated_machines = notification.filter_entities(MachineEntity)
+    body = await notification.body()
+    start = time.perf_counter()
+    try:
+        body = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail='malformed JSON')
+    data = _notification_data(body)
+    parsed = time.perf_counter()
+    metrics.parse_seconds.observe(parsed - start)
+    log.received_ngsi_entity_update(ctx, data)
+
+    updated_machines = filter_raw_entities(data, MachineEntity.entity_type())
+    metrics.filter_seconds.observe(time.perf_counter() - parsed)
     if updated_machines:
-        process_update(ctx, updated_machines)
+        try:
+            pipeline.submit(ctx, updated_machines)
+        except QueueFullError:
+            raise HTTPException(status_code=429, detail='too many updates')
+
+    return Response(status_code=204)
+
 
+def _notification_data(body: Any) -> List[Any]:
+    data = body.get('data') if isinstance(body, dict) else None
+    if not isinstance(data, list):
+        raise HTTPException(status_code=422,
+                            detail='expected a notification with a data array')
+
+    if config.validate_notifications():
+        try:
+            EntityUpdateNotification(data=data) \
+                .filter_entities(MachineEntity)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors())
+
+    return data
+# NOTE. Fast path. Parsing the notification into pydantic models is the
+# most expensive thing we'd do per notification, so we skip it and pull
+# out of the raw JSON only what scoring needs. Set the validation flag
+# in the config to also parse the machine entities into models and
+# reject any notification that doesn't validate.
 
 
 @app.post("/rawReading")
 async  def raw_reading(data: Request):
     req_info = await data.json()
-    #print(req_info)
-    if req_info.get('id', 0):
-        machine1 = MachineEntity(id='').set_id_with_type_prefix(req_info.get('id'))
-        req_info.pop('id')
-    else:
-        machine1 = MachineEntity(id='').set_id_with_type_prefix('1')
+    req_info.pop('id', None)
     rr = RawReading(**req_info)
 
-    x = rr.to_machine_entity(entity_id=machine1.id)
-
-    out = json.loads(predict(x).to_json())
-
-
-    return {"Label": out['Label']['value']}
+    batch = MachineBatch.from_raw_readings([rr])
+    labels, _ = score_batch(batch)
+    if np.isnan(labels[0]):
+        required = provider.get().features.spec.required()
+        missing = [name for name in required
+                   if np.isnan(batch.numeric(name)[0])]
+        raise HTTPException(status_code=422,
+                            detail=f"missing readings: {', '.join(missing)}")
+
+    return {"Label": float(labels[0])}
+# NOTE. Missing readings. Which readings the model can't do without
+# comes from its feature spec, so we only find out the reading can't be
+# scored once we've tried.
+
+
+async def _json_array_batches(readings: List[Any]) -> AsyncIterator[List[Any]]:
+    for k in range(0, len(readings), RAW_READINGS_CHUNK_SIZE):
+        yield readings[k:k + RAW_READINGS_CHUNK_SIZE]
+
+
+def _label_lines(readings: List[Any]) -> bytes:
+    batch = MachineBatch.from_raw_readings(readings)
+    labels, _ = score_batch(batch)
+    codes = np.where(np.isnan(labels), 2, labels).astype(int)
+    return b''.join([LABEL_LINES[c] for c in codes])
+
+
+@app.post("/rawReadings")
+async def raw_readings(data: Request):
+    content_type = data.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        try:
+            readings = await data.json()
+        except ValueError:
+            raise HTTPException(status_code=422, detail='malformed JSON')
+        if not isinstance(readings, list):
+            raise HTTPException(status_code=422,
+                                detail='expected an array of readings')
+        batches = _json_array_batches(readings)
+    else:
+        batches = read_batches(data.stream(), RAW_READINGS_CHUNK_SIZE)
+
+    out = [_label_lines(readings) async for readings in batches]
+    return Response(content=b''.join(out), media_type=NDJSON_MEDIA_TYPE)
+# NOTE. Input formats. Clients can either send a JSON array of readings
+# or stream readings as NDJSON, one reading per line. Either way we reply
+# with NDJSON labels, one line for each reading in the same order as the
+# input. The label is null if the reading has no Joules or we can't parse
+# it. We score NDJSON input in chunks as it comes in, so we never hold
+# more than a chunk of parsed readings in memory.
+# NOTE. Streaming the reply. We can't start sending labels back until
+# we've read the whole request: Starlette's StreamingResponse listens for
+# client disconnects on the same receive channel we'd read the request
+# body from, so the two would race for body chunks. Labels are tiny
+# though, so buffering them is cheap.
 
 
 # if __name__ == '__main__':
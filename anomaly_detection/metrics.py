@@ -0,0 +1,211 @@
+"""
+Counters and latency histograms, exposed in Prometheus text format.
+
+We keep track of how long each stage of processing a notification takes
+and of how much work goes through the service:
+
+* ``anomaly_stage_seconds``: latency histogram for each stage, i.e.
+  parsing the notification, filtering machine entities out of it,
+  scoring machines, serialising estimates and the Orion round trip.
+* ``anomaly_entities_processed_total``: machines scored.
+* ``anomaly_anomalies_flagged_total``: machines scored as anomalies.
+* ``anomaly_orion_errors_total``: failed Orion upserts.
+* ``anomaly_queue_depth``: notifications waiting in the pipeline queue.
+
+Recording a value takes a lock and a few additions, so it's cheap enough
+to do on every request. Rendering is only done when ``/metrics`` gets
+scraped.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def _format_value(x: float) -> str:
+    if x == float('inf'):
+        return '+Inf'
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Counter:
+    """
+    Monotonically increasing count.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, labels: Labels = ()):
+        self.labels = labels
+        self._value = 0
+        self._lock = Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self._value += n
+
+    def value(self) -> int:
+        return self._value
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{_format_labels(self.labels)} {self._value}"]
+
+
+class Gauge:
+    """
+    Value read off a function at scrape time.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, labels: Labels = ()):
+        self.labels = labels
+        self._read: Optional[Callable[[], float]] = None
+
+    def set_function(self, read: Callable[[], float]):
+        self._read = read
+
+    def value(self) -> float:
+        return self._read() if self._read else 0
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{_format_labels(self.labels)} " +
+                _format_value(self.value())]
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, labels: Labels = (), buckets=LATENCY_BUCKETS):
+        self.labels = labels
+        self._bounds = list(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, x: float):
+        k = bisect_left(self._bounds, x)
+        with self._lock:
+            self._counts[k] += 1
+            self._sum += x
+
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def samples(self, name: str) -> List[str]:
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+
+        lines, cumulative = [], 0
+        for bound, n in zip(self._bounds + [float('inf')], counts):
+            cumulative += n
+            le = (('le', _format_value(bound)),)
+            lines.append(f"{name}_bucket{_format_labels(self.labels, le)} " +
+                         f"{cumulative}")
+        lines.append(f"{name}_sum{_format_labels(self.labels)} {total!r}")
+        lines.append(f"{name}_count{_format_labels(self.labels)} " +
+                     f"{cumulative}")
+        return lines
+# NOTE. Buckets. We count each observation in the first bucket whose
+# upper bound it doesn't exceed and only add up counts at scrape time,
+# so observing touches one bucket rather than all the ones above it.
+
+
+class Registry:
+    """
+    Named metrics, each with one series for each set of labels.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, list]] = {}
+        self._lock = Lock()
+
+    def _register(self, name: str, help_text: str, metric):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (metric.kind, help_text, [])
+            family[2].append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._register(name, help_text,
+                              Counter(tuple(labels.items())))
+
+    def gauge(self, name: str, help_text: str, **labels) -> Gauge:
+        return self._register(name, help_text, Gauge(tuple(labels.items())))
+
+    def histogram(self, name: str, help_text: str, **labels) -> Histogram:
+        return self._register(name, help_text,
+                              Histogram(tuple(labels.items())))
+
+    def render(self) -> str:
+        """
+        :return: all the metrics in Prometheus text format.
+        """
+        with self._lock:
+            families = list(self._families.items())
+
+        lines = []
+        for name, (kind, help_text, metrics) in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for m in metrics:
+                lines.extend(m.samples(name))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+_STAGE_HELP = 'Time spent in each notification processing stage.'
+parse_seconds = registry.histogram('anomaly_stage_seconds', _STAGE_HELP,
+                                   stage='parse')
+filter_seconds = registry.histogram('anomaly_stage_seconds', _STAGE_HELP,
+                                    stage='filter')
+predict_seconds = registry.histogram('anomaly_stage_seconds', _STAGE_HELP,
+                                     stage='predict')
+serialize_seconds = registry.histogram('anomaly_stage_seconds', _STAGE_HELP,
+                                       stage='serialize')
+orion_seconds = registry.histogram('anomaly_stage_seconds', _STAGE_HELP,
+                                   stage='orion')
+
+entities_processed = registry.counter('anomaly_entities_processed_total',
+                                      'Machines scored.')
+anomalies_flagged = registry.counter('anomaly_anomalies_flagged_total',
+                                     'Machines scored as anomalies.')
+orion_errors = registry.counter('anomaly_orion_errors_total',
+                                'Failed Orion upserts.')
+queue_depth = registry.gauge('anomaly_queue_depth',
+                             'Notifications waiting to be processed.')
+result_cache_hits = registry.counter('anomaly_result_cache_hits_total',
+                                     'Readings dropped as already scored.')
+result_cache_misses = registry.counter('anomaly_result_cache_misses_total',
+                                       'Readings not scored before.')
+upserts_suppressed = registry.counter(
+    'anomaly_upserts_suppressed_total',
+    'Estimates not sent to Orion since they match the last ones sent.')
+spilled_estimates = registry.gauge(
+    'anomaly_spilled_estimates', 'Estimates waiting for Orion to come back.')
+orion_breaker_open = registry.gauge(
+    'anomaly_orion_breaker_open',
+    '1 if we stopped writing to Orion for a while, 0 otherwise.')
+windowed_machines = registry.gauge('anomaly_windowed_machines',
+                                   'Machines with a window of readings.')
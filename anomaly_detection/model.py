@@ -0,0 +1,338 @@
+"""
+Loads the anomaly detection model on demand.
+
+The model can come either from the PyOD pickle we train offline or from
+a bundle directory holding the compiled forest arrays (see
+``CompiledForest.save``). Loading a pickle means unpickling the whole
+PyOD object and compiling it, which each process has to do on its own.
+Loading a bundle is cheap and, with memory-mapping on, all the processes
+on the box share the same pages of the node arrays.
+
+To turn a pickle into a bundle:
+
+    python -m anomaly_detection.model data/anomaly_detection.pkl \
+        data/anomaly_detection.forest
+
+Instead of a single model, you can also point us to a model directory
+holding several versions of the model, each either a pickle or a bundle.
+In that case we serve the latest version, i.e. the one whose name sorts
+last, e.g. given
+
+    models/
+        2022-05-01.pkl
+        2022-06-01.forest/
+
+the version we serve is ``2022-06-01``. You can drop new versions in the
+directory while the service is running and we'll load them in the
+background, then swap them in without interrupting scoring.
+
+Each model can come with a spec of the features it takes, see
+``features``. Converting a pickle to a bundle copies its spec over too.
+
+"""
+
+import logging
+import pickle
+import shutil
+import sys
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Optional, Union
+
+import numpy as np
+
+import anomaly_detection.config as config
+from anomaly_detection.features import FeatureExtractor, load_spec, \
+    spec_path
+from anomaly_detection.iforest import CompiledForest, PARAMS_FILE_NAME
+from anomaly_detection.ttable import ThresholdTable
+
+
+Scorer = Union[CompiledForest, ThresholdTable]
+PICKLE_EXT = '.pkl'
+
+
+def load_forest(path: Path, mmap: bool = True) -> CompiledForest:
+    """
+    Load the forest from either a PyOD pickle or a bundle directory.
+
+    :param path: the pickle file or the bundle directory.
+    :param mmap: memory-map the bundle arrays? Ignored for pickles.
+    :return: the compiled forest.
+    """
+    if path.is_dir():
+        return CompiledForest.load(path, mmap_mode='r' if mmap else None)
+
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    return CompiledForest.from_model(model)
+
+
+def new_scorer(forest: CompiledForest, mode: str) -> Scorer:
+    """
+    Build the scoring engine for the given mode.
+
+    :param forest: the compiled forest.
+    :param mode: one of the ``config`` scoring modes.
+    :return: the forest itself or its threshold table. Only forests
+        trained on a single feature can be tabulated, the others score
+        with the forest in either mode.
+    """
+    if mode == config.TABLE_SCORING:
+        if forest.n_features == 1:
+            return ThresholdTable.from_forest(forest)
+        _logger().warning(
+            f"can't tabulate a model with {forest.n_features} features, " +
+            "scoring with the forest instead")
+    return forest
+
+
+class Model:
+    """
+    A version of the model, ready to score.
+    """
+
+    def __init__(self, version: str, scorer: Scorer,
+                 features: FeatureExtractor):
+        self.version = version
+        self.scorer = scorer
+        self.features = features
+
+
+def load_model(path: Path, mode: str, mmap: bool = True) -> Model:
+    """
+    Load the model at the given path and build its scorer.
+
+    :param path: the pickle file or the bundle directory.
+    :param mode: one of the ``config`` scoring modes.
+    :param mmap: memory-map bundle arrays.
+    :return: the model, versioned after the file or directory name
+        without extension.
+    :raise ValueError: if the model's feature spec doesn't match the
+        number of features the model was trained on.
+    """
+    forest = load_forest(path, mmap)
+    features = FeatureExtractor(load_spec(path))
+    if features.width != forest.n_features:
+        raise ValueError(
+            f"{spec_path(path)} lists {features.width} features but the " +
+            f"model takes {forest.n_features}")
+    scorer = new_scorer(forest, mode)
+    scorer.predict(np.zeros((1, forest.n_features)))
+    return Model(version=_version_of(path), scorer=scorer, features=features)
+# NOTE. Pre-warming. We score a sample before handing out the model so
+# any lazy initialisation and page faults happen here rather than on the
+# first request.
+
+
+def _version_of(path: Path) -> str:
+    return path.stem
+
+
+def _is_model(path: Path) -> bool:
+    if path.is_dir():
+        return (path / PARAMS_FILE_NAME).is_file()
+    return path.suffix == PICKLE_EXT
+
+
+def latest_model_path(model_dir: Path) -> Optional[Path]:
+    """
+    Find the latest model version in a model directory.
+
+    :param model_dir: the directory with the model versions.
+    :return: the path to the version whose name sorts last, if any.
+    """
+    candidates = [p for p in model_dir.iterdir() if _is_model(p)]
+    if not candidates:
+        return None
+    return max(candidates, key=_version_of)
+
+
+class ModelProvider:
+    """
+    Hands out the model, loading it the first time it's needed.
+    Safe to share among threads.
+    """
+
+    def __init__(self, path: Path, mode: str, mmap: bool = True):
+        """
+        Create a new instance. Nothing gets loaded until you call ``get``
+        or ``warm_up``.
+
+        :param path: the pickle file or the bundle directory.
+        :param mode: one of the ``config`` scoring modes.
+        :param mmap: memory-map bundle arrays.
+        """
+        self._path = path
+        self._mode = mode
+        self._mmap = mmap
+        self._model: Optional[Model] = None
+        self._lock = Lock()
+
+    @staticmethod
+    def from_config() -> 'ModelProvider':
+        """
+        :return: a provider for the model configured in the environment.
+            If there's a model directory, the provider is a registry
+            watching that directory.
+        """
+        model_dir = config.model_dir()
+        if model_dir:
+            return ModelRegistry(model_dir=model_dir,
+                                 mode=config.scoring_mode(),
+                                 mmap=config.model_mmap(),
+                                 poll_interval=config.model_poll_interval())
+        return ModelProvider(path=config.model_path(),
+                             mode=config.scoring_mode(),
+                             mmap=config.model_mmap())
+
+    def _model_path(self) -> Path:
+        return self._path
+
+    def _load(self) -> Model:
+        return load_model(self._model_path(), self._mode, self._mmap)
+
+    def is_loaded(self) -> bool:
+        """
+        :return: ``True`` if the model got loaded already.
+        """
+        return self._model is not None
+
+    def get(self) -> Model:
+        """
+        Get the model, loading it if this is the first call.
+
+        :return: the model.
+        """
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+                model = self._model
+        return model
+
+    def warm_up(self):
+        """
+        Load the model now rather than on the first request.
+        """
+        self.get()
+
+    def version(self) -> Optional[str]:
+        """
+        :return: the version being served, if the model got loaded yet.
+        """
+        model = self._model
+        return model.version if model else None
+
+    def reload(self) -> bool:
+        """
+        Pick up a new model version. Nothing to do here since there's only
+        one version.
+
+        :return: ``False``.
+        """
+        return False
+
+    def start(self):
+        """
+        Start any background work. Nothing to do here.
+        """
+        pass
+
+    def stop(self):
+        """
+        Stop any background work. Nothing to do here.
+        """
+        pass
+
+
+class ModelRegistry(ModelProvider):
+    """
+    Serves the latest model version in a model directory, loading new
+    versions in the background as they show up.
+
+    Swapping versions is atomic: ``get`` always returns a fully loaded
+    model, either the old or the new one, never waits on a reload and
+    never sees a half-built model.
+    """
+
+    def __init__(self, model_dir: Path, mode: str, mmap: bool = True,
+                 poll_interval: float = 0):
+        """
+        Create a new instance.
+
+        :param model_dir: the directory with the model versions.
+        :param mode: one of the ``config`` scoring modes.
+        :param mmap: memory-map bundle arrays.
+        :param poll_interval: how many seconds to wait between checks
+            for new versions. Zero or less means don't watch the
+            directory; call ``reload`` to pick up new versions.
+        """
+        super().__init__(model_dir, mode, mmap)
+        self._poll_interval = poll_interval
+        self._reload_lock = Lock()
+        self._stopped = Event()
+        self._watcher: Optional[Thread] = None
+
+    def _model_path(self) -> Path:
+        path = latest_model_path(self._path)
+        if path is None:
+            raise FileNotFoundError(f"no models in {self._path}")
+        return path
+
+    def reload(self) -> bool:
+        """
+        Load the latest version if it isn't the one being served and then
+        swap it in. Concurrent reloads are serialised, but ``get`` doesn't
+        wait on them.
+
+        :return: ``True`` if a new version got swapped in.
+        """
+        with self._reload_lock:
+            path = latest_model_path(self._path)
+            if path is None or _version_of(path) == self.version():
+                return False
+
+            model = load_model(path, self._mode, self._mmap)
+            self._model = model
+            _logger().info(f"now serving model version {model.version}")
+            return True
+
+    def _watch(self):
+        while not self._stopped.wait(self._poll_interval):
+            try:
+                self.reload()
+            except Exception:
+                _logger().exception("failed to reload model")
+
+    def start(self):
+        """
+        Start watching the model directory for new versions if a poll
+        interval was given.
+        """
+        if self._poll_interval > 0 and self._watcher is None:
+            self._stopped.clear()
+            self._watcher = Thread(target=self._watch, daemon=True,
+                                   name='model-registry')
+            self._watcher.start()
+
+    def stop(self):
+        """
+        Stop watching the model directory.
+        """
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+
+def _logger() -> logging.Logger:
+    return logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+    source, target = map(Path, sys.argv[1:3])
+    load_forest(source).save(target)
+    if spec_path(source).is_file():
+        shutil.copyfile(spec_path(source), spec_path(target))
@@ -159,6 +159,7 @@ class AnomalyDetectionEntity(BaseEntity):
     type = 'AnomalyDetection'
     #sensor = dict
     Label: FloatAttr
+    ModelVersion: Optional[TextAttr]
 
 
 
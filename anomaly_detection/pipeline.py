@@ -0,0 +1,203 @@
+"""
+Background processing of entity update notifications.
+
+Orion shouldn't have to wait for us to score machines and write the
+estimates back before we acknowledge its notification. So we just queue
+the machines up and let a pool of worker threads take it from there.
+Workers drain the queue in batches: they grab as many queued machines
+as they can up to a batch size, group them by FIWARE service and
+service path, and then process each group in one go.
+
+The queue is bounded. When it's full we refuse new work instead of
+buffering an unlimited backlog in memory, so Orion gets a chance to
+back off and retry.
+"""
+
+import logging
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+import anomaly_detection.config as config
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+Handler = Callable[[FiwareContext, List[dict]], None]
+
+
+class QueueFullError(Exception):
+    """
+    Raised when there's no room left in the queue.
+    """
+    pass
+
+
+class _Job:
+
+    def __init__(self, ctx: FiwareContext, machines: List[dict]):
+        self.ctx = ctx
+        self.machines = machines
+
+    def group_key(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.ctx.service, self.ctx.service_path
+
+
+_STOP = None
+
+
+class NotificationPipeline:
+    """
+    Bounded work queue drained by a pool of worker threads.
+    """
+
+    def __init__(self, handler: Handler, max_size: int = 1000,
+                 workers_n: int = 4, batch_size: int = 500):
+        """
+        Create a new instance. Call ``start`` to fire up the workers.
+
+        :param handler: what to do with a batch of machines.
+        :param max_size: max number of notifications in the queue.
+        :param workers_n: how many worker threads to run.
+        :param batch_size: max number of machines a worker grabs in
+            one go. A single notification with more machines than that
+            still gets processed in one go.
+        """
+        self._handler = handler
+        self._queue = Queue(maxsize=max_size)
+        self._workers_n = workers_n
+        self._batch_size = batch_size
+        self._workers: List[Thread] = []
+        self._stats_lock = Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+
+    @staticmethod
+    def from_config(handler: Handler) -> 'NotificationPipeline':
+        """
+        :param handler: what to do with a batch of machines.
+        :return: a pipeline sized as configured in the environment.
+        """
+        return NotificationPipeline(handler=handler,
+                                    max_size=config.queue_size(),
+                                    workers_n=config.workers_n(),
+                                    batch_size=config.worker_batch_size())
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        if self._workers:
+            return
+        self._workers = [
+            Thread(target=self._work, daemon=True, name=f"pipeline-{k}")
+            for k in range(self._workers_n)
+        ]
+        for w in self._workers:
+            w.start()
+
+    def stop(self):
+        """
+        Process whatever is still in the queue and then stop the workers.
+        Blocks until all the workers are done.
+        """
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for w in self._workers:
+            w.join()
+        self._workers = []
+
+    def submit(self, ctx: FiwareContext, machines: List[dict]):
+        """
+        Queue machines up for processing.
+
+        :param ctx: the FIWARE context the machines come from.
+        :param machines: the raw machine entities to process.
+        :raise QueueFullError: if there's no room left in the queue.
+        """
+        try:
+            self._queue.put_nowait(_Job(ctx, machines))
+        except Full:
+            self._count(rejected=1)
+            raise QueueFullError()
+        self._count(submitted=1)
+
+    def depth(self) -> int:
+        """
+        :return: how many notifications are waiting in the queue.
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: queue depth and capacity, plus counts of submitted and
+            rejected notifications and of processed and failed batches.
+        """
+        with self._stats_lock:
+            return {
+                'depth': self.depth(),
+                'capacity': self._queue.maxsize,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'processed': self._processed,
+                'failed': self._failed
+            }
+
+    def _count(self, submitted=0, rejected=0, processed=0, failed=0):
+        with self._stats_lock:
+            self._submitted += submitted
+            self._rejected += rejected
+            self._processed += processed
+            self._failed += failed
+
+    def _next_batch(self) -> Tuple[List[_Job], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        jobs, size = [first], len(first.machines)
+        while size < self._batch_size:
+            try:
+                job = self._queue.get_nowait()
+            except Empty:
+                break
+            if job is _STOP:
+                return jobs, True
+            jobs.append(job)
+            size += len(job.machines)
+
+        return jobs, False
+
+    def _work(self):
+        stop = False
+        while not stop:
+            jobs, stop = self._next_batch()
+            for ctx, machines in _group(jobs):
+                self._process(ctx, machines)
+
+    def _process(self, ctx: FiwareContext, machines: List[dict]):
+        try:
+            self._handler(ctx, machines)
+            self._count(processed=1)
+        except Exception:
+            self._count(failed=1)
+            _logger().exception(f"failed to process updates for {ctx}")
+
+
+def _group(jobs: List[_Job]) -> List[Tuple[FiwareContext, List[dict]]]:
+    groups: Dict[Tuple, _Job] = {}
+    for job in jobs:
+        key = job.group_key()
+        if key in groups:
+            groups[key].machines.extend(job.machines)
+        else:
+            groups[key] = _Job(job.ctx, list(job.machines))
+    return [(g.ctx, g.machines) for g in groups.values()]
+# NOTE. Correlator. When grouping notifications, the batch inherits the
+# FIWARE context of the first notification in the group, correlator
+# included.
+
+
+def _logger() -> logging.Logger:
+    return logging.getLogger(__name__)
@@ -0,0 +1,133 @@
+"""
+Change-only upserts.
+
+Upserting an estimate that's the same as the one Orion already has for
+the machine doesn't change anything in Orion, but it still makes Orion
+notify all its subscribers, e.g. QuantumLeap. So, optionally, we keep
+the last estimate we sent out for each machine and only send out new
+estimates that differ from it, either in the label or in the version of
+the model that came up with it.
+
+Memory is bounded: we remember at most a given number of machines,
+dropping the least recently updated ones first. Forgetting a machine
+just means its next estimate goes out no matter what.
+
+Examples
+--------
+
+>>> labels = PublishedLabels(capacity=10)
+>>> e = AnomalyDetectionEntity(id='m1', Label=FloatAttr.new(1))
+>>> len(labels.changed(None, [e])), len(labels.changed(None, [e]))
+(1, 0)
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import anomaly_detection.config as config
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util.ngsi.entity import FloatAttr
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+Published = Tuple[float, Optional[str]]
+
+
+def _published(e: AnomalyDetectionEntity) -> Published:
+    version = e.ModelVersion.value if e.ModelVersion else None
+    return e.Label.value, version
+
+
+class PublishedLabels:
+    """
+    Bounded record of the last estimate sent out for each machine.
+    Safe to share among threads.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        """
+        Create a new instance.
+
+        :param capacity: max number of machines to remember.
+        """
+        self._capacity = capacity
+        self._last: Dict[Hashable, Published] = OrderedDict()
+        self._lock = Lock()
+        self._changed = 0
+        self._suppressed = 0
+
+    @staticmethod
+    def from_config() -> Optional['PublishedLabels']:
+        """
+        :return: a record with the settings configured in the environment
+            or ``None`` if change-only upserts are turned off.
+        """
+        if not config.change_only_upserts():
+            return None
+        return PublishedLabels(capacity=config.published_labels_size())
+
+    @staticmethod
+    def _key(ctx: Optional[FiwareContext], eid: str) -> Hashable:
+        if ctx is None:
+            return None, None, eid
+        return ctx.service, ctx.service_path, eid
+
+    def changed(self, ctx: Optional[FiwareContext],
+                estimates: List[AnomalyDetectionEntity]) \
+            -> List[AnomalyDetectionEntity]:
+        """
+        Pick out the estimates that differ from the last ones sent out
+        and record them as the last ones.
+
+        :param ctx: the FIWARE context the estimates belong to.
+        :param estimates: the estimates about to be sent out.
+        :return: the estimates worth sending, in the same order.
+        """
+        keep = []
+        with self._lock:
+            for e in estimates:
+                key = self._key(ctx, e.id)
+                current = _published(e)
+                if self._last.get(key) == current:
+                    self._last.move_to_end(key)
+                    continue
+
+                keep.append(e)
+                self._last[key] = current
+                self._last.move_to_end(key)
+                if len(self._last) > self._capacity:
+                    self._last.popitem(last=False)
+
+            self._changed += len(keep)
+            self._suppressed += len(estimates) - len(keep)
+        return keep
+    # NOTE. Ordering. We record estimates as soon as they're handed over
+    # to be sent rather than when Orion acknowledges them. Otherwise an
+    # estimate could get compared to an older one still on its way to
+    # Orion and be dropped even though it differs from the one that ends
+    # up in Orion. If sending fails, call ``forget``.
+
+    def forget(self, ctx: Optional[FiwareContext], ids: List[str]):
+        """
+        Forget the last estimates of the given machines, e.g. because we
+        failed to send them, so their next estimates go out for sure.
+
+        :param ctx: the FIWARE context the machines belong to.
+        :param ids: the machine IDs.
+        """
+        with self._lock:
+            for eid in ids:
+                self._last.pop(self._key(ctx, eid), None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: how many machines we remember and counts of estimates
+            let through and suppressed.
+        """
+        with self._lock:
+            return {
+                'size': len(self._last),
+                'changed': self._changed,
+                'suppressed': self._suppressed
+            }
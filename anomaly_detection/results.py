@@ -0,0 +1,221 @@
+"""
+Remembers which readings we already scored.
+
+Orion sends the whole entity on each notification, so we often get the
+same machine reading more than once, e.g. when some other attribute of
+the machine changed or Orion retried a notification. Scoring it again
+would just produce the same estimate and upsert it again, which in turn
+makes Orion notify its subscribers for nothing.
+
+So for each machine we remember a fingerprint of the last reading we
+handled, made of its ``Datetime`` and of the values of every reading
+the model takes as listed in its feature spec, and drop any reading
+whose fingerprint matches before it gets to the model. We only remember
+a reading once it's been scored, and forget it if its estimate doesn't
+make it to Orion, so the reading gets another go when it comes back.
+Memory is bounded: we remember at most a given number of machines,
+dropping the least recently seen ones first, and forget each
+fingerprint after a while so an unchanged reading gets republished
+every now and then.
+
+Caching is off unless you set a cache size in the environment.
+
+Examples
+--------
+
+>>> cache = ResultCache(capacity=10, ttl=60)
+>>> batch = MachineBatch.from_raw_readings(
+...     [{'Joules': 7.0, 'Datetime': '2022-06-08 00:00:00'}], ids=['m1'])
+>>> len(cache.drop_seen(None, batch))
+1
+>>> cache.remember(None, batch)
+>>> len(cache.drop_seen(None, batch))
+0
+>>> cache.stats()['hits']
+1
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from anomaly_detection.batch import CATEGORICAL_ATTRS, NUMERIC_ATTRS, \
+    MachineBatch
+import anomaly_detection.config as config
+from anomaly_detection.features import FeatureSpec
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+Fingerprint = Tuple[Hashable, ...]
+
+
+def fingerprints(batch: MachineBatch,
+                 spec: Optional[FeatureSpec] = None) -> List[Fingerprint]:
+    """
+    :param batch: the machines.
+    :param spec: the features the model takes. Defaults to just
+        ``Joules``.
+    :return: the fingerprint of each machine's reading.
+    """
+    spec = spec if spec is not None else FeatureSpec.default()
+    numeric = {f.name for f in spec.numeric}
+    parts = [batch.text('Datetime')]
+    for name in spec.inputs():
+        if name not in _READINGS:
+            continue
+        if name in numeric:
+            values = batch.numeric(name)
+            valid = ~np.isnan(values)
+            parts.append(np.where(valid, values, 0).tolist())
+            parts.append(valid.tolist())
+        else:
+            parts.append(batch.text(name))
+    return list(zip(*parts))
+# NOTE. NaN. We can't put ``NaN`` in the fingerprint since it isn't equal
+# to itself, so we use a flag for whether there's a value.
+# NOTE. Derived features. We only fingerprint the readings the model
+# takes, not features derived from them like ``Joules_mean``. Those only
+# get values once the batch is past the cache and into the windows, so
+# they'd make the fingerprint of a reading differ between checking and
+# remembering it. They follow from the readings anyway.
+
+
+_READINGS = frozenset(NUMERIC_ATTRS + CATEGORICAL_ATTRS)
+
+
+class ResultCache:
+    """
+    Bounded, expiring record of the last reading scored for each machine.
+    Safe to share among threads.
+    """
+
+    def __init__(self, capacity: int = 10000, ttl: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Create a new instance.
+
+        :param capacity: max number of machines to remember.
+        :param ttl: how many seconds to remember a reading for.
+        :param clock: where to get the current time from, in seconds.
+        """
+        self._capacity = capacity
+        self._ttl = ttl
+        self._clock = clock
+        self._seen: Dict[Hashable, Tuple[Fingerprint, float]] = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    @staticmethod
+    def from_config() -> Optional['ResultCache']:
+        """
+        :return: a cache with the settings configured in the environment
+            or ``None`` if caching is turned off.
+        """
+        capacity = config.result_cache_size()
+        if capacity <= 0:
+            return None
+        return ResultCache(capacity=capacity, ttl=config.result_cache_ttl())
+
+    @staticmethod
+    def _key(ctx: Optional[FiwareContext], eid: str) -> Hashable:
+        if ctx is None:
+            return None, None, eid
+        return ctx.service, ctx.service_path, eid
+
+    def drop_seen(self, ctx: Optional[FiwareContext], batch: MachineBatch,
+                  spec: Optional[FeatureSpec] = None) -> MachineBatch:
+        """
+        Filter out the readings we've already handled. Call ``remember``
+        with the batch you get back once you've scored it.
+
+        :param ctx: the FIWARE context the batch comes from.
+        :param batch: the machines.
+        :param spec: the features the model takes.
+        :return: the machines with readings we haven't seen yet. Same
+            batch if there are no repeats.
+        """
+        fps = fingerprints(batch, spec)
+        now = self._clock()
+        fresh = []
+        in_batch = set()
+        with self._lock:
+            for k, (eid, fp) in enumerate(zip(batch.ids, fps)):
+                if not isinstance(eid, str):
+                    fresh.append(k)
+                    continue
+                key = self._key(ctx, eid)
+                seen = self._seen.get(key)
+                if seen is not None and seen[0] == fp and seen[1] > now:
+                    self._seen.move_to_end(key)
+                    continue
+                if (key, fp) in in_batch:
+                    continue
+
+                fresh.append(k)
+                in_batch.add((key, fp))
+
+            self._misses += len(fresh)
+            self._hits += len(batch) - len(fresh)
+
+        if len(fresh) == len(batch):
+            return batch
+        return batch.take(np.array(fresh, dtype=np.intp))
+    # NOTE. Repeats in a batch. The second time a batch holds the same
+    # reading for a machine counts as a hit too.
+
+    def remember(self, ctx: Optional[FiwareContext], batch: MachineBatch,
+                 spec: Optional[FeatureSpec] = None):
+        """
+        Remember the readings in the batch as handled.
+
+        :param ctx: the FIWARE context the batch comes from.
+        :param batch: the machines.
+        :param spec: the features the model takes.
+        """
+        fps = fingerprints(batch, spec)
+        expires = self._clock() + self._ttl
+        with self._lock:
+            for eid, fp in zip(batch.ids, fps):
+                if not isinstance(eid, str):
+                    continue
+                key = self._key(ctx, eid)
+                self._seen[key] = (fp, expires)
+                self._seen.move_to_end(key)
+                if len(self._seen) > self._capacity:
+                    self._seen.popitem(last=False)
+                    self._evicted += 1
+    # NOTE. In flight. Two notifications with the same reading processed
+    # at the same time both get through before either is remembered. That
+    # just costs a second identical estimate, which is better than losing
+    # one to a failure in between.
+
+    def forget(self, ctx: Optional[FiwareContext], ids: List[str]):
+        """
+        Forget the readings of the given machines, e.g. because we failed
+        to publish their estimates, so they get scored again next time.
+
+        :param ctx: the FIWARE context the machines belong to.
+        :param ids: the machine IDs.
+        """
+        with self._lock:
+            for eid in ids:
+                self._seen.pop(self._key(ctx, eid), None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: how many machines we remember, how many readings we
+            dropped as repeats and how many we let through, and how many
+            machines got dropped to make room for others.
+        """
+        with self._lock:
+            return {
+                'size': len(self._seen),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted': self._evicted
+            }
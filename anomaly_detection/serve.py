@@ -0,0 +1,33 @@
+"""
+Starts the service.
+
+Runs a single Uvicorn process unless ``ANOMALY_HTTP_WORKERS`` asks for
+more than one worker, in which case it hands over to Gunicorn with the
+settings in ``gunicorn_conf``.
+
+    python -m anomaly_detection.serve
+
+"""
+
+import os
+from pathlib import Path
+
+import uvicorn
+
+import anomaly_detection.config as config
+
+
+APP = 'anomaly_detection.main:app'
+GUNICORN_CONF = Path(__file__).parent / 'gunicorn_conf.py'
+
+
+def main():
+    if config.http_workers() > 1:
+        os.execvp('gunicorn', ['gunicorn', '-c', str(GUNICORN_CONF), APP])
+
+    host, port = config.bind_address().rsplit(':', 1)
+    uvicorn.run(APP, host=host, port=int(port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Threshold-table scoring for single-feature forests.
+
+When the forest only looks at one feature, each tree splits the real
+line into intervals and so does the whole forest: the sorted split
+points of all the trees partition the line into intervals on which the
+anomaly score is constant. So we can work out the score of each
+interval upfront and then scoring a sample boils down to a binary
+search for its interval---no tree traversal at all.
+
+Examples
+--------
+
+>>> import pickle
+>>> from anomaly_detection.iforest import CompiledForest
+>>> with open('data/anomaly_detection.pkl', 'rb') as f:
+...     model = pickle.load(f)
+>>> table = ThresholdTable.from_forest(CompiledForest.from_model(model))
+>>> table.predict(np.array([[7.0], [-3.0]]))
+array([0, 1])
+
+"""
+
+import numpy as np
+
+from anomaly_detection.iforest import CompiledForest
+
+
+class ThresholdTable:
+    """
+    Interval lookup table equivalent to a single-feature forest.
+
+    Given ``n`` sorted split points ``s``, interval ``0`` is
+    ``(-inf, s[0]]``, interval ``k`` is ``(s[k-1], s[k]]`` and interval
+    ``n`` is ``(s[n-1], +inf)``, which matches the ``x <= threshold``
+    test the trees do at each split. ``scores[k]`` is the anomaly score
+    of any sample in interval ``k``.
+    """
+
+    def __init__(self, splits: np.ndarray, scores: np.ndarray,
+                 label_threshold: float):
+        """
+        Create a new instance. You'd normally use ``from_forest`` instead.
+
+        :param splits: sorted, distinct split points.
+        :param scores: anomaly score of each interval; one more than the
+            split points.
+        :param label_threshold: anything scoring above it is an anomaly.
+        """
+        self.splits = splits
+        self.scores = scores
+        self.label_threshold = float(label_threshold)
+
+    @staticmethod
+    def from_forest(forest: CompiledForest) -> 'ThresholdTable':
+        """
+        Tabulate the given forest.
+
+        :param forest: a forest trained on exactly one feature.
+        :return: the table.
+        :raise ValueError: if the forest uses more than one feature.
+        """
+        if forest.n_features != 1:
+            raise ValueError(
+                "can only tabulate single-feature forests, " +
+                f"got {forest.n_features} features")
+
+        nodes = np.arange(len(forest.left))
+        is_split = forest.left != nodes
+        splits = np.unique(forest.threshold[is_split])
+
+        points = np.append(splits, np.inf).reshape(-1, 1)
+        scores = forest.offset - forest._score_samples(points)
+
+        return ThresholdTable(splits=splits, scores=scores,
+                              label_threshold=forest.label_threshold)
+    # NOTE. Interval representatives. Any point in interval k takes the
+    # same branch at every split s as s[k] itself does since x <= s iff
+    # s[k] <= s for all the split points s. So the split points (plus
+    # infinity for the last interval) are exact representatives. We feed
+    # them in at full precision, without the float32 downcast, since they
+    # aren't samples but thresholds.
+
+    def intervals(self, X: np.ndarray) -> np.ndarray:
+        """
+        Look up the interval each sample falls in.
+
+        :param X: samples, shape ``(n_samples, 1)`` or ``(n_samples,)``.
+        :return: interval indexes.
+        """
+        xs = np.asarray(X, dtype=np.float32).ravel()
+        return np.searchsorted(self.splits, xs, side='left')
+    # NOTE. Float32. Same as with the compiled forest, we've got to compare
+    # float32 samples to float64 thresholds to land in the same intervals
+    # scikit-learn would.
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """
+        Same as ``CompiledForest.decision_function``.
+
+        :param X: samples, shape ``(n_samples, 1)`` or ``(n_samples,)``.
+        :return: the anomaly scores.
+        """
+        return self.scores[self.intervals(X)]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Same as ``CompiledForest.predict``.
+
+        :param X: samples, shape ``(n_samples, 1)`` or ``(n_samples,)``.
+        :return: ``1`` for each anomaly, ``0`` for each normal sample.
+        """
+        return (self.decision_function(X) > self.label_threshold)\
+            .astype(int)
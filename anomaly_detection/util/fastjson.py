@@ -0,0 +1,51 @@
+"""
+JSON serialisation straight to bytes, and parsing.
+
+We use ``orjson`` if it's installed since it's several times faster than
+the standard library and writes out UTF-8 bytes directly. Otherwise we
+fall back to the standard ``json`` module with compact separators, so
+either way the output is the same compact JSON.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+BACKEND = 'orjson' if orjson else 'json'
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialise an object to compact JSON.
+
+    :param obj: a JSON-compatible object, i.e. dictionaries with string
+        keys, lists, strings, numbers, booleans and ``None``.
+    :return: the UTF-8 encoded JSON.
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+# NOTE. NaN. orjson writes NaN and infinities out as null whereas the
+# standard library writes out NaN and Infinity, which isn't valid JSON.
+# Don't feed either of them non-finite floats.
+
+
+def loads(data: bytes) -> Any:
+    """
+    Parse JSON.
+
+    :param data: the UTF-8 encoded JSON.
+    :return: the parsed value.
+    :raise ValueError: if the data isn't valid JSON.
+    """
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+# NOTE. Errors. ``orjson.JSONDecodeError`` is a ``ValueError`` just like
+# the standard library's, so callers can catch either the same way.
@@ -0,0 +1,123 @@
+from httpx import AsyncClient, Limits, Response
+
+from .header import HttpHeader, pack
+from .jclient import JSON_CONTENT_TYPE
+
+
+class AsyncJsonClient:
+    """
+    Asyncio counterpart of ``JsonClient``. Same API, except methods are
+    coroutines. Requests go through a connection pool shared by all the
+    coroutines using the client.
+    """
+
+    def __init__(self, timeout=60, verify=True, max_connections=100,
+                 keep_alive=True, transport=None):
+        """
+        Create a new instance.
+
+        :param timeout: error out if the request takes longer than this.
+        :param verify: verify SSL certificates for HTTPS connections.
+        :param max_connections: max number of concurrent connections.
+            Requests beyond that wait for a connection to free up.
+        :param keep_alive: reuse connections across requests?
+        :param transport: the ``httpx`` transport to use instead of the
+            default one. Only useful for testing.
+        """
+        keep_alive_n = max_connections if keep_alive else 0
+        limits = Limits(max_connections=max_connections,
+                        max_keepalive_connections=keep_alive_n)
+        self._timeout = timeout
+        self._http = AsyncClient(timeout=timeout, verify=verify,
+                                 limits=limits, transport=transport)
+
+    async def close(self):
+        """
+        Close any open connections.
+        """
+        await self._http.aclose()
+
+    @staticmethod
+    def _handle_response(r: Response) -> dict:
+        r.raise_for_status()
+        if r.text:
+            return r.json()
+        return {}
+
+    @staticmethod
+    def _prep_headers(hs: [HttpHeader] = None) -> dict:
+        if hs:
+            return pack(*hs)
+        return {}
+
+    async def get(self, url: str, headers: [HttpHeader] = None) -> dict:
+        """
+        GET the JSON resource identified by ``url``.
+
+        :param url: the resource identifier.
+        :param headers: any optional headers to add to the request.
+        :return: the JSON representation of the resource.
+        """
+        response = await self._http.get(url,
+                                        headers=self._prep_headers(headers))
+        return self._handle_response(response)
+
+    async def post(self, url: str, json_payload: dict,
+                   headers: [HttpHeader] = None) -> dict:
+        """
+        POST a JSON payload.
+
+        :param url: where to post.
+        :param json_payload: the data.
+        :param headers: any optional headers to add to the request.
+            ('Content-Type: application/json' will be added automatically.)
+        :return: JSON returned by the server if any.
+        """
+        response = await self._http.post(url,
+                                         headers=self._prep_headers(headers),
+                                         json=json_payload)
+        return self._handle_response(response)
+
+    async def post_raw(self, url: str, body: bytes,
+                       headers: [HttpHeader] = None) -> dict:
+        """
+        POST an already serialised JSON payload.
+
+        :param url: where to post.
+        :param body: the UTF-8 encoded JSON data.
+        :param headers: any optional headers to add to the request.
+            ('Content-Type: application/json' will be added automatically.)
+        :return: JSON returned by the server if any.
+        """
+        hs = self._prep_headers(headers)
+        hs['Content-Type'] = JSON_CONTENT_TYPE
+        response = await self._http.post(url, headers=hs, content=body)
+        return self._handle_response(response)
+
+    async def put(self, url: str, json_payload: dict,
+                  headers: [HttpHeader] = None) -> dict:
+        """
+        PUT a JSON representation of the resource identified by ``url``.
+
+        :param url: the resource identifier.
+        :param json_payload: the data.
+        :param headers: any optional headers to add to the request.
+            ('Content-Type: application/json' will be added automatically.)
+        :return: JSON returned by the server if any.
+        """
+        response = await self._http.put(url,
+                                        headers=self._prep_headers(headers),
+                                        json=json_payload)
+        return self._handle_response(response)
+
+    async def delete(self, url: str, headers: [HttpHeader] = None) -> dict:
+        """
+        DELETE the resource identified by ``url``.
+
+        :param url: the resource identifier.
+        :param headers: any optional headers to add to the request.
+        :return: JSON returned by the server if any.
+        """
+        response = await self._http.delete(
+            url, headers=self._prep_headers(headers))
+        return self._handle_response(response)
@@ -1,25 +1,52 @@
 from requests import Session, Response
+from requests.adapters import HTTPAdapter
 
 from .header import HttpHeader, pack
 
 
+JSON_CONTENT_TYPE = 'application/json'
+
+
 class JsonClient:
     """
     Simple HTTP client to operate on resources that are expected to have
     a JSON representation.
     """
 
-    def __init__(self, timeout=60, verify=True):
+    def __init__(self, timeout=60, verify=True, pool_connections=10,
+                 pool_maxsize=10, keep_alive=True, transport=None):
         """
         Create a new instance.
 
         :param timeout: error out if the request takes longer than this.
         :param verify: verify SSL certificates for HTTPS connections.
+        :param pool_connections: how many hosts to keep connection pools
+            for.
+        :param pool_maxsize: max number of connections to keep open to
+            the same host.
+        :param keep_alive: reuse connections across requests? If not,
+            ask the server to close each connection after responding.
+        :param transport: the ``requests`` transport adapter to use instead
+            of the default pooled one. Only useful for testing.
         """
         self._timeout = timeout
         self._verify = verify
         self._http = Session()
 
+        adapter = transport if transport else \
+            HTTPAdapter(pool_connections=pool_connections,
+                        pool_maxsize=pool_maxsize)
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+        if not keep_alive:
+            self._http.headers['Connection'] = 'close'
+
+    def close(self):
+        """
+        Close any open connections.
+        """
+        self._http.close()
+
     @staticmethod
     def _handle_response(r: Response) -> dict:
         r.raise_for_status()
@@ -67,6 +94,24 @@ class JsonClient:
     # NOTE. Content-Type header. Requests adds application/json automatically
     # when using the 'json' named argument.
 
+    def post_raw(self, url: str, body: bytes,
+                 headers: [HttpHeader] = None) -> dict:
+        """
+        POST an already serialised JSON payload.
+
+        :param url: where to post.
+        :param body: the UTF-8 encoded JSON data.
+        :param headers: any optional headers to add to the request.
+            ('Content-Type: application/json' will be added automatically.)
+        :return: JSON returned by the server if any.
+        """
+        hs = self._prep_headers(headers)
+        hs['Content-Type'] = JSON_CONTENT_TYPE
+        response = self._http.post(url=url, headers=hs, data=body,
+                                   timeout=self._timeout,
+                                   verify=self._verify)
+        return self._handle_response(response)
+
     def put(self, url: str, json_payload: dict,
             headers: [HttpHeader] = None) -> dict:
         """
@@ -0,0 +1,69 @@
+"""
+Newline-delimited JSON utils.
+"""
+
+from typing import Any, AsyncIterator, List
+
+from anomaly_detection.util import fastjson
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a stream of bytes into lines, skipping blank ones.
+
+    :param chunks: the stream.
+    :return: the lines, without line terminators.
+    """
+    pending = b''
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+def parse_lines(lines: List[bytes]) -> List[Any]:
+    """
+    Parse JSON lines.
+
+    :param lines: the lines to parse.
+    :return: the parsed values, in the same order as the lines. Any line
+        that isn't valid JSON becomes ``None``.
+    """
+    return [_parse_line(line) for line in lines]
+# NOTE. One line at a time. Parsing a whole batch as one JSON array would
+# save parser calls, but a line holding garbage like ``1, 2`` or ``[1``
+# can merge with its neighbours into a valid array whose values no longer
+# line up with the lines, even when there are as many values as lines.
+# So we parse each line on its own, with orjson if we have it to make up
+# for the extra calls.
+
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return fastjson.loads(line)
+    except ValueError:
+        return None
+
+
+async def read_batches(chunks: AsyncIterator[bytes], batch_size: int) \
+        -> AsyncIterator[List[Any]]:
+    """
+    Parse a stream of JSON lines in batches.
+
+    :param chunks: the stream.
+    :param batch_size: max number of lines in a batch.
+    :return: the parsed batches. Invalid lines become ``None``.
+    """
+    batch = []
+    async for line in read_lines(chunks):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield parse_lines(batch)
+            batch = []
+    if batch:
+        yield parse_lines(batch)
+
@@ -0,0 +1,63 @@
+"""
+Asyncio wrapper calls to Orion Context Broker.
+"""
+
+from typing import Optional, Type
+from uri import URI
+
+from anomaly_detection.util.http.ajclient import AsyncJsonClient
+from anomaly_detection.util.ngsi.entity import BaseEntity, \
+    entities_upsert_json
+from anomaly_detection.util.ngsi.headers import FiwareContext
+from anomaly_detection.util.ngsi.orion import OrionEndpoints
+
+
+class AsyncOrionClient:
+    """
+    Asyncio counterpart of ``OrionClient``. Same API, except methods are
+    coroutines.
+    """
+
+    def __init__(self, base_url: URI, ctx: FiwareContext,
+                 http: Optional[AsyncJsonClient] = None):
+        self._urls = OrionEndpoints(base_url)
+        self._ctx = ctx
+        self._http = http if http else AsyncJsonClient()
+
+    async def upsert_entity(self, data: BaseEntity):
+        url = self._urls.entities({'options': 'upsert'})
+        await self._http.post(url=url, json_payload=data.dict(),
+                              headers=self._ctx.headers())
+
+    async def upsert_entities(self, data: [BaseEntity]):
+        await self.upsert_entities_json(entities_upsert_json(data))
+
+    async def upsert_entities_json(self, payload: bytes):
+        url = self._urls.update_op()
+        await self._http.post_raw(url=url, body=payload,
+                                  headers=self._ctx.headers())
+
+    async def list_entities(self) -> [BaseEntity]:
+        url = self._urls.entities()
+        entity_arr = await self._http.get(url=url,
+                                          headers=self._ctx.headers())
+        models = [BaseEntity.parse_obj(entity_dict)
+                  for entity_dict in entity_arr]
+        return models
+
+    async def list_entities_of_type(self, like: Type[BaseEntity]) \
+            -> [BaseEntity]:
+        url = self._urls.entities({'type': like.type})
+        entity_arr = await self._http.get(url=url,
+                                          headers=self._ctx.headers())
+        models = [like.parse_obj(entity_dict) for entity_dict in entity_arr]
+        return models
+
+    async def subscribe(self, sub: dict):
+        url = self._urls.subscriptions()
+        await self._http.post(url=url, json_payload=sub,
+                              headers=self._ctx.headers())
+
+    async def list_subscriptions(self) -> [dict]:
+        url = self._urls.subscriptions()
+        return await self._http.get(url=url, headers=self._ctx.headers())
@@ -3,9 +3,19 @@ Basic NGSI v2 data types.
 """
 
 
+import numpy as np
 from pydantic import BaseModel
 from typing import Any, List, Optional, Type
 
+from anomaly_detection.util import fastjson
+
+
+OWN_ENTITY_TYPES = frozenset(['AnomalyDetection'])
+# NOTE. Feedback loops. Our estimates are Orion entities too, so a broad
+# enough subscription sends them back to us. We never pick out entities
+# of our own output types, whatever type we're told to look for,
+# otherwise each estimate we write could trigger another one.
+
 
 def ld_urn(unique_suffix: str) -> str:
     return f"urn:ngsi-ld:{unique_suffix}"
@@ -48,23 +58,100 @@ class BaseEntity(BaseModel):
     def to_json(self) -> str:
         return self.json(exclude_none=True)
 
+    @classmethod
+    def entity_type(cls) -> Optional[str]:
+        return cls.__fields__['type'].default
+
     @classmethod
     def from_raw(cls, raw_entity: dict) -> Optional['BaseEntity']:
-        own_type = cls(id='').type
+        own_type = cls.entity_type()
         etype = raw_entity.get('type', '')
         if own_type != etype:
             return None
         return cls(**raw_entity)
 
 
+def filter_raw_entities(data: List[Any], entity_type: str) -> List[dict]:
+    """
+    Pick out the entities of the given type without parsing them into
+    models. Entities of our own output types never get picked.
+
+    :param data: raw entities as parsed from JSON.
+    :param entity_type: the NGSI type of the entities to keep.
+    :return: the raw entities of that type, in the same order as the
+        input.
+    """
+    return [d for d in data
+            if isinstance(d, dict) and d.get('type') == entity_type and
+            d.get('type') not in OWN_ENTITY_TYPES]
+
+
+def attr_values(entities: List[dict], attr_name: str) -> np.ndarray:
+    """
+    Pull the values of a numeric attribute out of raw entities.
+
+    :param entities: raw entities as parsed from JSON.
+    :param attr_name: the attribute name.
+    :return: the attribute values, ``NaN`` wherever the attribute is
+        missing or its value isn't a number.
+    """
+    return np.fromiter((number_or_nan(attr_value(e, attr_name))
+                        for e in entities),
+                       dtype=float, count=len(entities))
+
+
+def attr_value(entity: dict, attr_name: str) -> Any:
+    """
+    :param entity: a raw entity as parsed from JSON.
+    :param attr_name: the attribute name.
+    :return: the attribute value or ``None`` if the attribute is missing.
+    """
+    attr = entity.get(attr_name)
+    return attr.get('value') if isinstance(attr, dict) else None
+
+
+def number_or_nan(x: Any) -> float:
+    if isinstance(x, (int, float)) and not isinstance(x, bool):
+        return x
+    return np.nan
+
+
 class EntityUpdateNotification(BaseModel):
     data: List[dict]
 
     def filter_entities(self, entity_class: Type[BaseEntity]) -> [BaseEntity]:
-        candidates = [entity_class.from_raw(d) for d in self.data]
-        return [c for c in candidates if c is not None]
+        raw_entities = filter_raw_entities(self.data,
+                                           entity_class.entity_type())
+        return [entity_class(**d) for d in raw_entities]
 
 
 class EntitiesUpsert(BaseModel):
     actionType = 'append'
     entities: List[BaseEntity]
+
+
+def entities_upsert_json(entities: List[BaseEntity]) -> bytes:
+    """
+    Serialise the body of an ``EntitiesUpsert`` request straight to JSON
+    bytes, without building the upsert model or its dictionary first.
+
+    :param entities: the entities to upsert. Their attributes have got to
+        be ``Attr`` models with a JSON-compatible value.
+    :return: the UTF-8 encoded JSON body.
+    """
+    payload = {
+        'actionType': EntitiesUpsert.__fields__['actionType'].default,
+        'entities': [_attrs_dict(e) for e in entities]
+    }
+    return fastjson.dumps(payload)
+# NOTE. Missing attributes. Unlike ``EntitiesUpsert.dict``, we leave out
+# attributes set to ``None`` instead of writing them out as null, which
+# Orion would reject anyway.
+
+
+def _attrs_dict(entity: BaseEntity) -> dict:
+    return {name: value.__dict__ if isinstance(value, Attr) else value
+            for name, value in entity.__dict__.items() if value is not None}
+# NOTE. Shallow dict. A pydantic model keeps its field values in its
+# ``__dict__``, so for flat NGSI entities two dictionary lookups per
+# attribute get us what ``dict()`` would, minus the recursive copy.
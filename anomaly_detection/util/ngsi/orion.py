@@ -2,11 +2,14 @@
 Wrapper calls to Orion Context Broker.
 """
 
-from typing import Type
+from threading import Lock
+from requests.adapters import BaseAdapter
+from typing import Dict, Optional, Tuple, Type
 from uri import URI
 
 from anomaly_detection.util.http.jclient import JsonClient
-from anomaly_detection.util.ngsi.entity import BaseEntity, EntitiesUpsert
+from anomaly_detection.util.ngsi.entity import BaseEntity, \
+    entities_upsert_json
 from anomaly_detection.util.ngsi.headers import FiwareContext
 
 
@@ -36,10 +39,11 @@ class OrionEndpoints:
 
 class OrionClient:
 
-    def __init__(self, base_url: URI, ctx: FiwareContext):
+    def __init__(self, base_url: URI, ctx: FiwareContext,
+                 http: Optional[JsonClient] = None):
         self._urls = OrionEndpoints(base_url)
         self._ctx = ctx
-        self._http = JsonClient()
+        self._http = http if http else JsonClient()
 
     def upsert_entity(self, data: BaseEntity):
         url = self._urls.entities({'options': 'upsert'})
@@ -47,10 +51,12 @@ class OrionClient:
                         headers=self._ctx.headers())
 
     def upsert_entities(self, data: [BaseEntity]):
+        self.upsert_entities_json(entities_upsert_json(data))
+
+    def upsert_entities_json(self, payload: bytes):
         url = self._urls.update_op()
-        payload = EntitiesUpsert(entities=data)
-        self._http.post(url=url, json_payload=payload.dict(),
-                        headers=self._ctx.headers())
+        self._http.post_raw(url=url, body=payload,
+                            headers=self._ctx.headers())
 
     def list_entities(self) -> [BaseEntity]:
         url = self._urls.entities()
@@ -73,3 +79,91 @@ class OrionClient:
     def list_subscriptions(self) -> [dict]:
         url = self._urls.subscriptions()
         return self._http.get(url=url, headers=self._ctx.headers())
+
+
+class OrionClientCache:
+    """
+    Process-wide cache of Orion clients, one for each Orion base URL and
+    FIWARE service and service path. Clients for the same base URL share
+    the same HTTP connection pool. Safe to share among threads.
+
+    Cached clients don't forward FIWARE correlators since the same client
+    serves requests originating from different notifications.
+    """
+
+    def __init__(self, pool_maxsize: int = 10, keep_alive: bool = True,
+                 transport: Optional[BaseAdapter] = None,
+                 timeout: float = 60):
+        """
+        Create a new instance.
+
+        :param pool_maxsize: max number of connections to keep open to
+            each Orion.
+        :param keep_alive: reuse connections across requests?
+        :param transport: the ``requests`` transport adapter to use for
+            all the clients. Only useful for testing.
+        :param timeout: how many seconds to wait for Orion to respond.
+        """
+        self._pool_maxsize = pool_maxsize
+        self._timeout = timeout
+        self._keep_alive = keep_alive
+        self._transport = transport
+        self._http: Dict[str, JsonClient] = {}
+        self._clients: Dict[Tuple, OrionClient] = {}
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, base_url: URI, ctx: FiwareContext) -> OrionClient:
+        """
+        Get the client for the given Orion and context, creating one if
+        there's none yet.
+
+        :param base_url: the Orion base URL.
+        :param ctx: the FIWARE context.
+        :return: the client.
+        """
+        url = str(base_url)
+        key = (url, ctx.service, ctx.service_path)
+        with self._lock:
+            client = self._clients.get(key)
+            if client:
+                self._hits += 1
+                return client
+
+            self._misses += 1
+            http = self._http.get(url)
+            if http is None:
+                http = self._http[url] = JsonClient(
+                    timeout=self._timeout,
+                    pool_maxsize=self._pool_maxsize,
+                    keep_alive=self._keep_alive,
+                    transport=self._transport)
+            client_ctx = FiwareContext(service=ctx.service,
+                                       service_path=ctx.service_path)
+            client = self._clients[key] = OrionClient(base_url, client_ctx,
+                                                      http)
+            return client
+
+    def close(self):
+        """
+        Close all the connections and forget about the cached clients.
+        """
+        with self._lock:
+            for http in self._http.values():
+                http.close()
+            self._http.clear()
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: cache hits and misses, plus how many clients and
+            connection pools are in the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'clients': len(self._clients),
+                'pools': len(self._http)
+            }
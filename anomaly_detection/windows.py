@@ -0,0 +1,315 @@
+"""
+Per-machine windows of recent readings.
+
+Orion sends us a stream of readings for each machine, but a single
+reading says little about whether a weld went wrong compared to the
+machine's recent history. So we keep, for each machine, the last few
+readings of each numeric attribute in a ring buffer, together with
+running statistics we update as readings come in:
+
+* ``mean`` and ``var``: mean and variance of the readings in the window;
+* ``ewma``: exponentially weighted moving average of all the readings;
+* ``delta``: difference between the reading and the previous one.
+
+Updating the statistics takes constant time per reading, regardless of
+the window size: the running sums get the new reading added and the one
+falling out of the window subtracted.
+
+All the windows live in a handful of NumPy arrays allocated upfront,
+one row for each machine we track, so memory use is bounded. When we
+run out of rows, the machine we haven't heard from in the longest time
+makes room for the new one.
+
+Readings of the same machine can reach us out of order, e.g. when two
+notification pipeline workers process them at the same time. So we
+order readings by their ``Datetime`` and keep track of the latest one
+each window has seen. A reading older than that comes too late: it
+gets the window features as they stand, but doesn't change the window.
+Readings without a ``Datetime`` go in as they come.
+
+Examples
+--------
+
+>>> ws = MachineWindows(capacity=2, size=3, attrs=['Joules'])
+>>> xs = ws.update(['m1', 'm1', 'm1', 'm1'], np.array([[1.], [2.], [3.], [5.]]))
+>>> xs[:, ws.feature_names.index('Joules_mean')]
+array([1.        , 1.5       , 2.        , 3.33333333])
+>>> xs[:, ws.feature_names.index('Joules_delta')]
+array([nan,  1.,  1.,  2.])
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+from anomaly_detection.batch import MachineBatch, NUMERIC_ATTRS
+import anomaly_detection.config as config
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+STATS = ['mean', 'var', 'ewma', 'delta']
+
+
+def feature_names(attrs: List[str]) -> List[str]:
+    """
+    :param attrs: the windowed attributes.
+    :return: the names of the window features, e.g. ``Joules_mean``, in
+        the same order as the columns ``MachineWindows.update`` returns.
+    """
+    return [f"{a}_{s}" for a in attrs for s in STATS]
+
+
+class MachineWindows:
+    """
+    Bounded store of per-machine reading windows.
+    Safe to share among threads.
+    """
+
+    def __init__(self, capacity: int = 10000, size: int = 16,
+                 alpha: float = 0.2, attrs: Optional[List[str]] = None):
+        """
+        Create a new instance.
+
+        :param capacity: max number of machines to track.
+        :param size: how many readings to keep in each window.
+        :param alpha: the EWMA smoothing factor, between 0 and 1. The
+            higher, the more weight recent readings get.
+        :param attrs: the numeric attributes to keep windows for.
+            Defaults to all the numeric machine attributes.
+        """
+        if capacity < 1 or size < 1:
+            raise ValueError('capacity and size must be positive')
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha must be in (0, 1]')
+
+        self.capacity = capacity
+        self.size = size
+        self.alpha = alpha
+        self.attrs = list(attrs or NUMERIC_ATTRS)
+        self.feature_names = feature_names(self.attrs)
+
+        shape = (capacity, len(self.attrs))
+        self._ring = np.zeros(shape + (size,))
+        self._count = np.zeros(shape, dtype=np.int64)
+        self._head = np.zeros(shape, dtype=np.int64)
+        self._sum = np.zeros(shape)
+        self._sumsq = np.zeros(shape)
+        self._ewma = np.full(shape, np.nan)
+        self._last = np.full(shape, np.nan)
+        self._stamp = np.full(capacity, np.nan)
+
+        self._slots: Dict[Hashable, int] = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+        self._evicted = 0
+        self._late = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def from_config() -> Optional['MachineWindows']:
+        """
+        :return: a store with the settings configured in the environment
+            or ``None`` if windows are turned off.
+        """
+        size = config.window_size()
+        if size <= 0:
+            return None
+        return MachineWindows(capacity=config.window_machines(), size=size,
+                              alpha=config.window_ewma_alpha())
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def evicted(self) -> int:
+        """
+        :return: how many machines got dropped so far to make room for
+            new ones.
+        """
+        return self._evicted
+
+    def late(self) -> int:
+        """
+        :return: how many readings came in older than the latest reading
+            of their machine and so got left out of the windows.
+        """
+        return self._late
+
+    def update(self, keys: List[Hashable], values: np.ndarray,
+               stamps: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Add readings to the windows.
+
+        :param keys: the machine each reading comes from. The same machine
+            can show up more than once, in which case its readings get
+            added in order.
+        :param values: one row for each reading, one column for each of
+            ``attrs``, ``NaN`` for missing values.
+        :param stamps: when each reading was taken, in seconds since the
+            epoch, ``NaN`` if unknown. Readings older than the latest one
+            already in their machine's window don't change the window.
+            Leave out to add all the readings.
+        :return: the window features right after adding each reading, one
+            row for each reading and one column for each of
+            ``feature_names``. Features of attributes with no readings
+            yet are ``NaN``.
+        """
+        features = np.full((len(keys), len(self.feature_names)), np.nan)
+        if stamps is None:
+            stamps = np.full(len(keys), np.nan)
+        with self._lock:
+            for start in range(0, len(keys), self.capacity):
+                end = start + self.capacity
+                self._update(keys[start:end], values[start:end],
+                             stamps[start:end], features[start:end])
+        return features
+    # NOTE. Chunks. We never take in more machines at once than we can
+    # track, otherwise a machine could get evicted halfway through its
+    # own update.
+
+    def _update(self, keys: List[Hashable], values: np.ndarray,
+                stamps: np.ndarray, features: np.ndarray):
+        slots = np.empty(len(keys), dtype=np.int64)
+        rounds = np.empty(len(keys), dtype=np.int64)
+        seen: Dict[Hashable, int] = {}
+        for k, key in enumerate(keys):
+            slots[k] = self._slot(key)
+            rounds[k] = seen[key] = seen.get(key, -1) + 1
+
+        for r in range(int(rounds.max(initial=-1)) + 1):
+            rows = np.flatnonzero(rounds == r)
+            features[rows] = self._add(slots[rows], values[rows],
+                                       stamps[rows])
+    # NOTE. Rounds. A batch can hold several readings for the same
+    # machine. The k-th reading of each machine goes into round k, so each
+    # round updates distinct rows and we can do it with array operations.
+    # Usually there's just one round.
+
+    def _slot(self, key: Hashable) -> int:
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slots.move_to_end(key)
+            return slot
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self._evicted += 1
+        self._reset(slot)
+        self._slots[key] = slot
+        return slot
+
+    def _reset(self, slot: int):
+        self._count[slot] = 0
+        self._head[slot] = 0
+        self._sum[slot] = 0
+        self._sumsq[slot] = 0
+        self._ewma[slot] = np.nan
+        self._last[slot] = np.nan
+        self._stamp[slot] = np.nan
+
+    def _add(self, slots: np.ndarray, values: np.ndarray,
+             stamps: np.ndarray) -> np.ndarray:
+        late = stamps < self._stamp[slots]
+        self._late += int(late.sum())
+        self._stamp[slots] = np.fmax(self._stamp[slots], stamps)
+
+        present = ~np.isnan(values) & ~late[:, None]
+        x = np.where(present, values, 0.0)
+        count = self._count[slots]
+        head = self._head[slots]
+        full = count == self.size
+
+        rows = slots[:, None]
+        cols = np.arange(len(self.attrs))[None, :]
+        old = np.where(full, self._ring[rows, cols, head], 0.0)
+        self._ring[rows, cols, head] = np.where(
+            present, x, self._ring[rows, cols, head])
+
+        self._sum[slots] += np.where(present, x - old, 0.0)
+        self._sumsq[slots] += np.where(present, x * x - old * old, 0.0)
+        delta = np.where(present, values - self._last[slots], np.nan)
+        seen = count > 0
+        ewma = self._ewma[slots]
+        self._ewma[slots] = np.where(
+            present,
+            np.where(seen, self.alpha * x + (1 - self.alpha) * ewma, x),
+            ewma)
+        self._last[slots] = np.where(present, x, self._last[slots])
+
+        count = np.where(present & ~full, count + 1, count)
+        head = np.where(present, (head + 1) % self.size, head)
+        self._count[slots] = count
+        self._head[slots] = head
+        self._resum(slots, present & (head == 0))
+
+        return self._features(slots, delta)
+    # NOTE. Unknown times. Comparisons with ``NaN`` are always false and
+    # ``fmax`` ignores ``NaN``, so a reading without a time is never late
+    # and doesn't move the window's latest time.
+
+    def _resum(self, slots: np.ndarray, wrapped: np.ndarray):
+        rows, cols = np.nonzero(wrapped)
+        if len(rows):
+            window = self._ring[slots[rows], cols]
+            self._sum[slots[rows], cols] = window.sum(axis=1)
+            self._sumsq[slots[rows], cols] = (window * window).sum(axis=1)
+    # NOTE. Drift. Adding and subtracting readings over and over makes
+    # rounding errors pile up in the running sums. So each time a window
+    # wraps around, we sum it up again from scratch. That's one pass over
+    # the window every ``size`` readings, still constant time per reading.
+
+    def _features(self, slots: np.ndarray, delta: np.ndarray) -> np.ndarray:
+        count = self._count[slots]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._sum[slots] / count
+            var = np.maximum(self._sumsq[slots] / count - mean * mean, 0.0)
+        var[count == 0] = np.nan
+
+        stats = np.stack([mean, var, self._ewma[slots], delta], axis=2)
+        return stats.reshape(len(slots), -1)
+
+    def annotate(self, batch: MachineBatch,
+                 ctx: Optional[FiwareContext] = None):
+        """
+        Add the readings in a batch to the windows and set the resulting
+        window features as extra numeric columns of the batch, e.g.
+        ``batch.numeric('Joules_mean')``.
+
+        :param batch: the machines. Machines without an ID get ``NaN``
+            features and don't touch any window.
+        :param ctx: the FIWARE context the batch comes from. Machines with
+            the same ID in different tenants get separate windows.
+        """
+        scope = (ctx.service, ctx.service_path) if ctx else (None, None)
+        known = np.array([k for k, eid in enumerate(batch.ids)
+                          if isinstance(eid, str)], dtype=np.int64)
+        stamps = _timestamps(batch.text('Datetime'))[known]
+        known = known[np.argsort(stamps, kind='stable')]
+        values = np.column_stack([batch.numeric(a)[known]
+                                  for a in self.attrs])
+        features = np.full((len(batch), len(self.feature_names)), np.nan)
+        features[known] = self.update(
+            [scope + (batch.ids[k],) for k in known], values,
+            np.sort(stamps, kind='stable'))
+
+        for j, name in enumerate(self.feature_names):
+            batch.set_numeric(name, features[:, j])
+    # NOTE. Ordering. ``update`` adds a machine's readings in the order
+    # it gets them, so we hand them over sorted by time. Readings without
+    # a time sort last. Across batches, ``update`` skips late readings.
+
+
+def _timestamps(values: List[Optional[str]]) -> np.ndarray:
+    stamps = np.full(len(values), np.nan)
+    for k, value in enumerate(values):
+        try:
+            stamps[k] = datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return stamps
+# NOTE. Datetime. Machines send ``Datetime`` as e.g. ``2020-06-08 00:00:00``,
+# which ``fromisoformat`` reads as local time. Anything we can't read
+# counts as unknown.
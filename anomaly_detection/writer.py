@@ -0,0 +1,501 @@
+"""
+Writes estimates to Orion, riding out Orion hiccups and outages.
+
+A write that fails gets retried a few times, waiting a random delay
+between attempts that grows exponentially, so a brief hiccup doesn't
+lose any estimates while many writers retrying at once don't all hit
+Orion again at the same time.
+
+If writes keep failing, we stop trying: a circuit breaker opens and,
+for a while, writes go straight to a spill buffer instead of waiting on
+an Orion that's down. Once the while is over, the breaker lets one
+write through to see if Orion is back. If it is, the breaker closes and
+a background thread replays the spilled estimates in batches; if not,
+the breaker stays open for another while.
+
+The spill buffer is in memory and bounded. It only keeps the latest
+estimate for each machine, since Orion would overwrite any earlier one
+anyway, and when it's full it drops the oldest estimates to make room
+for new ones. While there are spilled estimates, new ones go to the
+buffer too so they don't overtake older ones.
+
+Writes Orion rejects as bad requests, with a 4xx status, never get
+retried or spilled since they'd fail the same way each time. We drop
+them straight away.
+"""
+
+from collections import OrderedDict
+import logging
+import random
+from threading import Event, Lock, Thread
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from requests import HTTPError
+
+import anomaly_detection.config as config
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+Sink = Callable[[FiwareContext, List[AnomalyDetectionEntity]], None]
+ContextKey = Tuple[Optional[str], Optional[str]]
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+_WRITTEN = 'written'
+_REJECTED = 'rejected'
+_FAILED = 'failed'
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service for a while.
+    Safe to share among threads.
+    """
+
+    def __init__(self, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Create a new instance, closed.
+
+        :param failure_threshold: open after this many failures in a row.
+        :param reset_timeout: how many seconds to stay open before letting
+            a trial call through.
+        :param clock: where to get the current time from, in seconds.
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Can we make a call? Once the breaker has been open long enough,
+        this returns ``True`` for just one trial call, until you report
+        how that went.
+
+        :return: ``True`` if the call should go ahead.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and \
+                    self._clock() - self._opened_at >= self._reset_timeout:
+                self._state = HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or \
+                    self._failures >= self._failure_threshold:
+                self._state = OPEN
+                self._opened_at = self._clock()
+
+    def release(self):
+        """
+        Give back the trial call ``allow`` let through if we didn't make
+        it after all, so the next ``allow`` lets another one through.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = OPEN
+
+
+class _Spilled:
+
+    def __init__(self, ctx: FiwareContext):
+        self.ctx = ctx
+        self.estimates: Dict[str, AnomalyDetectionEntity] = OrderedDict()
+
+
+class SpillBuffer:
+    """
+    Bounded buffer of estimates waiting to be written, keeping only the
+    latest estimate for each machine. Not thread-safe.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Create a new instance.
+
+        :param capacity: max number of estimates to hold.
+        """
+        self.capacity = capacity
+        self._buffers: Dict[ContextKey, _Spilled] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, ctx: FiwareContext,
+            estimates: List[AnomalyDetectionEntity],
+            keep_newer: bool = False) \
+            -> List[Tuple[FiwareContext, List[AnomalyDetectionEntity]]]:
+        """
+        Buffer estimates, dropping the oldest ones if there's no room.
+
+        :param ctx: the FIWARE context the estimates belong to.
+        :param estimates: the estimates.
+        :param keep_newer: don't replace estimates already in the buffer
+            for the same machines. Use it to put back estimates taken out
+            of the buffer.
+        :return: the dropped estimates, by context.
+        """
+        if not estimates:
+            return []
+        key = (ctx.service, ctx.service_path)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = _Spilled(ctx)
+
+        for e in estimates:
+            if e.id in buffer.estimates:
+                if not keep_newer:
+                    buffer.estimates[e.id] = e
+                continue
+            buffer.estimates[e.id] = e
+            self._size += 1
+
+        return self._shrink()
+
+    def _shrink(self) \
+            -> List[Tuple[FiwareContext, List[AnomalyDetectionEntity]]]:
+        dropped = []
+        while self._size > self.capacity:
+            key, buffer = next(iter(self._buffers.items()))
+            n = min(self._size - self.capacity, len(buffer.estimates))
+            estimates = [buffer.estimates.popitem(last=False)[1]
+                         for _ in range(n)]
+            dropped.append((buffer.ctx, estimates))
+            self._size -= n
+            if not buffer.estimates:
+                del self._buffers[key]
+        return dropped
+    # NOTE. Oldest first. Contexts are in order of when they first got
+    # spilled, so we drop from the oldest context before touching the
+    # newer ones.
+
+    def take(self, max_n: int) \
+            -> Optional[Tuple[FiwareContext, List[AnomalyDetectionEntity]]]:
+        """
+        Take the oldest estimates out of the buffer.
+
+        :param max_n: max number of estimates to take.
+        :return: up to ``max_n`` estimates, all from the same context, or
+            ``None`` if the buffer is empty.
+        """
+        if not self._buffers:
+            return None
+        key, buffer = next(iter(self._buffers.items()))
+        n = min(max_n, len(buffer.estimates))
+        estimates = [buffer.estimates.popitem(last=False)[1]
+                     for _ in range(n)]
+        self._size -= n
+        if not buffer.estimates:
+            del self._buffers[key]
+        return buffer.ctx, estimates
+
+
+class OrionWriter:
+    """
+    Writes estimates through a sink, retrying, spilling and replaying as
+    explained in the module docs. Safe to share among threads.
+
+    Retries happen on the thread that calls ``write``, which waits out
+    the backoff between attempts. Replays happen on the writer's own
+    background thread.
+    """
+
+    def __init__(self, sink: Sink, on_drop: Optional[Sink] = None,
+                 retries: int = 3, backoff: float = 0.1,
+                 max_backoff: float = 2.0,
+                 breaker: Optional[CircuitBreaker] = None,
+                 spill_size: int = 10000, replay_batch: int = 100,
+                 replay_interval: float = 1.0,
+                 sleep: Callable[[float], None] = time.sleep,
+                 rng: Callable[[], float] = random.random):
+        """
+        Create a new instance. Call ``start`` to replay spilled estimates
+        in the background.
+
+        :param sink: the actual write, typically an Orion upsert. It
+            should raise an exception if the write fails.
+        :param on_drop: what to do with estimates we give up on, e.g. to
+            clear any record of them having been published.
+        :param retries: how many times to retry a failed write.
+        :param backoff: max seconds to wait before the first retry. Each
+            retry waits up to twice as long as the previous one.
+        :param max_backoff: max seconds to wait before any retry.
+        :param breaker: the circuit breaker to use. Defaults to one with
+            default settings.
+        :param spill_size: max number of estimates to spill. Zero means
+            drop estimates right away if we can't write them.
+        :param replay_batch: max number of spilled estimates to write in
+            one go.
+        :param replay_interval: how many seconds to wait between checks
+            for spilled estimates to replay.
+        :param sleep: how to wait between retries.
+        :param rng: where to get random numbers in ``[0, 1)`` from.
+        """
+        self._sink = sink
+        self._on_drop = on_drop
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._spill = SpillBuffer(spill_size)
+        self._replay_batch = replay_batch
+        self._replay_interval = replay_interval
+        self._sleep = sleep
+        self._rng = rng
+
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._replayer: Optional[Thread] = None
+        self._written = 0
+        self._retried = 0
+        self._failed = 0
+        self._rejected = 0
+        self._spilled = 0
+        self._dropped = 0
+        self._replayed = 0
+
+    @staticmethod
+    def from_config(sink: Sink, on_drop: Optional[Sink] = None) \
+            -> 'OrionWriter':
+        """
+        :param sink: the actual write.
+        :param on_drop: what to do with estimates we give up on.
+        :return: a writer with the settings configured in the environment.
+        """
+        breaker = CircuitBreaker(
+            failure_threshold=config.orion_breaker_failures(),
+            reset_timeout=config.orion_breaker_reset())
+        return OrionWriter(sink=sink, on_drop=on_drop,
+                           retries=config.orion_retries(),
+                           backoff=config.orion_backoff(),
+                           breaker=breaker,
+                           spill_size=config.orion_spill_size(),
+                           replay_batch=config.upsert_batch_size())
+
+    def write(self, ctx: FiwareContext,
+              estimates: List[AnomalyDetectionEntity]):
+        """
+        Write estimates out, or spill them if Orion is down or there are
+        other spilled estimates waiting to be written. Blocks while
+        retrying a failed write.
+
+        :param ctx: the FIWARE context the estimates belong to.
+        :param estimates: the estimates.
+        """
+        with self._lock:
+            backlog = len(self._spill) > 0
+        if backlog or not self.breaker.allow():
+            self._spill_estimates(ctx, estimates)
+            return
+        if self._send(ctx, estimates, self._retries) == _FAILED:
+            self._spill_estimates(ctx, estimates)
+
+    def _send(self, ctx: FiwareContext,
+              estimates: List[AnomalyDetectionEntity], retries: int) -> str:
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                if not self.breaker.allow():
+                    break
+                self._count(retried=1)
+                self._sleep(self._delay(attempt))
+            try:
+                self._sink(ctx, estimates)
+            except Exception as e:
+                if _rejected(e):
+                    self.breaker.success()
+                    self._reject(ctx, estimates, e)
+                    return _REJECTED
+                _logger().exception(
+                    f"failed to write {len(estimates)} estimates for {ctx}")
+                self.breaker.failure()
+                self._count(failed=1)
+                continue
+            self.breaker.success()
+            self._count(written=len(estimates))
+            return _WRITTEN
+        return _FAILED
+    # NOTE. Breaker and retries. Every failed attempt counts towards
+    # opening the breaker, and we stop retrying as soon as it opens.
+    # NOTE. Rejections. If Orion rejects the estimates, we drop them
+    # right away rather than retrying or spilling them. Either way Orion
+    # is up, so a rejection counts as a success for the breaker.
+
+    def _reject(self, ctx: FiwareContext,
+                estimates: List[AnomalyDetectionEntity], e: Exception):
+        _logger().error(
+            f"Orion rejected {len(estimates)} estimates for {ctx}: {e}")
+        self._count(rejected=1)
+        self._drop([(ctx, estimates)])
+
+    def _delay(self, attempt: int) -> float:
+        cap = min(self._max_backoff, self._backoff * 2 ** (attempt - 1))
+        return self._rng() * cap
+    # NOTE. Full jitter. Waiting a random time between zero and the
+    # exponential backoff spreads retries out best when lots of writers
+    # fail at the same time.
+
+    def _spill_estimates(self, ctx: FiwareContext,
+                         estimates: List[AnomalyDetectionEntity],
+                         put_back: bool = False):
+        with self._lock:
+            dropped = self._spill.add(ctx, estimates, keep_newer=put_back)
+            if not put_back:
+                self._spilled += len(estimates)
+        self._drop(dropped)
+        self._wake.set()
+    # NOTE. Counting. Estimates we put back after a failed replay already
+    # got counted as spilled the first time round.
+
+    def _drop(self, dropped: List[Tuple[FiwareContext,
+                                         List[AnomalyDetectionEntity]]]):
+        for ctx, estimates in dropped:
+            self._count(dropped=len(estimates))
+            _logger().warning(
+                f"dropped {len(estimates)} estimates for {ctx}")
+            if self._on_drop:
+                self._on_drop(ctx, estimates)
+
+    def replay(self) -> int:
+        """
+        Write out spilled estimates, a batch at a time, until there are
+        none left or a write fails.
+
+        :return: how many estimates got written.
+        """
+        written = 0
+        while self.spilled() and self.breaker.allow():
+            with self._lock:
+                batch = self._spill.take(self._replay_batch)
+            if batch is None:
+                self.breaker.release()
+                break
+
+            ctx, estimates = batch
+            outcome = self._send(ctx, estimates, retries=0)
+            if outcome == _FAILED:
+                self._spill_estimates(ctx, estimates, put_back=True)
+                break
+            if outcome == _REJECTED:
+                continue
+            written += len(estimates)
+            self._count(replayed=len(estimates))
+        return written
+    # NOTE. Putting back. If a batch fails, it goes back to the buffer
+    # but doesn't replace any newer estimate for the same machine that
+    # got spilled while we were trying.
+    # NOTE. Empty buffer. Another thread may have emptied the buffer, e.g.
+    # ``stop``, between us checking and taking, in which case we give back
+    # the breaker's trial call so the breaker doesn't stay half-open.
+
+    def _replay_in_background(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self._replay_interval)
+            self._wake.clear()
+            try:
+                self.replay()
+            except Exception:
+                _logger().exception('failed to replay spilled estimates')
+
+    def start(self):
+        """
+        Start replaying spilled estimates in the background.
+        """
+        if self._replayer is None:
+            self._stopped.clear()
+            self._replayer = Thread(target=self._replay_in_background,
+                                    daemon=True, name='orion-writer')
+            self._replayer.start()
+
+    def stop(self):
+        """
+        Stop the background replay and try one last time to write out
+        whatever is still spilled. Anything left after that gets dropped.
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._replayer is not None:
+            self._replayer.join()
+            self._replayer = None
+        self.replay()
+
+        with self._lock:
+            dropped = []
+            while len(self._spill):
+                dropped.append(self._spill.take(len(self._spill)))
+        self._drop(dropped)
+
+    def spilled(self) -> int:
+        """
+        :return: how many estimates are waiting in the spill buffer.
+        """
+        with self._lock:
+            return len(self._spill)
+
+    def _count(self, written=0, retried=0, failed=0, rejected=0, dropped=0,
+               replayed=0):
+        with self._lock:
+            self._written += written
+            self._retried += retried
+            self._failed += failed
+            self._rejected += rejected
+            self._dropped += dropped
+            self._replayed += replayed
+
+    def stats(self) -> Dict[str, object]:
+        """
+        :return: the breaker state, how many estimates are spilled, plus
+            counts of estimates written, spilled, replayed and dropped,
+            and of retries, failed writes and writes Orion rejected.
+        """
+        with self._lock:
+            return {
+                'breaker': self.breaker.state,
+                'spill_depth': len(self._spill),
+                'written': self._written,
+                'spilled': self._spilled,
+                'replayed': self._replayed,
+                'dropped': self._dropped,
+                'retries': self._retried,
+                'failures': self._failed,
+                'rejections': self._rejected
+            }
+
+
+def _rejected(e: Exception) -> bool:
+    response = e.response if isinstance(e, HTTPError) else None
+    return response is not None and 400 <= response.status_code < 500 and \
+        response.status_code not in _RETRYABLE_STATUSES
+
+
+_RETRYABLE_STATUSES = {408, 429}
+# NOTE. Client errors worth retrying. Orion may time out reading a request
+# or ask us to slow down, neither of which is about what we sent.
+
+
+def _logger() -> logging.Logger:
+    return logging.getLogger(__name__)
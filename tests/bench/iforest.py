@@ -0,0 +1,46 @@
+"""
+Microbenchmark: compiled forest and threshold table vs the pickled PyOD
+model.
+
+Run from the repo root with
+
+    python -m tests.bench.iforest
+
+"""
+
+import pickle
+import timeit
+
+import numpy as np
+
+from anomaly_detection.iforest import CompiledForest
+from anomaly_detection.ttable import ThresholdTable
+
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def per_call_usecs(fn, repeat: int = 5, number: int = 20) -> float:
+    best = min(timeit.repeat(fn, repeat=repeat, number=number))
+    return best / number * 1e6
+
+
+def run():
+    with open('data/anomaly_detection.pkl', 'rb') as f:
+        model = pickle.load(f)
+    forest = CompiledForest.from_model(model)
+    table = ThresholdTable.from_forest(forest)
+    readings = np.load('data/data.npz')['test'][:, :1]
+
+    print(f"{'batch':>6} {'pyod (us)':>12} {'compiled (us)':>14} " +
+          f"{'table (us)':>11}")
+    for n in BATCH_SIZES:
+        xs = np.resize(readings, (n, 1))
+        slow = per_call_usecs(lambda: model.predict(xs))
+        fast = per_call_usecs(lambda: forest.predict(xs))
+        fastest = per_call_usecs(lambda: table.predict(xs))
+        print(f"{n:>6} {slow:>12.1f} {fast:>14.1f} {fastest:>11.1f}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,227 @@
+"""
+Benchmark suite for the scoring and notification paths.
+
+Measures
+
+* scoring one machine at a time and in batches of several sizes, with
+  readings from ``data/data.npz``;
+* parsing synthetic notifications built with ``MachineSampler``, both
+  into pydantic models and into a columnar batch;
+* end-to-end ``/updates`` throughput through FastAPI's test client, with
+  estimates going to an in-process fake Orion.
+
+and writes the results to a JSON file so runs can be compared. Run from
+the repo root with
+
+    python -m tests.bench.suite --out bench.json
+
+and then, after making changes,
+
+    python -m tests.bench.suite --out new.json --baseline bench.json
+
+to check for regressions. Each result is in seconds per operation, so
+lower is better; the run fails if any result got slower than its
+baseline by more than the threshold.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import anomaly_detection.config as config
+
+
+BATCH_SIZES = [1, 10, 100, 1000]
+NOTIFICATION_SIZES = [1, 10, 100]
+UPDATES_RUNS = [(200, 1), (50, 10), (20, 100)]
+FAKE_ORION_URL = 'http://orion.fake:1026'
+DEFAULT_THRESHOLD = 0.2
+
+Results = Dict[str, Dict[str, float]]
+
+
+def per_call_secs(fn: Callable, repeat: int = 5, number: int = 20) -> float:
+    best = min(timeit.repeat(fn, repeat=repeat, number=number))
+    return best / number
+
+
+def bench_scoring() -> Results:
+    from anomaly_detection.ai import predict, predict_machines
+    from anomaly_detection.batch import MachineBatch
+    from anomaly_detection.ngsy import FloatAttr, MachineEntity
+
+    readings = MachineBatch.from_npz('data/data.npz')
+    machine = MachineEntity(id='1', Joules=FloatAttr.new(7.0))
+
+    results = {'score.single': {'secs': per_call_secs(lambda: predict(machine)),
+                                'ops': 1}}
+    for n in BATCH_SIZES:
+        batch = readings.take(np.arange(n) % len(readings))
+        secs = per_call_secs(lambda: predict_machines(batch))
+        results[f"score.batch.{n}"] = {'secs': secs, 'ops': n}
+    return results
+
+
+def notification_data(machines_n: int) -> List[dict]:
+    from tests.util.sampler import MachineSampler
+
+    sampler = MachineSampler(machines_n)
+    return [sampler.new_machine_entity(nid).dict(exclude_none=True)
+            for nid in range(1, machines_n + 1)]
+
+
+def bench_parsing() -> Results:
+    from anomaly_detection.batch import MachineBatch
+    from anomaly_detection.ngsy import MachineEntity
+    from anomaly_detection.util.ngsi.entity import EntityUpdateNotification, \
+        filter_raw_entities
+
+    def to_models(data):
+        return EntityUpdateNotification(data=data) \
+            .filter_entities(MachineEntity)
+
+    def to_batch(data):
+        ms = filter_raw_entities(data, MachineEntity.entity_type())
+        return MachineBatch.from_entities(ms).numeric('Joules')
+
+    results = {}
+    for n in NOTIFICATION_SIZES:
+        data = notification_data(n)
+        results[f"parse.models.{n}"] = {
+            'secs': per_call_secs(lambda: to_models(data)), 'ops': n}
+        results[f"parse.batch.{n}"] = {
+            'secs': per_call_secs(lambda: to_batch(data)), 'ops': n}
+    return results
+
+
+def run_updates(notifications_n: int, machines_n: int) -> Dict[str, float]:
+    from fastapi.testclient import TestClient
+
+    import anomaly_detection.enteater as enteater
+    from anomaly_detection.main import app
+    from anomaly_detection.util.ngsi.orion import OrionClientCache
+    from tests.util.fakeorion import FakeOrion
+
+    bodies = [json.dumps({'data': notification_data(machines_n)})
+              for _ in range(notifications_n)]
+    headers = {'Content-Type': 'application/json',
+               'fiware-service': 'csic'}
+    orion = FakeOrion(record=False)
+    clients = enteater.orion_clients
+    enteater.orion_clients = OrionClientCache(transport=orion)
+    try:
+        with TestClient(app) as client:
+            start = time.perf_counter()
+            for body in bodies:
+                client.post('/updates', data=body, headers=headers)
+        secs = time.perf_counter() - start
+    finally:
+        enteater.orion_clients = clients
+
+    return {'secs': secs / (notifications_n * machines_n),
+            'ops': notifications_n * machines_n,
+            'machines_per_sec': notifications_n * machines_n / secs,
+            'upserted': orion.upserted_n}
+# NOTE. Draining. Leaving the test client context shuts the app down,
+# which waits for the pipeline to process whatever is still queued and
+# writes out any buffered estimates. So the clock stops only after all
+# the estimates reached the fake Orion.
+
+
+def bench_updates(repeat: int = 3) -> Results:
+    results = {}
+    for notifications_n, machines_n in UPDATES_RUNS:
+        runs = [run_updates(notifications_n, machines_n)
+                for _ in range(repeat)]
+        name = f"updates.{notifications_n}x{machines_n}"
+        results[name] = min(runs, key=lambda r: r['secs'])
+    return results
+
+
+def run_suite() -> dict:
+    os.environ[config.ORION_BASE_URL_VAR] = FAKE_ORION_URL
+    os.environ.setdefault(config.LOG_LEVEL_VAR, 'WARNING')
+    random.seed(0)
+
+    results = {}
+    results.update(bench_scoring())
+    results.update(bench_parsing())
+    results.update(bench_updates())
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'scoring_mode': config.scoring_mode()
+        },
+        'results': results
+    }
+
+
+def regressions(current: Results, baseline: Results,
+                threshold: float) -> List[str]:
+    """
+    Compare two runs.
+
+    :param current: the results of this run.
+    :param baseline: the results to compare to.
+    :param threshold: max slowdown allowed, as a fraction of the
+        baseline, e.g. ``0.2`` for 20%.
+    :return: the names of the results that got slower than allowed.
+    """
+    return [name for name, r in current.items()
+            if name in baseline and
+            r['secs'] > baseline[name]['secs'] * (1 + threshold)]
+
+
+def print_results(current: Results, baseline: Results):
+    print(f"{'benchmark':<22} {'usecs/op':>12} {'baseline':>12} " +
+          f"{'change':>8}")
+    for name, r in current.items():
+        usecs = r['secs'] * 1e6
+        line = f"{name:<22} {usecs:>12.2f}"
+        if name in baseline:
+            base = baseline[name]['secs'] * 1e6
+            line += f" {base:>12.2f} {(usecs / base - 1) * 100:>+7.1f}%"
+        print(line)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='JSON results to compare to')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='max slowdown allowed vs the baseline, ' +
+                             'e.g. 0.2 for 20%%')
+    args = parser.parse_args(argv)
+
+    run = run_suite()
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_results(run['results'], baseline)
+
+    slower = regressions(run['results'], baseline, args.threshold)
+    for name in slower:
+        print(f"regression: {name}", file=sys.stderr)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,55 @@
+"""
+Microbenchmark: building the ``/v2/op/update`` body for a batch of
+estimates, going through the pydantic upsert model and the standard
+``json`` module (what ``requests`` does with a ``json`` argument) vs
+serialising straight to bytes.
+
+Run from the repo root with
+
+    python -m tests.bench.upsert
+
+"""
+
+import json
+import timeit
+
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util import fastjson
+from anomaly_detection.util.ngsi.entity import EntitiesUpsert, FloatAttr, \
+    TextAttr, entities_upsert_json
+
+
+BATCH_SIZES = [1000, 10000]
+
+
+def per_call_msecs(fn, repeat: int = 5, number: int = 5) -> float:
+    best = min(timeit.repeat(fn, repeat=repeat, number=number))
+    return best / number * 1e3
+
+
+def estimates(n: int) -> [AnomalyDetectionEntity]:
+    version = TextAttr.new('anomaly_detection')
+    return [AnomalyDetectionEntity(id=f"urn:ngsi-ld:Machine:{k}",
+                                   Label=FloatAttr.new(k % 2),
+                                   ModelVersion=version)
+            for k in range(n)]
+
+
+def pydantic_payload(es: [AnomalyDetectionEntity]) -> bytes:
+    payload = EntitiesUpsert(entities=es).dict()
+    return json.dumps(payload, allow_nan=False).encode('utf-8')
+
+
+def run():
+    print(f"json backend: {fastjson.BACKEND}")
+    print(f"{'batch':>6} {'pydantic (ms)':>14} {'direct (ms)':>12} " +
+          f"{'speedup':>8}")
+    for n in BATCH_SIZES:
+        es = estimates(n)
+        slow = per_call_msecs(lambda: pydantic_payload(es))
+        fast = per_call_msecs(lambda: entities_upsert_json(es))
+        print(f"{n:>6} {slow:>14.2f} {fast:>12.2f} {slow / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    run()
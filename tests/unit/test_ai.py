@@ -0,0 +1,54 @@
+from anomaly_detection.ai import predict, predict_batch, predict_machines
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.ngsy import MachineEntity, RawReading
+
+
+def machine(nid: str, joules: float = None) -> MachineEntity:
+    m = RawReading(Joules=joules).to_machine_entity(entity_id='')
+    return m.set_id_with_type_prefix(nid)
+
+
+def test_batch_matches_single_predictions():
+    ms = [machine(str(k), j) for k, j in enumerate([7.0, -0.6, 6.9, 30.0])]
+    want = [predict(m) for m in ms]
+    got = predict_batch(ms)
+
+    assert want == got
+
+
+def test_batch_skips_machines_without_readings():
+    ms = [machine('1', 7.0), machine('2'), machine('3', -0.6)]
+    got = predict_batch(ms)
+
+    assert [e.id for e in got] == [ms[0].id, ms[2].id]
+
+
+def test_empty_batch():
+    assert predict_batch([]) == []
+    assert predict_batch([machine('1')]) == []
+
+
+def test_estimates_carry_model_version():
+    got = predict_batch([machine('1', 7.0), machine('2', -3.0)])
+
+    assert [e.Label.value for e in got] == [0, 1]
+    assert {e.ModelVersion.value for e in got} == {'anomaly_detection'}
+
+
+def test_raw_entities_match_machines():
+    ms = [machine(str(k), j) for k, j in enumerate([7.0, -0.6, 6.0, -3.0])]
+    entities = [m.dict(exclude_none=True) for m in ms]
+
+    assert predict_machines(MachineBatch.from_entities(entities)) == \
+        predict_batch(ms)
+
+
+def test_raw_entities_without_id_or_readings():
+    entities = [{'id': '1', 'type': 'Machine', 'Joules': {'value': 7.0}},
+                {'id': '2', 'type': 'Machine'},
+                {'id': '3', 'type': 'Machine', 'Joules': {'value': None}},
+                {'type': 'Machine', 'Joules': {'value': -3.0}},
+                {'id': '5', 'type': 'Machine', 'Joules': {'value': -3.0}}]
+    got = predict_machines(MachineBatch.from_entities(entities))
+
+    assert [(e.id, e.Label.value) for e in got] == [('1', 0), ('5', 1)]
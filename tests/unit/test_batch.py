@@ -0,0 +1,85 @@
+import numpy as np
+
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.ngsy import MachineEntity, RawReading
+
+
+sensors_data = {"Barcode": "ZLM001", "Face": "2nd", "Cell": "8th",
+                "Point": "1st", "Group": "A+E1", "Joules": 4.5,
+                "Charge": 100.5, "Residue": 98.24, "Force_N": 24.2,
+                "Force_N_1": 23.5, "Datetime": "2020-06-08 00:00:00"}
+
+
+def test_raw_readings_round_trip():
+    rr = RawReading(**sensors_data)
+    batch = MachineBatch.from_raw_readings([rr], ids=['m1'])
+
+    assert batch.to_machine_entities() == [rr.to_machine_entity('m1')]
+
+
+def test_entities_round_trip():
+    ms = [RawReading(**sensors_data).to_machine_entity('m1'),
+          MachineEntity(id='m2')]
+    batch = MachineBatch.from_machine_entities(ms)
+
+    assert batch.to_machine_entities() == ms
+
+
+def test_invalid_raw_readings():
+    readings = [{"Joules": 4.5}, {"Joules": 3}, {"Charge": 1.0},
+                {"Joules": "x"}, {"Joules": True}, None, 7]
+    batch = MachineBatch.from_raw_readings(readings)
+
+    assert batch.numeric('Joules')[:2].tolist() == [4.5, 3.0]
+    assert batch.valid('Joules').tolist() == [True, True] + [False] * 5
+    assert batch.ids == [''] * 7
+
+
+def test_categorical_interning():
+    entities = [{'id': str(k), 'Group': {'value': g}}
+                for k, g in enumerate(['A', 'B', None, 'A', 1])]
+    group = MachineBatch.from_entities(entities).categorical('Group')
+
+    assert group.codes.tolist() == [0, 1, -1, 0, -1]
+    assert group.categories == ['A', 'B']
+    assert group.values() == ['A', 'B', None, 'A', None]
+
+
+def test_take_and_concat():
+    entities = MachineBatch.from_entities(
+        [{'id': '1', 'Joules': {'value': 1.0}, 'Face': {'value': 'x'}},
+         {'id': '2', 'Joules': {'value': 2.0}}])
+    readings = MachineBatch.from_raw_readings(
+        [{'Joules': 3.0, 'Face': 'y'}], ids=['3'])
+
+    batch = MachineBatch.concat([entities, readings])
+    assert batch.ids == ['1', '2', '3']
+    assert batch.numeric('Joules').tolist() == [1.0, 2.0, 3.0]
+    assert batch.categorical('Face').values() == ['x', None, 'y']
+
+    picked = batch.take(batch.numeric('Joules') > 1.5)
+    assert picked.ids == ['2', '3']
+    assert picked.categorical('Face').values() == [None, 'y']
+
+
+def test_concat_keeps_added_columns():
+    first = MachineBatch.from_entities([{'id': '1', 'Joules': {'value': 1.0}}])
+    second = MachineBatch.from_entities([{'id': '2', 'Joules': {'value': 2.0}}])
+    first.set_numeric('Joules_mean', np.array([0.5]))
+    readings = MachineBatch.from_raw_readings([{'Joules': 3.0}], ids=['3'])
+
+    batch = MachineBatch.concat([first, second])
+    np.testing.assert_array_equal(batch.numeric('Joules_mean'), [0.5, np.nan])
+
+    batch = MachineBatch.concat([first, readings])
+    np.testing.assert_array_equal(batch.numeric('Joules_mean'), [0.5, np.nan])
+    assert batch.numeric('Joules').tolist() == [1.0, 3.0]
+
+
+def test_npz():
+    batch = MachineBatch.from_npz('data/data.npz')
+    test = np.load('data/data.npz')['test']
+
+    assert len(batch) == len(test)
+    assert np.array_equal(batch.numeric('Joules'), test[:, 0])
+    assert not batch.valid('Charge').any()
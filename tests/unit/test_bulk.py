@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import anomaly_detection.ai as ai
+import anomaly_detection.config as config
+from anomaly_detection.ai import predict_readings, score_readings
+from anomaly_detection.bulk import score_file
+from anomaly_detection.features import spec_path
+from anomaly_detection.model import ModelProvider, load_forest
+
+
+def test_score_readings_match_labels():
+    joules = np.array([7.0, np.nan, -3.0])
+    labels, scores = score_readings(joules)
+
+    assert np.array_equal(labels, predict_readings(joules), equal_nan=True)
+    assert np.isnan(scores[1]) and scores[2] > scores[0]
+
+
+def test_npz_to_npy_in_chunks(tmp_path):
+    target = tmp_path / 'labels.npy'
+    rows = score_file(Path('data/data.npz'), target, key='test',
+                      chunk_size=300)
+
+    joules = np.load('data/data.npz')['test'][:, 0]
+    got = np.load(target)
+    assert rows == len(joules) == len(got)
+    assert np.array_equal(got[:, 0], predict_readings(joules))
+
+
+def test_csv_to_csv_with_workers(tmp_path):
+    source, target = tmp_path / 'readings.csv', tmp_path / 'labels.csv'
+    joules = [7.0, -3.0, None, 6.0, 'x']
+    pd.DataFrame({'Barcode': 'ZLM001', 'Joules': joules}) \
+        .to_csv(source, index=False)
+
+    score_file(source, target, chunk_size=2, workers=2)
+
+    got = pd.read_csv(target)
+    assert got['Label'].tolist()[:2] == [0, 1]
+    assert got['Label'].isna().tolist() == [False, False, True, False, True]
+    assert got['Score'].isna().tolist() == [False, False, True, False, True]
+
+
+def test_reject_model_taking_more_than_joules(tmp_path, monkeypatch):
+    model_dir = tmp_path / 'model'
+    load_forest(config.DEFAULT_MODEL_PATH).save(model_dir)
+    spec = {'numeric': [{'name': 'Charge'}]}
+    spec_path(model_dir).write_text(json.dumps(spec))
+    monkeypatch.setattr(ai, 'provider',
+                        ModelProvider(model_dir, config.TABLE_SCORING))
+    target = tmp_path / 'labels.csv'
+
+    with pytest.raises(ValueError):
+        score_file(Path('data/data.npz'), target, key='test')
+    assert not target.exists()
@@ -0,0 +1,110 @@
+import time
+
+from anomaly_detection.coalesce import UpsertCoalescer
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util.ngsi.entity import FloatAttr
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+def estimate(nid: int, label: float = 0) -> AnomalyDetectionEntity:
+    return AnomalyDetectionEntity(id=str(nid), Label=FloatAttr.new(label))
+
+
+def ctx(service: str, path: str = None, correlator: str = None) \
+        -> FiwareContext:
+    return FiwareContext(service=service, service_path=path,
+                         correlator=correlator)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, ctx: FiwareContext, es: [AnomalyDetectionEntity]):
+        self.batches.append(
+            ((ctx.service, ctx.service_path),
+             [(e.id, e.Label.value) for e in es])
+        )
+
+
+def test_no_buffering_without_delay():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_delay=0)
+    coalescer.add(ctx('s'), [estimate(1), estimate(1, 1)])
+
+    assert sink.batches == [(('s', None), [('1', 0), ('1', 1)])]
+
+
+def test_flush_on_size():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_batch=3, max_delay=60)
+    coalescer.add(ctx('s'), [estimate(1)])
+    coalescer.add(ctx('s'), [estimate(2)])
+    assert sink.batches == []
+
+    coalescer.add(ctx('s'), [estimate(3)])
+    assert sink.batches == [(('s', None), [('1', 0), ('2', 0), ('3', 0)])]
+
+
+def test_keep_latest_estimate_per_entity():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_batch=10, max_delay=60)
+    coalescer.add(ctx('s'), [estimate(1), estimate(2)])
+    coalescer.add(ctx('s'), [estimate(1, 1)])
+    coalescer.flush()
+
+    assert sink.batches == [(('s', None), [('1', 1), ('2', 0)])]
+    assert coalescer.stats() == {'added': 3, 'deduplicated': 1,
+                                 'flushes': 1}
+
+
+def test_buffer_per_service_and_path():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_batch=10, max_delay=60)
+    coalescer.add(ctx('s', correlator='c1'), [estimate(1)])
+    coalescer.add(ctx('s', '/p'), [estimate(1)])
+    coalescer.add(ctx('t'), [estimate(1)])
+    coalescer.add(ctx('s', correlator='c2'), [estimate(2)])
+    coalescer.flush()
+
+    assert sorted(sink.batches, key=lambda b: str(b[0])) == [
+        (('s', '/p'), [('1', 0)]),
+        (('s', None), [('1', 0), ('2', 0)]),
+        (('t', None), [('1', 0)])
+    ]
+
+
+def test_flush_on_time():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_batch=10, max_delay=0.02)
+    coalescer.start()
+    try:
+        coalescer.add(ctx('s'), [estimate(1)])
+        for _ in range(200):
+            if sink.batches:
+                break
+            time.sleep(0.01)
+        assert sink.batches == [(('s', None), [('1', 0)])]
+    finally:
+        coalescer.stop()
+
+
+def test_stop_writes_out_buffers():
+    sink = Recorder()
+    coalescer = UpsertCoalescer(sink, max_batch=10, max_delay=60)
+    coalescer.start()
+    coalescer.add(ctx('s'), [estimate(1)])
+    coalescer.stop()
+
+    assert sink.batches == [(('s', None), [('1', 0)])]
+
+
+def test_sink_failures_are_contained():
+    def sink(c, es):
+        raise ConnectionError()
+
+    coalescer = UpsertCoalescer(sink, max_batch=1, max_delay=60)
+    coalescer.add(ctx('s'), [estimate(1)])
+
+    assert coalescer.stats()['flushes'] == 1
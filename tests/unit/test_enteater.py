@@ -0,0 +1,214 @@
+import json
+
+from fastapi.testclient import TestClient
+import numpy as np
+from pyod.models.iforest import IForest
+import pytest
+from requests import HTTPError
+from uri import URI
+
+from anomaly_detection.coalesce import UpsertCoalescer
+import anomaly_detection.ai as ai
+import anomaly_detection.config as config
+import anomaly_detection.enteater as enteater
+from anomaly_detection.features import spec_path
+from anomaly_detection.iforest import CompiledForest
+import anomaly_detection.main as main
+import anomaly_detection.metrics as metrics
+from anomaly_detection.model import ModelProvider
+from anomaly_detection.ngsy import AnomalyDetectionEntity, MachineEntity
+from anomaly_detection.pipeline import NotificationPipeline
+from anomaly_detection.published import PublishedLabels
+from anomaly_detection.results import ResultCache
+from anomaly_detection.util.http.jclient import JsonClient
+from anomaly_detection.util.ngsi.entity import FloatAttr
+from anomaly_detection.util.ngsi.headers import FiwareContext
+from anomaly_detection.util.ngsi.orion import OrionClient, OrionClientCache
+from anomaly_detection.windows import MachineWindows
+from anomaly_detection.writer import OrionWriter
+from tests.util.fakeorion import FakeOrion
+
+
+ORION_URL = 'http://orion:1026'
+CTX = FiwareContext(service='csic', service_path=None, correlator=None)
+
+
+def estimate(nid: str, label: float) -> AnomalyDetectionEntity:
+    return AnomalyDetectionEntity(id=nid, Label=FloatAttr.new(label))
+
+
+@pytest.fixture
+def orion(monkeypatch) -> FakeOrion:
+    fake = FakeOrion()
+    monkeypatch.setenv(config.ORION_BASE_URL_VAR, ORION_URL)
+    monkeypatch.setattr(enteater, 'orion_clients',
+                        OrionClientCache(transport=fake))
+    yield fake
+    fake.close()
+
+
+def test_upsert_estimates(orion):
+    enteater.upsert_estimates(CTX, [estimate('1', 0), estimate('2', 1)])
+
+    request = orion.requests[0]
+    assert (request.method, request.path) == ('POST', '/v2/op/update')
+    assert {e['id']: e['Label']['value'] for e in orion.entities('csic')} \
+        == {'1': 0, '2': 1}
+
+
+def test_count_orion_errors(orion):
+    errors = metrics.orion_errors.value()
+    orion.fail_next(status=503)
+
+    with pytest.raises(HTTPError):
+        enteater.upsert_estimates(CTX, [estimate('1', 0)])
+    assert metrics.orion_errors.value() == errors + 1
+    assert orion.entities('csic') == []
+
+
+def test_notify_subscribers(orion, monkeypatch):
+    got = []
+    monkeypatch.setattr(main, 'pipeline',
+                        NotificationPipeline(lambda c, ms: got.extend(ms)))
+
+    with TestClient(main.app) as client:
+        orion.notifier = client
+        sub_orion = OrionClient(URI(ORION_URL), CTX,
+                                JsonClient(transport=orion))
+        sub_orion.subscribe({
+            'subject': {'entities': [{'idPattern': '.*', 'type': 'Machine'}]},
+            'notification': {'http': {'url': 'http://anomaly/updates'}}
+        })
+        sub_orion.upsert_entities([
+            MachineEntity(id='m1', Joules=FloatAttr.new(7.0))])
+        orion.drain()
+
+    assert [m['id'] for m in got] == ['m1']
+
+
+def machine(nid: str, joules: float) -> dict:
+    return {'id': nid, 'type': 'Machine', 'Joules': {'value': joules},
+            'Datetime': {'value': '2022-06-08 00:00:00'}}
+
+
+def test_skip_readings_already_scored(orion, monkeypatch):
+    monkeypatch.setattr(enteater, 'results', ResultCache())
+    monkeypatch.setattr(enteater, 'update_context',
+                        lambda ctx, es: enteater.upsert_estimates(ctx, es))
+
+    enteater.process_update(CTX, [machine('1', 7.0), machine('2', -3.0)])
+    enteater.process_update(CTX, [machine('1', 7.0), machine('2', 6.0)])
+
+    upserted = [[e['id'] for e in r.body['entities']] for r in orion.requests]
+    assert upserted == [['1', '2'], ['2']]
+    assert enteater.results.stats()['hits'] == 1
+
+
+def test_rescore_readings_that_failed_scoring(orion, monkeypatch):
+    monkeypatch.setattr(enteater, 'results', ResultCache())
+    monkeypatch.setattr(enteater, 'update_context',
+                        lambda ctx, es: enteater.upsert_estimates(ctx, es))
+    predict_machines = enteater.predict_machines
+
+    def broken(batch):
+        raise RuntimeError('scoring failed')
+
+    monkeypatch.setattr(enteater, 'predict_machines', broken)
+    with pytest.raises(RuntimeError):
+        enteater.process_update(CTX, [machine('1', 7.0)])
+    monkeypatch.setattr(enteater, 'predict_machines', predict_machines)
+    enteater.process_update(CTX, [machine('1', 7.0)])
+
+    assert [e['id'] for e in orion.entities('csic')] == ['1']
+
+
+class CountingWindows(MachineWindows):
+
+    def __init__(self):
+        super().__init__(attrs=['Joules'])
+        self.updates = 0
+
+    def update(self, keys, values, stamps=None):
+        self.updates += len(keys)
+        return super().update(keys, values, stamps)
+
+
+def test_skip_readings_already_windowed(orion, monkeypatch, tmp_path):
+    X = np.random.default_rng(0).normal(7, 1, (200, 2))
+    CompiledForest.from_model(IForest(n_estimators=10).fit(X)) \
+        .save(tmp_path)
+    spec = {'numeric': [{'name': 'Joules'}, {'name': 'Joules_mean'}]}
+    spec_path(tmp_path).write_text(json.dumps(spec))
+    provider = ModelProvider(tmp_path, config.TABLE_SCORING)
+    monkeypatch.setattr(ai, 'provider', provider)
+    monkeypatch.setattr(enteater, 'provider', provider)
+    monkeypatch.setattr(enteater, 'results', ResultCache())
+    monkeypatch.setattr(enteater, 'windows', CountingWindows())
+    monkeypatch.setattr(enteater, 'update_context', lambda ctx, es: None)
+
+    for _ in range(3):
+        enteater.process_update(CTX, [machine('1', 7.0)])
+
+    assert enteater.results.stats()['hits'] == 2
+    assert enteater.windows.updates == 1
+
+
+def giving_up_writer() -> OrionWriter:
+    return OrionWriter(enteater.upsert_estimates,
+                       on_drop=enteater.forget_estimates, retries=0,
+                       spill_size=0)
+
+
+def test_rescore_readings_not_published(orion, monkeypatch):
+    monkeypatch.setattr(enteater, 'results', ResultCache())
+    writer = giving_up_writer()
+    monkeypatch.setattr(enteater, 'update_context', writer.write)
+    orion.fail_next(status=503)
+
+    enteater.process_update(CTX, [machine('1', 7.0)])
+    enteater.process_update(CTX, [machine('1', 7.0)])
+
+    assert [e['id'] for e in orion.entities('csic')] == ['1']
+
+
+def test_change_only_upserts(orion, monkeypatch):
+    monkeypatch.setattr(enteater, 'published', PublishedLabels())
+    monkeypatch.setattr(enteater, 'coalescer', UpsertCoalescer(
+        enteater.upsert_estimates, max_delay=0))
+
+    enteater.update_context(CTX, [estimate('1', 0), estimate('2', 1)])
+    enteater.update_context(CTX, [estimate('1', 0), estimate('2', 0)])
+    enteater.update_context(CTX, [estimate('1', 0)])
+
+    upserted = [[e['id'] for e in r.body['entities']] for r in orion.requests]
+    assert upserted == [['1', '2'], ['2']]
+    assert enteater.published.stats()['suppressed'] == 2
+
+
+def test_resend_estimates_not_published(orion, monkeypatch):
+    monkeypatch.setattr(enteater, 'published', PublishedLabels())
+    writer = giving_up_writer()
+    orion.fail_next(status=503)
+
+    writer.write(CTX, enteater.published.changed(CTX, [estimate('1', 0)]))
+
+    assert len(enteater.published.changed(CTX, [estimate('1', 0)])) == 1
+
+
+def test_ignore_own_estimates(orion, monkeypatch):
+    got = []
+    monkeypatch.setattr(main, 'pipeline',
+                        NotificationPipeline(lambda c, ms: got.extend(ms)))
+
+    with TestClient(main.app) as client:
+        orion.notifier = client
+        sub_orion = OrionClient(URI(ORION_URL), CTX,
+                                JsonClient(transport=orion))
+        sub_orion.subscribe({
+            'subject': {'entities': [{'idPattern': '.*'}]},
+            'notification': {'http': {'url': 'http://anomaly/updates'}}
+        })
+        sub_orion.upsert_entities([estimate('m1', 1)])
+        orion.drain()
+
+    assert got == []
@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+from pyod.models.iforest import IForest
+import pytest
+
+import anomaly_detection.config as config
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.features import FeatureExtractor, FeatureSpec, \
+    load_spec, spec_path
+from anomaly_detection.iforest import CompiledForest
+from anomaly_detection.model import ModelProvider, load_forest, load_model
+
+
+READINGS = [{'Joules': 7.0, 'Charge': 1.0, 'Face': '2nd'},
+            {'Charge': 2.0, 'Face': '1st'},
+            {'Joules': -3.0, 'Face': '9th'}]
+
+
+def extract(spec: dict) -> (np.ndarray, np.ndarray):
+    extractor = FeatureExtractor(FeatureSpec.parse_obj(spec))
+    return extractor(MachineBatch.from_raw_readings(READINGS))
+
+
+def test_default_spec_takes_joules():
+    X, ok = FeatureExtractor(FeatureSpec.default())(
+        MachineBatch.from_raw_readings(READINGS))
+
+    assert X.dtype == np.float32 and X.flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(X, [[7.0], [np.nan], [-3.0]])
+    assert ok.tolist() == [True, False, True]
+
+
+def test_fill_missing_values():
+    X, ok = extract({'numeric': [{'name': 'Joules', 'fill': 0},
+                                 {'name': 'Charge'}],
+                     'missing': 'fill', 'fill': -1})
+
+    np.testing.assert_array_equal(X, [[7, 1], [0, 2], [-3, -1]])
+    assert ok.all()
+
+
+def test_skip_missing_values():
+    X, ok = extract({'numeric': [{'name': 'Joules'}, {'name': 'Charge'}]})
+
+    assert ok.tolist() == [True, False, False]
+
+
+def test_ordinal_encoding():
+    X, _ = extract({'numeric': [],
+                    'categorical': [{'name': 'Face', 'encoding': 'ordinal',
+                                     'categories': ['1st', '2nd']},
+                                    {'name': 'Cell', 'categories': ['8th']}]})
+
+    np.testing.assert_array_equal(X, [[1, 0], [0, 0], [-1, 0]])
+
+
+def test_spec_files_next_to_models(tmp_path):
+    assert spec_path(tmp_path / 'm.pkl') == tmp_path / 'm.features.json'
+    assert spec_path(tmp_path) == tmp_path / 'features.json'
+    assert load_spec(tmp_path / 'm.pkl') == FeatureSpec.default()
+
+
+def test_reject_spec_not_matching_model(tmp_path):
+    load_forest(config.DEFAULT_MODEL_PATH).save(tmp_path)
+    spec = {'numeric': [{'name': 'Joules'}, {'name': 'Charge'}]}
+    spec_path(tmp_path).write_text(json.dumps(spec))
+
+    with pytest.raises(ValueError):
+        load_model(tmp_path, config.FOREST_SCORING)
+
+
+def test_score_with_multi_feature_model(tmp_path):
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.normal(10, 1, 500), rng.integers(0, 2, 500)])
+    model = IForest(n_estimators=20, random_state=0).fit(X)
+    forest = CompiledForest.from_model(model)
+    forest.save(tmp_path)
+    spec = {'numeric': [{'name': 'Joules'}],
+            'categorical': [{'name': 'Face', 'categories': ['1st', '2nd'],
+                             'encoding': 'ordinal'}]}
+    spec_path(tmp_path).write_text(json.dumps(spec))
+
+    provider = ModelProvider(tmp_path, config.TABLE_SCORING)
+    scorer = provider.get().scorer
+    X, ok = provider.get().features(MachineBatch.from_raw_readings(READINGS))
+
+    assert isinstance(scorer, CompiledForest)
+    assert ok.tolist() == [True, False, True]
+    np.testing.assert_array_equal(scorer.predict(X[ok]),
+                                  model.predict(X[ok]))
@@ -0,0 +1,57 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from anomaly_detection.iforest import CompiledForest, average_path_length
+
+
+@pytest.fixture(scope='module')
+def model():
+    with open('data/anomaly_detection.pkl', 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def samples() -> np.ndarray:
+    data = np.load('data/data.npz')
+    readings = np.concatenate([data['train'][:, 0], data['test'][:, 0],
+                               np.linspace(-50, 50, 5001)])
+    return readings.reshape(-1, 1)
+
+
+def test_average_path_length():
+    got = average_path_length(np.array([0, 1, 2, 3, 256]))
+
+    assert got[0] == 0.0
+    assert got[1] == 0.0
+    assert got[2] == 1.0
+    assert got[3] == pytest.approx(2.0 * (np.log(2.0) + np.euler_gamma)
+                                   - 2.0 * 2.0 / 3.0)
+    assert got[4] == pytest.approx(10.2447, abs=1e-4)
+
+
+def test_decision_function_parity(model, samples):
+    forest = CompiledForest.from_model(model)
+
+    want = model.decision_function(samples)
+    got = forest.decision_function(samples)
+
+    np.testing.assert_allclose(got, want, rtol=0, atol=1e-12)
+
+
+def test_label_parity(model, samples):
+    forest = CompiledForest.from_model(model)
+
+    want = model.predict(samples)
+    got = forest.predict(samples)
+
+    np.testing.assert_array_equal(got, want)
+
+
+def test_leaves_are_leaves(model, samples):
+    forest = CompiledForest.from_model(model)
+    leaves = forest.leaves(samples.astype(np.float32))
+
+    np.testing.assert_array_equal(forest.left[leaves], leaves)
+    np.testing.assert_array_equal(forest.right[leaves], leaves)
@@ -0,0 +1,52 @@
+import pytest
+
+import anomaly_detection.log as log
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+CTX = FiwareContext(service='csic', service_path='/', correlator=None)
+
+
+class ExplodingBatch(MachineBatch):
+
+    def rows(self):
+        raise AssertionError('rendered machine rows')
+
+
+@pytest.fixture
+def logging_at():
+    def start(level: str):
+        log.start(level)
+    yield start
+    log.stop()
+
+
+def test_summary_only_at_info(logging_at, capsys):
+    logging_at('INFO')
+    batch = ExplodingBatch(ids=[str(k) for k in range(12)])
+    log.going_to_process_updates(CTX, batch)
+    log.stop()
+
+    out = capsys.readouterr().out
+    assert 'going to process 12 machines' in out
+    assert '0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ... (2 more)' in out
+
+
+def test_details_at_debug(logging_at, capsys):
+    logging_at('DEBUG')
+    batch = MachineBatch.from_raw_readings([{'Joules': 7.0}], ids=['m1'])
+    log.going_to_process_updates(CTX, batch)
+    log.stop()
+
+    assert "{'id': 'm1', 'Joules': 7.0}" in capsys.readouterr().out
+
+
+def test_render_before_queueing(logging_at, capsys):
+    logging_at('INFO')
+    ids = ['m1', 'm2']
+    log.going_to_process_updates(CTX, MachineBatch(ids=ids))
+    ids.append('m3')
+    log.stop()
+
+    assert ': m1, m2\n' in capsys.readouterr().out
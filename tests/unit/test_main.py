@@ -0,0 +1,198 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import anomaly_detection.config as config
+import anomaly_detection.main as main
+from anomaly_detection.main import app
+from anomaly_detection.pipeline import NotificationPipeline
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+def test_admin_model_version():
+    with TestClient(app) as client:
+        response = client.get('/admin/model')
+
+        assert response.status_code == 200
+        assert response.json() == {'version': 'anomaly_detection'}
+
+
+def test_admin_model_reload():
+    with TestClient(app) as client:
+        response = client.post('/admin/model/reload')
+
+        assert response.status_code == 202
+        assert response.json() == {'version': 'anomaly_detection'}
+
+
+def test_ready():
+    with TestClient(app) as client:
+        response = client.get('/ready')
+
+        assert response.status_code == 200
+        assert response.json() == {'ready': True,
+                                   'version': 'anomaly_detection'}
+
+
+def test_not_ready_before_startup():
+    client = TestClient(app)
+    response = client.get('/ready')
+
+    assert response.status_code == 503
+
+
+def test_raw_reading():
+    with TestClient(app) as client:
+        response = client.post('/rawReading', json={'Joules': -3.0})
+
+        assert response.status_code == 200
+        assert response.json() == {'Label': 1.0}
+
+
+def test_raw_reading_without_joules():
+    with TestClient(app) as client:
+        response = client.post('/rawReading', json={'Charge': 1.0})
+
+        assert response.status_code == 422
+        assert response.json() == {'detail': 'missing readings: Joules'}
+
+
+def notification(*entities: dict) -> dict:
+    return {'data': list(entities)}
+
+
+def machine(nid: str, joules: float) -> dict:
+    return {'id': nid, 'type': 'Machine',
+            'Joules': {'type': 'Number', 'value': joules}}
+
+
+def test_updates_get_queued(monkeypatch):
+    got = []
+    pipeline = NotificationPipeline(lambda c, ms: got.extend(ms))
+    monkeypatch.setattr(main, 'pipeline', pipeline)
+
+    with TestClient(app) as client:
+        response = client.post('/updates', json=notification(
+            machine('1', 7.0), {'id': '2', 'type': 'NotMe'}))
+        assert response.status_code == 204
+
+    assert [m['id'] for m in got] == ['1']
+
+
+def test_updates_skip_own_estimates(monkeypatch):
+    got = []
+    pipeline = NotificationPipeline(lambda c, ms: got.extend(ms))
+    monkeypatch.setattr(main, 'pipeline', pipeline)
+    estimate = {'id': '1', 'type': 'AnomalyDetection',
+                'Label': {'type': 'Number', 'value': 1}}
+
+    with TestClient(app) as client:
+        response = client.post('/updates', json=notification(
+            machine('1', 7.0), estimate, machine('2', 6.0)))
+        assert response.status_code == 204
+
+    assert [m['id'] for m in got] == ['1', '2']
+
+
+def test_updates_reject_malformed_notifications():
+    client = TestClient(app)
+    for body in [[machine('1', 7.0)], {'data': 'x'}, {'nodata': []}]:
+        response = client.post('/updates', json=body)
+        assert response.status_code == 422
+
+    response = client.post('/updates', data=b'not json', headers={
+        'Content-Type': 'application/json'
+    })
+    assert response.status_code == 422
+
+
+def test_updates_validation_mode(monkeypatch):
+    monkeypatch.setenv(config.VALIDATE_NOTIFICATIONS_VAR, 'true')
+    got = []
+    pipeline = NotificationPipeline(lambda c, ms: got.extend(ms))
+    monkeypatch.setattr(main, 'pipeline', pipeline)
+    bad_machine = {'id': '1', 'type': 'Machine', 'Joules': {'value': 'x'}}
+
+    client = TestClient(app)
+    response = client.post('/updates', json=notification(bad_machine))
+    assert response.status_code == 422
+    assert pipeline.depth() == 0
+
+    response = client.post('/updates', json=notification(machine('1', 7.0)))
+    assert response.status_code == 204
+    assert pipeline.depth() == 1
+
+
+def test_updates_rejected_when_queue_full(monkeypatch):
+    pipeline = NotificationPipeline(lambda c, ms: None, max_size=1)
+    pipeline.submit(FiwareContext(), [])
+    monkeypatch.setattr(main, 'pipeline', pipeline)
+
+    client = TestClient(app)
+    response = client.post('/updates', json=notification(machine('1', 7.0)))
+    assert response.status_code == 429
+
+    response = client.get('/admin/pipeline')
+    assert response.json()['rejected'] == 1
+
+
+def labels_of(response) -> list:
+    return [json.loads(line)['Label']
+            for line in response.text.splitlines()]
+
+
+def test_raw_readings_from_json_array(monkeypatch):
+    monkeypatch.setattr(main, 'RAW_READINGS_CHUNK_SIZE', 2)
+    readings = [{'Joules': 7.0}, {'Joules': -3.0}, {'Charge': 1.0},
+                {'Joules': 6.0, 'Barcode': 'x'}, {'Joules': 7.0}]
+
+    with TestClient(app) as client:
+        response = client.post('/rawReadings', json=readings)
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert labels_of(response) == [0.0, 1.0, None, 1.0, 0.0]
+
+
+def test_raw_readings_from_ndjson_stream(monkeypatch):
+    monkeypatch.setattr(main, 'RAW_READINGS_CHUNK_SIZE', 2)
+    chunks = [b'{"Joules": 7.0}\n{"Joul', b'es": -3.0}\n', b'{oops\n',
+              b'{"Joules": 6.0}']
+
+    with TestClient(app) as client:
+        response = client.post('/rawReadings', data=(c for c in chunks), headers={
+            'Content-Type': 'application/x-ndjson'
+        })
+
+    assert response.status_code == 200
+    assert labels_of(response) == [0.0, 1.0, None, 1.0]
+
+
+def test_raw_readings_rejects_json_object():
+    with TestClient(app) as client:
+        response = client.post('/rawReadings', json={'Joules': 7.0})
+
+    assert response.status_code == 422
+
+
+def test_raw_readings_rejects_malformed_json():
+    with TestClient(app) as client:
+        response = client.post('/rawReadings', data=b'[{"Joules": 7', headers={
+            'Content-Type': 'application/json'
+        })
+
+    assert response.status_code == 422
+
+
+def test_metrics(monkeypatch):
+    monkeypatch.setattr(main, 'pipeline',
+                        NotificationPipeline(lambda c, ms: None))
+
+    with TestClient(app) as client:
+        client.post('/updates', json=notification(machine('1', 7.0)))
+        response = client.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert 'anomaly_stage_seconds_count{stage="parse"}' in response.text
+        assert 'anomaly_queue_depth ' in response.text
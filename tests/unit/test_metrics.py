@@ -0,0 +1,46 @@
+from anomaly_detection.metrics import Registry
+
+
+def test_counter():
+    registry = Registry()
+    c = registry.counter('things_total', 'Things.')
+    c.inc()
+    c.inc(2)
+
+    assert registry.render() == \
+        '# HELP things_total Things.\n' + \
+        '# TYPE things_total counter\n' + \
+        'things_total 3\n'
+
+
+def test_gauge():
+    registry = Registry()
+    registry.gauge('depth', 'Depth.').set_function(lambda: 4)
+
+    assert registry.render().endswith('depth 4\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    h = registry.histogram('secs', 'Seconds.', stage='a')
+    for x in [0.0001, 0.001, 0.003, 20.0]:
+        h.observe(x)
+    lines = registry.render().splitlines()
+
+    assert 'secs_bucket{stage="a",le="0.0005"} 1' in lines
+    assert 'secs_bucket{stage="a",le="0.001"} 2' in lines
+    assert 'secs_bucket{stage="a",le="0.005"} 3' in lines
+    assert 'secs_bucket{stage="a",le="10.0"} 3' in lines
+    assert 'secs_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 'secs_count{stage="a"} 4' in lines
+
+
+def test_labelled_series_share_family():
+    registry = Registry()
+    registry.counter('ops_total', 'Ops.', op='a').inc()
+    registry.counter('ops_total', 'Ops.', op='b').inc(5)
+    text = registry.render()
+
+    assert text.count('# TYPE ops_total counter') == 1
+    assert 'ops_total{op="a"} 1' in text
+    assert 'ops_total{op="b"} 5' in text
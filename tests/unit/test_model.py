@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+import pytest
+
+import anomaly_detection.config as config
+from anomaly_detection.iforest import CompiledForest
+from anomaly_detection.model import ModelProvider, ModelRegistry, load_forest
+from anomaly_detection.ttable import ThresholdTable
+
+
+SAMPLES = np.array([[7.0], [-3.0], [-0.6], [6.0], [30.0]])
+
+
+@pytest.fixture(scope='module')
+def forest() -> CompiledForest:
+    return load_forest(config.DEFAULT_MODEL_PATH)
+
+
+def test_provider_loads_lazily():
+    provider = ModelProvider(config.DEFAULT_MODEL_PATH,
+                             config.FOREST_SCORING)
+    assert not provider.is_loaded()
+
+    model = provider.get()
+    assert provider.is_loaded()
+    assert isinstance(model.scorer, CompiledForest)
+    assert model.version == 'anomaly_detection'
+    assert provider.get() is model
+
+
+def test_provider_table_mode():
+    provider = ModelProvider(config.DEFAULT_MODEL_PATH, config.TABLE_SCORING)
+    provider.warm_up()
+
+    assert isinstance(provider.get().scorer, ThresholdTable)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_bundle_round_trip(forest, tmp_path, mmap):
+    bundle = tmp_path / 'forest'
+    forest.save(bundle)
+
+    provider = ModelProvider(bundle, config.FOREST_SCORING, mmap=mmap)
+    loaded = provider.get().scorer
+
+    assert isinstance(loaded.threshold, np.memmap) == mmap
+    np.testing.assert_array_equal(loaded.decision_function(SAMPLES),
+                                  forest.decision_function(SAMPLES))
+    np.testing.assert_array_equal(loaded.predict(SAMPLES),
+                                  forest.predict(SAMPLES))
+
+
+def test_model_path_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv(config.MODEL_PATH_VAR, raising=False)
+    assert config.model_path() == config.DEFAULT_MODEL_PATH
+
+    monkeypatch.setenv(config.MODEL_PATH_VAR, str(tmp_path))
+    assert config.model_path() == tmp_path
+
+
+def test_registry_serves_latest_version(forest, tmp_path):
+    forest.save(tmp_path / 'v1.forest')
+    (tmp_path / 'notes.txt').write_text('not a model')
+
+    registry = ModelRegistry(tmp_path, config.FOREST_SCORING)
+    assert registry.version() is None
+    assert registry.get().version == 'v1'
+
+    assert not registry.reload()
+    assert registry.get().version == 'v1'
+
+
+def test_registry_swaps_in_new_version(forest, tmp_path):
+    forest.save(tmp_path / 'v1.forest')
+    registry = ModelRegistry(tmp_path, config.FOREST_SCORING)
+    old = registry.get()
+
+    forest.save(tmp_path / 'v2.forest')
+    assert registry.version() == 'v1'
+    assert registry.reload()
+
+    new = registry.get()
+    assert new is not old
+    assert new.version == 'v2'
+    np.testing.assert_array_equal(new.scorer.predict(SAMPLES),
+                                  old.scorer.predict(SAMPLES))
+
+
+def test_registry_watches_model_dir(forest, tmp_path):
+    forest.save(tmp_path / 'v1.forest')
+    registry = ModelRegistry(tmp_path, config.FOREST_SCORING,
+                             poll_interval=0.01)
+    registry.warm_up()
+    registry.start()
+    try:
+        forest.save(tmp_path / 'v2.forest')
+        for _ in range(500):
+            if registry.version() == 'v2':
+                break
+            time.sleep(0.01)
+        assert registry.version() == 'v2'
+    finally:
+        registry.stop()
+
+
+def test_empty_registry(tmp_path):
+    registry = ModelRegistry(tmp_path, config.FOREST_SCORING)
+
+    assert not registry.reload()
+    with pytest.raises(FileNotFoundError):
+        registry.get()
@@ -0,0 +1,101 @@
+from threading import Event
+
+import pytest
+
+from anomaly_detection.pipeline import NotificationPipeline, QueueFullError
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+def machines(*nids: int) -> [dict]:
+    return [{'id': str(n), 'type': 'Machine'} for n in nids]
+
+
+def ctx(service: str, correlator: str = None) -> FiwareContext:
+    return FiwareContext(service=service, correlator=correlator)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, ctx: FiwareContext, ms: [dict]):
+        self.batches.append((ctx.service, [m['id'] for m in ms]))
+
+
+def ids(*nids: int) -> [str]:
+    return [m['id'] for m in machines(*nids)]
+
+
+def test_processes_everything_before_stopping():
+    handler = Recorder()
+    pipeline = NotificationPipeline(handler, workers_n=2)
+    pipeline.start()
+    for k in range(10):
+        pipeline.submit(ctx('s'), machines(k))
+    pipeline.stop()
+
+    got = sorted(mid for _, batch in handler.batches for mid in batch)
+    assert got == sorted(ids(*range(10)))
+    assert pipeline.stats()['submitted'] == 10
+    assert pipeline.stats()['depth'] == 0
+
+
+def test_batches_queued_notifications_by_context():
+    handler = Recorder()
+    pipeline = NotificationPipeline(handler, workers_n=1, batch_size=10)
+    pipeline.submit(ctx('s', 'c1'), machines(1))
+    pipeline.submit(ctx('t'), machines(2))
+    pipeline.submit(ctx('s', 'c2'), machines(3, 4))
+    assert pipeline.depth() == 3
+
+    pipeline.start()
+    pipeline.stop()
+
+    assert handler.batches == [('s', ids(1, 3, 4)), ('t', ids(2))]
+    assert pipeline.stats()['processed'] == 2
+
+
+def test_batch_size_caps_batches():
+    handler = Recorder()
+    pipeline = NotificationPipeline(handler, workers_n=1, batch_size=2)
+    for k in range(5):
+        pipeline.submit(ctx('s'), machines(k))
+
+    pipeline.start()
+    pipeline.stop()
+
+    assert [len(b) for _, b in handler.batches] == [2, 2, 1]
+
+
+def test_rejects_work_when_full():
+    pipeline = NotificationPipeline(Recorder(), max_size=2)
+    pipeline.submit(ctx('s'), machines(1))
+    pipeline.submit(ctx('s'), machines(2))
+
+    with pytest.raises(QueueFullError):
+        pipeline.submit(ctx('s'), machines(3))
+
+    stats = pipeline.stats()
+    assert stats['depth'] == 2
+    assert stats['capacity'] == 2
+    assert stats['rejected'] == 1
+
+
+def test_handler_failures_dont_kill_workers():
+    done = Event()
+
+    def handler(c: FiwareContext, ms: [dict]):
+        if c.service == 'boom':
+            raise ValueError()
+        done.set()
+
+    pipeline = NotificationPipeline(handler, workers_n=1, batch_size=1)
+    pipeline.start()
+    pipeline.submit(ctx('boom'), machines(1))
+    pipeline.submit(ctx('s'), machines(2))
+    pipeline.stop()
+
+    assert done.is_set()
+    assert pipeline.stats()['failed'] == 1
+    assert pipeline.stats()['processed'] == 1
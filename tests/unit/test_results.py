@@ -0,0 +1,117 @@
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.features import FeatureSpec
+from anomaly_detection.results import ResultCache
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+CSIC = FiwareContext(service='csic', service_path=None, correlator=None)
+OTHER = FiwareContext(service='other', service_path=None, correlator=None)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def batch(*readings: tuple) -> MachineBatch:
+    return MachineBatch.from_raw_readings(
+        [{'Joules': j, 'Datetime': d} for _, j, d in readings],
+        ids=[eid for eid, _, _ in readings])
+
+
+def handle(cache: ResultCache, ctx: FiwareContext, readings: MachineBatch,
+           spec: FeatureSpec = None) -> MachineBatch:
+    fresh = cache.drop_seen(ctx, readings, spec)
+    cache.remember(ctx, fresh, spec)
+    return fresh
+
+
+def test_drop_repeated_readings():
+    cache = ResultCache()
+    handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m2', 6.0, 't1')))
+
+    fresh = handle(cache, CSIC, batch(
+        ('m1', 7.0, 't1'), ('m2', 6.0, 't2'), ('m3', 6.0, 't1'),
+        ('m1', 8.0, 't1'), ('m1', 8.0, 't1')))
+
+    assert fresh.ids == ['m2', 'm3', 'm1']
+    assert fresh.numeric('Joules').tolist() == [6.0, 6.0, 8.0]
+    assert cache.stats() == {'size': 3, 'hits': 2, 'misses': 5,
+                             'evicted': 0}
+
+
+def test_only_remember_handled_readings():
+    cache = ResultCache()
+    readings = batch(('m1', 7.0, 't1'))
+    cache.drop_seen(CSIC, readings)
+
+    assert len(cache.drop_seen(CSIC, readings)) == 1
+    cache.remember(CSIC, readings)
+    assert len(cache.drop_seen(CSIC, readings)) == 0
+
+
+def test_fingerprint_all_model_inputs():
+    cache = ResultCache()
+    spec = FeatureSpec.parse_obj({
+        'numeric': [{'name': 'Joules'}, {'name': 'Charge'}],
+        'categorical': [{'name': 'Face', 'categories': ['1st']}]})
+
+    def reading(charge: float, face: str) -> MachineBatch:
+        return MachineBatch.from_raw_readings(
+            [{'Joules': 7.0, 'Charge': charge, 'Face': face,
+              'Datetime': 't1'}], ids=['m1'])
+
+    handle(cache, CSIC, reading(1.0, '1st'), spec)
+    assert len(handle(cache, CSIC, reading(1.0, '1st'), spec)) == 0
+    assert len(handle(cache, CSIC, reading(2.0, '1st'), spec)) == 1
+    assert len(handle(cache, CSIC, reading(2.0, '2nd'), spec)) == 1
+    assert len(handle(cache, CSIC, reading(2.0, '2nd'))) == 1
+
+
+def test_tenants_dont_share_readings():
+    cache = ResultCache()
+    handle(cache, CSIC, batch(('m1', 7.0, 't1')))
+
+    assert len(handle(cache, OTHER, batch(('m1', 7.0, 't1')))) == 1
+
+
+def test_missing_readings_are_fingerprinted_too():
+    cache = ResultCache()
+    readings = MachineBatch.from_raw_readings([{}], ids=['m1'])
+    handle(cache, CSIC, readings)
+
+    assert len(handle(cache, CSIC, readings)) == 0
+
+
+def test_readings_expire():
+    clock = Clock()
+    cache = ResultCache(ttl=10, clock=clock)
+    handle(cache, CSIC, batch(('m1', 7.0, 't1')))
+
+    clock.now = 9
+    assert len(handle(cache, CSIC, batch(('m1', 7.0, 't1')))) == 0
+    clock.now = 10
+    assert len(handle(cache, CSIC, batch(('m1', 7.0, 't1')))) == 1
+
+
+def test_evict_least_recently_seen():
+    cache = ResultCache(capacity=2)
+    handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m2', 7.0, 't1')))
+    handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m3', 7.0, 't1')))
+
+    fresh = handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m2', 7.0, 't1')))
+    assert fresh.ids == ['m2']
+    assert cache.stats()['evicted'] == 2
+
+
+def test_forget():
+    cache = ResultCache()
+    handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m2', 7.0, 't1')))
+    cache.forget(CSIC, ['m1'])
+
+    fresh = handle(cache, CSIC, batch(('m1', 7.0, 't1'), ('m2', 7.0, 't1')))
+    assert fresh.ids == ['m1']
@@ -0,0 +1,73 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from anomaly_detection.iforest import CompiledForest
+from anomaly_detection.ttable import ThresholdTable
+
+
+@pytest.fixture(scope='module')
+def model():
+    with open('data/anomaly_detection.pkl', 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def forest(model) -> CompiledForest:
+    return CompiledForest.from_model(model)
+
+
+@pytest.fixture(scope='module')
+def table(forest) -> ThresholdTable:
+    return ThresholdTable.from_forest(forest)
+
+
+@pytest.fixture(scope='module')
+def samples() -> np.ndarray:
+    data = np.load('data/data.npz')
+    readings = np.concatenate([data['train'][:, 0], data['test'][:, 0]])
+    return readings.reshape(-1, 1)
+
+
+def test_table_is_exact_on_dataset(model, table, samples):
+    want = model.predict(samples)
+    got = table.predict(samples)
+
+    np.testing.assert_array_equal(got, want)
+
+
+def test_table_scores_match_forest(forest, table, samples):
+    want = forest.decision_function(samples)
+    got = table.decision_function(samples)
+
+    np.testing.assert_array_equal(got, want)
+
+
+def test_table_is_exact_at_split_points(forest, table):
+    s = table.splits.astype(np.float32)
+    edges = np.concatenate([s, np.nextafter(s, np.float32(np.inf)),
+                            np.nextafter(s, np.float32(-np.inf)),
+                            [-1e9, 1e9]]).reshape(-1, 1)
+
+    want = forest.decision_function(edges)
+    got = table.decision_function(edges)
+
+    np.testing.assert_array_equal(got, want)
+
+
+def test_table_accepts_flat_input(table):
+    got = table.predict(np.array([7.0, -3.0]))
+    np.testing.assert_array_equal(got, [0, 1])
+
+
+def test_cannot_tabulate_multi_feature_forest(forest):
+    two_features = CompiledForest(
+        roots=forest.roots, feature=forest.feature,
+        threshold=forest.threshold, left=forest.left, right=forest.right,
+        path_length=forest.path_length, max_depth=forest.max_depth,
+        n_features=2, max_samples=forest.max_samples, offset=forest.offset,
+        label_threshold=forest.label_threshold)
+
+    with pytest.raises(ValueError):
+        ThresholdTable.from_forest(two_features)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from anomaly_detection.batch import MachineBatch
+from anomaly_detection.util.ngsi.headers import FiwareContext
+from anomaly_detection.windows import MachineWindows
+
+
+def reference_features(history: [float], size: int, alpha: float) -> [float]:
+    xs = [x for x in history if not np.isnan(x)]
+    if not xs:
+        return [np.nan] * 4
+    window = xs[-size:]
+    ewma = xs[0]
+    for x in xs[1:]:
+        ewma = alpha * x + (1 - alpha) * ewma
+    current = history[-1]
+    delta = current - xs[-2] if not np.isnan(current) and len(xs) > 1 \
+        else np.nan
+    return [np.mean(window), np.var(window), ewma, delta]
+
+
+def test_matches_recomputing_from_history():
+    rng = np.random.default_rng(1)
+    ws = MachineWindows(capacity=10, size=4, alpha=0.3, attrs=['a', 'b'])
+    history = {}
+    for _ in range(30):
+        keys = list(rng.choice(['m1', 'm2', 'm3'], size=5))
+        values = rng.normal(50, 10, size=(5, 2))
+        values[rng.random((5, 2)) < 0.2] = np.nan
+
+        got = ws.update(keys, values)
+
+        for k, key in enumerate(keys):
+            for j in range(2):
+                history.setdefault((key, j), []).append(values[k, j])
+                want = reference_features(history[(key, j)], 4, 0.3)
+                np.testing.assert_allclose(got[k, j * 4:(j + 1) * 4], want)
+
+
+def test_evict_least_recently_used():
+    ws = MachineWindows(capacity=2, size=3, attrs=['a'])
+    ws.update(['m1', 'm2'], np.array([[1.0], [2.0]]))
+    ws.update(['m1'], np.array([[3.0]]))
+    ws.update(['m3'], np.array([[4.0]]))
+
+    assert len(ws) == 2
+    assert ws.evicted() == 1
+
+    xs = ws.update(['m2', 'm1'], np.array([[6.0], [5.0]]))
+    assert xs[0].tolist()[:2] == [6.0, 0.0]
+    assert xs[1, 0] == 5.0
+    assert ws.evicted() == 3
+
+
+def test_more_machines_than_capacity():
+    ws = MachineWindows(capacity=2, size=3, attrs=['a'])
+    xs = ws.update(['m1', 'm2', 'm3', 'm1'], np.array([[1.], [2.], [3.], [4.]]))
+
+    assert xs[:, 0].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_annotate_batch():
+    ws = MachineWindows(capacity=10, size=3, attrs=['Joules'])
+    csic = FiwareContext(service='csic', service_path=None, correlator=None)
+    other = FiwareContext(service='other', service_path=None, correlator=None)
+
+    ws.annotate(MachineBatch.from_raw_readings(
+        [{'Joules': 2.0}], ids=['m1']), csic)
+    batch = MachineBatch.from_raw_readings(
+        [{'Joules': 4.0}, {'Joules': 1.0}, {'Joules': 5.0}],
+        ids=['m1', None, 'm1'])
+    ws.annotate(batch, csic)
+
+    np.testing.assert_allclose(batch.numeric('Joules_mean'),
+                               [3.0, np.nan, 11 / 3])
+    np.testing.assert_allclose(batch.numeric('Joules_delta'),
+                               [2.0, np.nan, 1.0])
+
+    batch = MachineBatch.from_raw_readings([{'Joules': 7.0}], ids=['m1'])
+    ws.annotate(batch, other)
+    assert batch.numeric('Joules_mean').tolist() == [7.0]
+
+
+def test_skip_late_readings():
+    ws = MachineWindows(capacity=10, size=3, attrs=['a'])
+    ws.update(['m1'], np.array([[1.0]]), np.array([10.0]))
+    ws.update(['m1'], np.array([[3.0]]), np.array([30.0]))
+    xs = ws.update(['m1', 'm1'], np.array([[2.0], [5.0]]),
+                   np.array([20.0, np.nan]))
+
+    np.testing.assert_allclose(xs[0], [2.0, 1.0, 1.4, np.nan])
+    assert xs[1, 3] == 2.0
+    assert ws.late() == 1
+
+
+def test_annotate_in_time_order():
+    ws = MachineWindows(capacity=10, size=3, attrs=['Joules'])
+    ctx = FiwareContext(service='csic', service_path=None, correlator=None)
+
+    newer = MachineBatch.from_raw_readings(
+        [{'Joules': 4.0, 'Datetime': '2022-06-08 00:00:02'},
+         {'Joules': 2.0, 'Datetime': '2022-06-08 00:00:01'}],
+        ids=['m1', 'm1'])
+    ws.annotate(newer, ctx)
+    np.testing.assert_allclose(newer.numeric('Joules_delta'), [2.0, np.nan])
+
+    older = MachineBatch.from_raw_readings(
+        [{'Joules': 1.0, 'Datetime': '2022-06-08 00:00:00'}], ids=['m1'])
+    ws.annotate(older, ctx)
+    assert older.numeric('Joules_mean').tolist() == [3.0]
+    assert ws.late() == 1
+
+
+@pytest.mark.parametrize('kwargs', [{'capacity': 0}, {'size': 0},
+                                    {'alpha': 0}, {'alpha': 1.5}])
+def test_reject_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        MachineWindows(**kwargs)
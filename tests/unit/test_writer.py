@@ -0,0 +1,220 @@
+import pytest
+from requests import HTTPError, Response
+
+from anomaly_detection.ngsy import AnomalyDetectionEntity
+from anomaly_detection.util.ngsi.entity import FloatAttr
+from anomaly_detection.util.ngsi.headers import FiwareContext
+from anomaly_detection.writer import CLOSED, HALF_OPEN, OPEN, \
+    CircuitBreaker, OrionWriter, SpillBuffer
+
+
+CTX = FiwareContext(service='csic', service_path=None, correlator=None)
+OTHER = FiwareContext(service='other', service_path=None, correlator=None)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Sink:
+
+    def __init__(self):
+        self.down = False
+        self.bad_ids = set()
+        self.writes = []
+
+    def __call__(self, ctx, estimates):
+        if self.down:
+            raise ConnectionError('orion down')
+        if any(e.id in self.bad_ids for e in estimates):
+            response = Response()
+            response.status_code = 400
+            raise HTTPError('bad request', response=response)
+        self.writes.append((ctx.service, [e.id for e in estimates]))
+
+
+def estimates(*ids: str, label: float = 0) -> [AnomalyDetectionEntity]:
+    return [AnomalyDetectionEntity(id=i, Label=FloatAttr.new(label))
+            for i in ids]
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def sink() -> Sink:
+    return Sink()
+
+
+def new_writer(sink: Sink, clock: Clock, **kwargs) -> OrionWriter:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                             clock=clock)
+    kwargs.setdefault('sleep', lambda secs: None)
+    return OrionWriter(sink, breaker=breaker, retries=1, **kwargs)
+
+
+def test_breaker_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                             clock=clock)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED
+
+
+def test_breaker_gets_unused_trial_back(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10,
+                             clock=clock)
+    breaker.failure()
+    clock.now = 10
+    assert breaker.allow()
+
+    breaker.release()
+    assert breaker.state == OPEN
+    assert breaker.allow() and breaker.state == HALF_OPEN
+
+
+def test_retry_with_jittered_backoff(sink, clock):
+    attempts = []
+
+    def flaky(ctx, es):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('orion hiccup')
+        sink(ctx, es)
+
+    delays = []
+    writer = OrionWriter(flaky, retries=3, backoff=0.2,
+                         breaker=CircuitBreaker(clock=clock),
+                         sleep=delays.append, rng=lambda: 0.5)
+    writer.write(CTX, estimates('1'))
+
+    assert sink.writes == [('csic', ['1'])]
+    assert delays == [0.1, 0.2]
+    assert writer.stats()['retries'] == 2
+
+
+def test_spill_while_orion_is_down_then_replay(sink, clock):
+    writer = new_writer(sink, clock, replay_batch=2)
+    sink.down = True
+
+    writer.write(CTX, estimates('1', '2'))
+    assert writer.breaker.state == OPEN
+    writer.write(CTX, estimates('3'))
+    writer.write(OTHER, estimates('1'))
+    writer.write(CTX, estimates('1', label=1))
+    assert writer.spilled() == 4
+    assert writer.replay() == 0
+    assert writer.stats()['spilled'] == 5
+
+    sink.down = False
+    clock.now = 10
+    assert writer.replay() == 4
+    assert sink.writes == [('csic', ['1', '2']), ('csic', ['3']),
+                           ('other', ['1'])]
+    assert writer.breaker.state == CLOSED
+
+    writer.write(CTX, estimates('4'))
+    assert sink.writes[-1] == ('csic', ['4'])
+
+
+def test_failed_replay_puts_estimates_back(sink, clock):
+    writer = new_writer(sink, clock)
+    sink.down = True
+    writer.write(CTX, estimates('1', '2'))
+
+    clock.now = 10
+    assert writer.replay() == 0
+    assert writer.spilled() == 2
+    assert writer.stats()['spilled'] == 2
+    assert writer.breaker.state == OPEN
+
+
+def test_drop_rejected_estimates(sink, clock):
+    dropped = []
+    writer = new_writer(sink, clock, replay_batch=1,
+                        on_drop=lambda ctx, es: dropped.extend(
+                            e.id for e in es))
+    sink.bad_ids = {'1'}
+
+    writer.write(CTX, estimates('1'))
+    assert dropped == ['1'] and writer.spilled() == 0
+    assert writer.breaker.state == CLOSED
+
+    sink.down = True
+    writer.write(CTX, estimates('2', '1'))
+    sink.down = False
+    sink.bad_ids = {'2'}
+    clock.now = 10
+    assert writer.replay() == 1
+    assert sink.writes == [('csic', ['1'])]
+    assert dropped == ['1', '2'] and writer.spilled() == 0
+    assert writer.stats()['rejections'] == 2
+
+
+def test_new_estimates_queue_behind_spilled_ones(sink, clock):
+    writer = new_writer(sink, clock)
+    sink.down = True
+    writer.write(CTX, estimates('1', '2'))
+    sink.down = False
+
+    writer.write(CTX, estimates('3'))
+
+    assert sink.writes == []
+    assert writer.spilled() == 3
+
+
+def test_drop_oldest_estimates_when_spill_is_full(sink, clock):
+    dropped = []
+    writer = new_writer(sink, clock, spill_size=3,
+                        on_drop=lambda ctx, es: dropped.extend(
+                            (ctx.service, e.id) for e in es))
+    sink.down = True
+
+    writer.write(CTX, estimates('1', '2'))
+    writer.write(OTHER, estimates('1', '2'))
+
+    assert dropped == [('csic', '1')]
+    assert writer.spilled() == 3
+
+    writer.stop()
+    assert writer.spilled() == 0
+    assert len(dropped) == 4
+    assert writer.stats()['dropped'] == 4
+
+
+def test_spill_buffer_keeps_latest_estimate():
+    spill = SpillBuffer(capacity=10)
+    spill.add(CTX, estimates('1', '2'))
+    spill.add(CTX, estimates('1', label=1))
+
+    ctx, es = spill.take(10)
+    assert [(e.id, e.Label.value) for e in es] == [('1', 1), ('2', 0)]
+    assert spill.take(10) is None
+
+
+def test_spill_buffer_put_back_keeps_newer_estimates():
+    spill = SpillBuffer(capacity=10)
+    spill.add(CTX, estimates('1', label=1))
+    spill.add(CTX, estimates('1', '2'), keep_newer=True)
+
+    ctx, es = spill.take(10)
+    assert [(e.id, e.Label.value) for e in es] == [('1', 1), ('2', 0)]
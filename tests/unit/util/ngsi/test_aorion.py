@@ -0,0 +1,138 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+
+import pytest
+from httpx import HTTPStatusError
+from uri import URI
+
+from anomaly_detection.ngsy import MachineEntity
+from anomaly_detection.util.http.ajclient import AsyncJsonClient
+from anomaly_detection.util.ngsi.aorion import AsyncOrionClient
+from anomaly_detection.util.ngsi.entity import FloatAttr
+from anomaly_detection.util.ngsi.headers import FiwareContext
+
+
+ENTITIES = [{'id': '1', 'type': 'Machine',
+             'Joules': {'type': 'Number', 'value': 1.5}},
+            {'id': '2', 'type': 'Machine'}]
+
+
+class StubOrion(BaseHTTPRequestHandler):
+
+    requests = []
+
+    def _reply(self, status: int, body=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _record(self):
+        size = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(size)) if size else None
+        self.requests.append((self.command, self.path,
+                              self.headers.get('fiware-service'), body))
+
+    def do_GET(self):
+        self._record()
+        if self.path.startswith('/v2/entities'):
+            self._reply(200, ENTITIES)
+        elif self.path == '/v2/subscriptions':
+            self._reply(200, [{'id': 'sub1'}])
+        else:
+            self._reply(404, {'error': 'NotFound'})
+
+    def do_POST(self):
+        self._record()
+        self._reply(204)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def orion_url() -> URI:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOrion)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield URI(f"http://127.0.0.1:{server.server_port}")
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def clear_requests():
+    StubOrion.requests.clear()
+
+
+def run(action):
+    async def with_client():
+        http = AsyncJsonClient(max_connections=4)
+        try:
+            return await action(http)
+        finally:
+            await http.close()
+    return asyncio.run(with_client())
+
+
+def orion(url: URI, http: AsyncJsonClient) -> AsyncOrionClient:
+    return AsyncOrionClient(url, FiwareContext(service='csic'), http)
+
+
+def test_upsert_entities(orion_url):
+    m = MachineEntity(id='1', Joules=FloatAttr.new(1.5))
+    run(lambda http: orion(orion_url, http).upsert_entities([m]))
+
+    method, path, service, body = StubOrion.requests[0]
+    assert (method, path, service) == ('POST', '/v2/op/update', 'csic')
+    assert body['actionType'] == 'append'
+    assert body['entities'][0]['Joules'] == {'type': 'Number', 'value': 1.5}
+
+
+def test_upsert_entity(orion_url):
+    m = MachineEntity(id='1')
+    run(lambda http: orion(orion_url, http).upsert_entity(m))
+
+    method, path, _, body = StubOrion.requests[0]
+    assert (method, path) == ('POST', '/v2/entities?options=upsert')
+    assert body['id'] == '1'
+
+
+def test_list_entities_of_type(orion_url):
+    like = MachineEntity(id='')
+    ms = run(lambda http: orion(orion_url, http).list_entities_of_type(like))
+
+    assert [m.id for m in ms] == ['1', '2']
+    assert ms[0].Joules.value == 1.5
+    assert StubOrion.requests[0][1] == '/v2/entities?type=Machine'
+
+
+def test_subscriptions(orion_url):
+    async def subscribe_and_list(http):
+        client = orion(orion_url, http)
+        await client.subscribe({'description': 'test'})
+        return await client.list_subscriptions()
+
+    subs = run(subscribe_and_list)
+
+    assert subs == [{'id': 'sub1'}]
+    assert StubOrion.requests[0][3] == {'description': 'test'}
+
+
+def test_concurrent_upserts(orion_url):
+    async def upsert_many(http):
+        client = orion(orion_url, http)
+        ms = [MachineEntity(id=str(k)) for k in range(50)]
+        await asyncio.gather(*[client.upsert_entity(m) for m in ms])
+
+    run(upsert_many)
+
+    ids = sorted(int(r[3]['id']) for r in StubOrion.requests)
+    assert ids == list(range(50))
+
+
+def test_raise_on_error(orion_url):
+    with pytest.raises(HTTPStatusError):
+        run(lambda http: http.get(f"{orion_url}nope"))
@@ -0,0 +1,64 @@
+import json
+
+from anomaly_detection.ngsy import AnomalyDetectionEntity, MachineEntity
+from anomaly_detection.util.ngsi.entity import OWN_ENTITY_TYPES, \
+    EntitiesUpsert, EntityUpdateNotification, FloatAttr, TextAttr, \
+    attr_values, entities_upsert_json, filter_raw_entities
+
+
+DATA = [
+    {'id': '1', 'type': 'Machine', 'Joules': {'value': 1.1}},
+    {'id': '2', 'type': 'NotMe', 'Joules': {'value': 2.2}},
+    'garbage',
+    {'id': '3', 'type': 'Machine', 'Joules': {'type': 'Number', 'value': 3}},
+    {'id': '4', 'type': 'Machine', 'Joules': 4.4},
+    {'id': '5', 'type': 'Machine'}
+]
+
+
+def test_entity_type():
+    assert MachineEntity.entity_type() == 'Machine'
+
+
+def test_filter_raw_entities():
+    got = filter_raw_entities(DATA, 'Machine')
+    assert [e['id'] for e in got] == ['1', '3', '4', '5']
+
+
+def test_never_keep_own_entities():
+    data = [{'id': '1', 'type': 'Machine'},
+            {'id': '2', 'type': 'AnomalyDetection'},
+            {'id': '3', 'type': 'Machine'}]
+    own_type = AnomalyDetectionEntity.entity_type()
+
+    assert own_type in OWN_ENTITY_TYPES
+    assert [e['id'] for e in filter_raw_entities(data, 'Machine')] == \
+        ['1', '3']
+    assert filter_raw_entities(data, own_type) == []
+    assert EntityUpdateNotification(data=data) \
+        .filter_entities(AnomalyDetectionEntity) == []
+
+
+def test_attr_values():
+    got = attr_values(filter_raw_entities(DATA, 'Machine'), 'Joules')
+
+    assert got[:2].tolist() == [1.1, 3.0]
+    assert all(x != x for x in got[2:])
+
+
+def test_filter_entities():
+    notification = EntityUpdateNotification(data=DATA[:2] + DATA[3:4])
+    got = notification.filter_entities(MachineEntity)
+
+    assert [m.id for m in got] == ['1', '3']
+    assert [m.Joules.value for m in got] == [1.1, 3.0]
+
+
+def test_entities_upsert_json():
+    es = [AnomalyDetectionEntity(id='1', Label=FloatAttr.new(1),
+                                 ModelVersion=TextAttr.new('v1')),
+          AnomalyDetectionEntity(id='2', Label=FloatAttr.new(0.0))]
+    want = EntitiesUpsert(entities=es).dict(exclude_none=True)
+    got = json.loads(entities_upsert_json(es))
+
+    assert want == got
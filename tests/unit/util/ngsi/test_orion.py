@@ -0,0 +1,63 @@
+from uri import URI
+
+from anomaly_detection.util.ngsi.headers import FiwareContext
+from anomaly_detection.util.ngsi.orion import OrionClientCache
+
+
+ORION_1 = URI('http://orion1:1026')
+ORION_2 = URI('http://orion2:1026')
+
+
+def ctx(service: str, path: str = None, correlator: str = None) \
+        -> FiwareContext:
+    return FiwareContext(service=service, service_path=path,
+                         correlator=correlator)
+
+
+def test_reuse_clients_for_same_orion_and_context():
+    cache = OrionClientCache()
+    c1 = cache.get(ORION_1, ctx('s', '/p', 'c1'))
+    c2 = cache.get(URI('http://orion1:1026'), ctx('s', '/p', 'c2'))
+
+    assert c1 is c2
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'clients': 1,
+                             'pools': 1}
+
+
+def test_separate_clients_for_each_context():
+    cache = OrionClientCache()
+    clients = [cache.get(ORION_1, ctx('s')),
+               cache.get(ORION_1, ctx('s', '/p')),
+               cache.get(ORION_1, ctx('t')),
+               cache.get(ORION_2, ctx('s'))]
+
+    assert len({id(c) for c in clients}) == 4
+    assert cache.stats() == {'hits': 0, 'misses': 4, 'clients': 4,
+                             'pools': 2}
+
+
+def test_clients_share_connection_pool_per_orion():
+    cache = OrionClientCache()
+    c1 = cache.get(ORION_1, ctx('s'))
+    c2 = cache.get(ORION_1, ctx('t'))
+    c3 = cache.get(ORION_2, ctx('s'))
+
+    assert c1._http is c2._http
+    assert c1._http is not c3._http
+
+
+def test_cached_clients_drop_correlator():
+    cache = OrionClientCache()
+    client = cache.get(ORION_1, ctx('s', '/p', 'c'))
+
+    assert {h.value() for h in client._ctx.headers()} == {'s', '/p'}
+
+
+def test_close_empties_cache():
+    cache = OrionClientCache()
+    c1 = cache.get(ORION_1, ctx('s'))
+    cache.close()
+    c2 = cache.get(ORION_1, ctx('s'))
+
+    assert c1 is not c2
+    assert cache.stats()['clients'] == 1
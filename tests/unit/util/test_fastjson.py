@@ -0,0 +1,19 @@
+import json
+
+from anomaly_detection.util import fastjson
+
+
+DATA = {'actionType': 'append',
+        'entities': [{'id': 'ü', 'Label': {'type': 'Number', 'value': 1.5}}]}
+
+
+def test_compact_utf8():
+    want = json.dumps(DATA, separators=(',', ':'), ensure_ascii=False)
+    assert fastjson.dumps(DATA) == want.encode('utf-8')
+
+
+def test_stdlib_fallback(monkeypatch):
+    fast = fastjson.dumps(DATA)
+    monkeypatch.setattr(fastjson, 'orjson', None)
+
+    assert fastjson.dumps(DATA) == fast
@@ -0,0 +1,18 @@
+from anomaly_detection.util.http.jclient import JsonClient
+
+
+def test_pool_size():
+    client = JsonClient(pool_maxsize=3)
+    adapter = client._http.get_adapter('http://orion:1026')
+
+    assert adapter._pool_maxsize == 3
+
+
+def test_keep_alive_by_default():
+    client = JsonClient()
+    assert 'close' != client._http.headers.get('Connection')
+
+
+def test_no_keep_alive():
+    client = JsonClient(keep_alive=False)
+    assert 'close' == client._http.headers.get('Connection')
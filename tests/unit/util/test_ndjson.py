@@ -0,0 +1,55 @@
+import asyncio
+
+from anomaly_detection.util.ndjson import parse_lines, read_batches, \
+    read_lines
+
+
+async def stream(*chunks: bytes):
+    for c in chunks:
+        yield c
+
+
+def collect(agen) -> list:
+    async def run():
+        return [x async for x in agen]
+    return asyncio.run(run())
+
+
+def test_read_lines_across_chunks():
+    chunks = stream(b'{"a": 1}\n{"a"', b': 2}\n\n', b'  \n{"a": 3}')
+    got = collect(read_lines(chunks))
+
+    assert got == [b'{"a": 1}', b'{"a": 2}', b'{"a": 3}']
+
+
+def test_read_lines_with_crlf():
+    got = collect(read_lines(stream(b'1\r\n2\r\n')))
+    assert parse_lines(got) == [1, 2]
+
+
+def test_parse_lines():
+    assert parse_lines([b'{"a": 1}', b'2', b'null']) == [{'a': 1}, 2, None]
+
+
+def test_parse_lines_with_garbage():
+    assert parse_lines([b'1', b'{oops', b'3']) == [1, None, 3]
+
+
+def test_parse_lines_with_comma_separated_values():
+    assert parse_lines([b'1', b'2, 3', b'4']) == [1, None, 4]
+    assert parse_lines([b'1', b'2,', b'3']) == [1, None, 3]
+
+    got = parse_lines([b'{"Joules": 7}, {"Joules": 7}', b'{"Joules": -3}',
+                       b'[1', b'2]'])
+    assert got == [None, {'Joules': -3}, None, None]
+
+
+def test_read_batches():
+    chunks = stream(b'1\n2\n3\n', b'4\n5')
+    got = collect(read_batches(chunks, batch_size=2))
+
+    assert got == [[1, 2], [3, 4], [5]]
+
+
+def test_read_batches_of_empty_stream():
+    assert collect(read_batches(stream(b'', b'\n'), batch_size=2)) == []
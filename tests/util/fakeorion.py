@@ -0,0 +1,264 @@
+"""
+In-process fake of the Orion Context Broker.
+
+Covers the endpoints ``OrionClient`` uses---``/v2/entities``,
+``/v2/op/update`` and ``/v2/subscriptions``---well enough to test and
+benchmark the detector on one box without Docker. It plugs into the
+Orion clients as a ``requests`` transport adapter, so no sockets are
+involved:
+
+    orion = FakeOrion(latency=0.005, failure_rate=0.1, seed=1)
+    clients = OrionClientCache(transport=orion)
+
+Like the real thing, it keeps entities separate for each FIWARE service
+and, when entities change, notifies the subscribers whose subscription
+subject matches them. Notifications go out on a background thread
+through whatever ``requests`` session you give it, e.g. FastAPI's
+``TestClient`` to deliver them straight to the app.
+
+Every request gets recorded. Latency and failures are injected on
+request: a fixed delay plus optional random jitter, random failures at a
+given rate and scripted failures for the next few requests. Randomness
+comes from a seeded generator so runs are repeatable.
+"""
+
+import json
+from queue import Queue
+import random
+import re
+from threading import Lock, Thread
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+from requests import ConnectionError, PreparedRequest, Response, Session
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+UPDATE_OP_PATH = '/v2/op/update'
+ENTITIES_PATH = '/v2/entities'
+SUBSCRIPTIONS_PATH = '/v2/subscriptions'
+
+Tenant = Optional[str]
+
+
+class RecordedRequest:
+
+    def __init__(self, method: str, path: str, query: Dict[str, List[str]],
+                 service: Tenant, service_path: Optional[str],
+                 body: Optional[dict]):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.service = service
+        self.service_path = service_path
+        self.body = body
+        self.status: Optional[int] = None
+
+
+def _matches(subject: dict, entity: dict) -> bool:
+    for spec in subject.get('entities', []):
+        if 'id' in spec and spec['id'] != entity['id']:
+            continue
+        if 'idPattern' in spec and \
+                not re.fullmatch(spec['idPattern'], entity['id']):
+            continue
+        if 'type' in spec and spec['type'] != entity.get('type'):
+            continue
+        if 'typePattern' in spec and \
+                not re.fullmatch(spec['typePattern'], entity.get('type', '')):
+            continue
+        return True
+    return False
+
+
+class FakeOrion(BaseAdapter):
+    """
+    Fake Orion, usable as a ``requests`` transport adapter.
+    Safe to share among threads.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0,
+                 failure_status: Optional[int] = 500,
+                 notifier: Optional[Session] = None, seed: int = 0,
+                 record: bool = True):
+        """
+        Create a new instance.
+
+        :param latency: seconds to wait before replying to each request.
+        :param jitter: max random seconds to add to the latency.
+        :param failure_rate: fraction of requests to fail at random.
+        :param failure_status: HTTP status to fail requests with. If
+            ``None``, failing requests raise a connection error instead.
+        :param notifier: the session to POST notifications with. Defaults
+            to a plain ``requests`` session.
+        :param seed: seed for the latency jitter and random failures.
+        :param record: keep a log of the requests received?
+        """
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.record = record
+        self.requests: List[RecordedRequest] = []
+        self.upserted_n = 0
+
+        self._rng = random.Random(seed)
+        self._failures: List[Optional[int]] = []
+        self._entities: Dict[Tenant, Dict[str, dict]] = {}
+        self._subscriptions: Dict[Tenant, List[dict]] = {}
+        self._lock = Lock()
+
+        self.notifier = notifier if notifier is not None else Session()
+        self._notifications = Queue()
+        self._sender: Optional[Thread] = None
+
+    def fail_next(self, n: int = 1, status: Optional[int] = 500):
+        """
+        Fail the next requests.
+
+        :param n: how many requests to fail.
+        :param status: the HTTP status to reply with. ``None`` for a
+            connection error.
+        """
+        with self._lock:
+            self._failures.extend([status] * n)
+
+    def entities(self, service: Tenant = None) -> List[dict]:
+        """
+        :param service: the FIWARE service.
+        :return: the entities stored for that service.
+        """
+        with self._lock:
+            return list(self._entities.get(service, {}).values())
+
+    def drain(self):
+        """
+        Wait until all the notifications queued so far have been sent.
+        """
+        self._notifications.join()
+
+    def close(self):
+        if self._sender is not None:
+            self._notifications.put(None)
+            self._sender.join()
+            self._sender = None
+
+    def _failure(self) -> Tuple[bool, Optional[int]]:
+        with self._lock:
+            if self._failures:
+                return True, self._failures.pop(0)
+            if self.failure_rate and self._rng.random() < self.failure_rate:
+                return True, self.failure_status
+            delay = self.latency + self._rng.uniform(0, self.jitter) \
+                if self.jitter else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        return False, None
+    # NOTE. Latency and failures. We only wait on requests that succeed, so
+    # a failing Orion fails fast, same as when it refuses connections.
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        url = urlsplit(request.url)
+        body = json.loads(request.body) if request.body else None
+        service = request.headers.get('fiware-service')
+        recorded = RecordedRequest(
+            method=request.method, path=url.path,
+            query=parse_qs(url.query), service=service,
+            service_path=request.headers.get('fiware-servicepath'),
+            body=body)
+        if self.record:
+            with self._lock:
+                self.requests.append(recorded)
+
+        failed, status = self._failure()
+        if failed:
+            if status is None:
+                raise ConnectionError('injected connection failure',
+                                      request=request)
+            recorded.status = status
+            return self._reply(request, status, {'error': 'InjectedFailure'})
+
+        status, payload = self._handle(recorded)
+        recorded.status = status
+        return self._reply(request, status, payload)
+
+    def _handle(self, r: RecordedRequest) -> Tuple[int, Optional[object]]:
+        if r.path == UPDATE_OP_PATH and r.method == 'POST':
+            return self._upsert(r.service, r.body.get('entities', []))
+        if r.path == ENTITIES_PATH and r.method == 'POST':
+            return self._upsert(r.service, [r.body])
+        if r.path == ENTITIES_PATH and r.method == 'GET':
+            etype = r.query.get('type', [None])[0]
+            return 200, [e for e in self.entities(r.service)
+                         if etype is None or e.get('type') == etype]
+        if r.path == SUBSCRIPTIONS_PATH and r.method == 'POST':
+            sub = dict(r.body, id=uuid.uuid4().hex)
+            with self._lock:
+                self._subscriptions.setdefault(r.service, []).append(sub)
+            return 201, None
+        if r.path == SUBSCRIPTIONS_PATH and r.method == 'GET':
+            with self._lock:
+                return 200, list(self._subscriptions.get(r.service, []))
+        return 404, {'error': 'NotFound'}
+
+    def _upsert(self, service: Tenant, entities: List[dict]) \
+            -> Tuple[int, None]:
+        with self._lock:
+            store = self._entities.setdefault(service, {})
+            for e in entities:
+                store.setdefault(e['id'], {}).update(e)
+            self.upserted_n += len(entities)
+            subs = list(self._subscriptions.get(service, []))
+
+        for sub in subs:
+            data = [e for e in entities if _matches(sub['subject'], e)]
+            if data:
+                self._notify(service, sub, data)
+        return 204, None
+
+    def _notify(self, service: Tenant, sub: dict, data: List[dict]):
+        if self._sender is None:
+            with self._lock:
+                if self._sender is None:
+                    self._sender = Thread(target=self._send_notifications,
+                                          daemon=True, name='fake-orion')
+                    self._sender.start()
+        notification = {'subscriptionId': sub['id'], 'data': data}
+        self._notifications.put((sub['notification']['http']['url'],
+                                 service, notification))
+
+    def _send_notifications(self):
+        while True:
+            item = self._notifications.get()
+            if item is None:
+                self._notifications.task_done()
+                return
+            url, service, notification = item
+            headers = {'fiware-service': service} if service else {}
+            try:
+                self.notifier.post(url, json=notification, headers=headers)
+            except Exception:
+                pass
+            self._notifications.task_done()
+    # NOTE. Notifications. Orion doesn't care whether subscribers got the
+    # notification, so neither do we: delivery errors get swallowed.
+
+    @staticmethod
+    def _reply(request: PreparedRequest, status: int,
+               payload: Optional[object]) -> Response:
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict()
+        response._content = b''
+        if payload is not None:
+            response.headers['Content-Type'] = 'application/json'
+            response._content = json.dumps(payload).encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
@@ -13,11 +13,12 @@ ANOMALY_INTERNAL_BASE_URL = 'http://anomaly:8000'
 QUANTUMLEAP_INTERNAL_BASE_URL = 'http://quantumleap:8668'
 QUANTUMLEAP_EXTERNAL_BASE_URL = 'http://localhost:8668'
 ANOMALY_DETECTOR_SUB = {
-    "description": "Notify Anomaly Detector of changes to any entity.",
+    "description": "Notify Anomaly Detector of changes to machines.",
     "subject": {
         "entities": [
             {
-                "idPattern": ".*"
+                "idPattern": ".*",
+                "type": "Machine"
             }
         ]
     },
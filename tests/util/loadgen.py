@@ -0,0 +1,211 @@
+"""
+Open-loop load generator for the anomaly detection service.
+
+Fires NGSI notifications at ``/updates`` or raw readings at
+``/rawReading`` at a target rate, regardless of how fast the service
+responds, and reports the throughput achieved and latency percentiles.
+Arrivals are either evenly spaced or Poisson. Each notification carries
+a batch of machines, cycling through the given number of machines, so
+you can mimic a production line of a given size.
+
+Run from the repo root, e.g.
+
+    python -m tests.util.loadgen --url http://localhost:8000 \
+        --target updates --rate 200 --duration 30 --machines 500 \
+        --batch-size 20 --concurrency 16
+
+Latency is measured from the time each request was *meant* to go out,
+so if the service can't keep up, the time requests spend waiting for a
+free connection shows up in the percentiles rather than silently
+lowering the rate.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import random
+import sys
+from threading import Lock
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from anomaly_detection.util.http.jclient import JsonClient
+from anomaly_detection.util.ngsi.headers import FiwareServiceHeader
+from tests.util.sampler import MachineSampler
+
+
+UPDATES_TARGET = 'updates'
+RAW_READING_TARGET = 'raw'
+CONSTANT_ARRIVALS = 'constant'
+POISSON_ARRIVALS = 'poisson'
+PAYLOADS_N = 100
+
+
+def arrival_times(rate: float, duration: float, arrivals: str,
+                  rng: random.Random) -> Iterator[float]:
+    """
+    Generate send times, as offsets in seconds from the start of the run.
+
+    :param rate: mean number of requests per second.
+    :param duration: how many seconds to generate send times for.
+    :param arrivals: either evenly spaced or Poisson arrivals.
+    :param rng: random source for Poisson arrivals.
+    :return: the send times in increasing order.
+    """
+    t = 0.0
+    while True:
+        if arrivals == POISSON_ARRIVALS:
+            t += rng.expovariate(rate)
+        else:
+            t += 1.0 / rate
+        if t >= duration:
+            return
+        yield t
+
+
+def notification_bodies(sampler: MachineSampler, machines_n: int,
+                        batch_size: int) -> List[bytes]:
+    bodies, nid = [], 0
+    for _ in range(PAYLOADS_N):
+        ms = []
+        for _ in range(batch_size):
+            nid = nid % machines_n + 1
+            ms.append(sampler.new_machine_entity(nid).dict(exclude_none=True))
+        bodies.append(json.dumps({'data': ms}).encode('utf-8'))
+    return bodies
+
+
+def raw_reading_bodies(sampler: MachineSampler,
+                       machines_n: int) -> List[bytes]:
+    bodies = []
+    for k in range(PAYLOADS_N):
+        m = sampler.new_machine_entity(k % machines_n + 1)
+        reading = {name: attr['value']
+                   for name, attr in m.dict(exclude_none=True).items()
+                   if isinstance(attr, dict)}
+        bodies.append(json.dumps(reading).encode('utf-8'))
+    return bodies
+# NOTE. Payloads. Sampling machines is slow enough to cap the rate we can
+# generate at, so we build a fixed set of payloads upfront and cycle
+# through them.
+
+
+class LoadReport:
+
+    def __init__(self):
+        self._lock = Lock()
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+
+    def summary(self, elapsed: float, machines_per_request: int) -> dict:
+        n = len(self.latencies)
+        ok_n = n - self.errors
+        p50, p95, p99 = (np.percentile(self.latencies, [50, 95, 99]) * 1000
+                         if n else (float('nan'),) * 3)
+        return {
+            'requests': n,
+            'errors': self.errors,
+            'elapsed_secs': elapsed,
+            'requests_per_sec': ok_n / elapsed if elapsed else 0.0,
+            'machines_per_sec':
+                ok_n * machines_per_request / elapsed if elapsed else 0.0,
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99)
+        }
+
+
+def run(url: str, target: str, rate: float, duration: float,
+        arrivals: str, concurrency: int, machines_n: int, batch_size: int,
+        service: Optional[str], seed: int) -> dict:
+    """
+    Generate load and measure how the service copes.
+
+    :return: the run summary.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    sampler = MachineSampler(machines_n)
+
+    if target == UPDATES_TARGET:
+        endpoint = f"{url.rstrip('/')}/updates"
+        bodies = notification_bodies(sampler, machines_n, batch_size)
+        machines_per_request = batch_size
+    else:
+        endpoint = f"{url.rstrip('/')}/rawReading"
+        bodies = raw_reading_bodies(sampler, machines_n)
+        machines_per_request = 1
+    headers = [FiwareServiceHeader(service)] if service else None
+
+    http = JsonClient(timeout=30, pool_maxsize=concurrency)
+    report = LoadReport()
+
+    def send(body: bytes, due: float):
+        ok = True
+        try:
+            http.post_raw(url=endpoint, body=body, headers=headers)
+        except Exception:
+            ok = False
+        report.record(time.perf_counter() - due, ok)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for k, offset in enumerate(arrival_times(rate, duration, arrivals,
+                                                 rng)):
+            due = start + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, bodies[k % len(bodies)], due)
+    elapsed = time.perf_counter() - start
+    http.close()
+
+    return report.summary(elapsed, machines_per_request)
+# NOTE. Open loop. The main thread submits requests on schedule without
+# waiting for responses; a backed-up pool just queues them. Elapsed time
+# includes waiting for the last responses, so throughput is what the
+# service actually handled.
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:8000',
+                        help='base URL of the anomaly detection service')
+    parser.add_argument('--target', default=UPDATES_TARGET,
+                        choices=[UPDATES_TARGET, RAW_READING_TARGET])
+    parser.add_argument('--rate', type=float, default=50,
+                        help='requests per second')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to generate load for')
+    parser.add_argument('--arrivals', default=CONSTANT_ARRIVALS,
+                        choices=[CONSTANT_ARRIVALS, POISSON_ARRIVALS])
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='max requests in flight')
+    parser.add_argument('--machines', type=int, default=100,
+                        help='how many distinct machines to simulate')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help='machines in each notification')
+    parser.add_argument('--service', default='csic',
+                        help='FIWARE service to send notifications for')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    summary = run(url=args.url, target=args.target, rate=args.rate,
+                  duration=args.duration, arrivals=args.arrivals,
+                  concurrency=args.concurrency, machines_n=args.machines,
+                  batch_size=args.batch_size, service=args.service,
+                  seed=args.seed)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))